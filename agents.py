@@ -1,42 +1,51 @@
 # Import langchain
-from langchain_openai import ChatOpenAI
 from langchain.agents import AgentExecutor, create_openai_tools_agent
 from langchain_core.tools import Tool
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from typing import Dict, Any
+from langchain_core.runnables import Runnable
+from typing import Dict, Any, List, Optional, Tuple
 
 # Import state, prompts, tools 
 from state import AgentGraphState
-from prompts import router_prompt, investment_strategy_prompt, research_prompt, final_text_formatter, rag_caller_prompt, rag_caller_json
-from tools import get_stock_analysis, generate_rag_queries, set_openai_api_key
+from prompts import router_prompt, investment_strategy_prompt, research_prompt, final_text_formatter, rag_caller_prompt, rag_caller_json, single_pass_formatting, fused_router_prompt, fused_router_json, conversation_summary_prompt
+from tools import get_stock_analysis, aget_stock_analysis, generate_rag_queries, agenerate_rag_queries
+from llm_pool import get_chat_model
+from speculative import get_speculative_executor
+from router_classifier import get_local_router
+from answer_cache import cache_scope, cache_text, get_answer_cache
+from embedding_cache import create_embeddings
+from vector_store import get_backend
+from memory import format_message, get_compactor, get_memory, summary_key
+from metrics import span
 
 # Import json
 import json
 
 
 class Agent:
-    def __init__(self, state: AgentGraphState):
-        self.state = state
-        self.openai_api_key = state.get("api_key", "")
+    """Stateless base agent; all per-request data is read from and written to the graph state"""
+
+    def __init__(self) -> None:
         self.openai_version = "gpt-4o"
 
-    def get_llm(self) -> ChatOpenAI:
-        return ChatOpenAI(model=self.openai_version, openai_api_key=self.openai_api_key, temperature=0.6)
+    def get_llm(self, state: AgentGraphState, schema: Optional[Dict[str, Any]] = None) -> Runnable:
+        """Borrow a pooled client for this request's API key, optionally bound to a structured-output schema"""
+
+        return get_chat_model(state.get("api_key", ""), self.openai_version, 0.6, schema)
 
-    def update_state(self, key: str, value: Any) -> AgentGraphState:
-        self.state[key] = value
-        return self.state
+    def update_state(self, state: AgentGraphState, key: str, value: Any) -> AgentGraphState:
+        state[key] = value
+        return state
 
 class TradingAgent(Agent):
-    def __init__(self, state: AgentGraphState):
-        super().__init__(state)
-        
-        set_openai_api_key(self.openai_api_key)
+    def __init__(self) -> None:
+        super().__init__()
         
+        # Tools hold no per-request data, so they are built once and shared by every session
         self.market_research_tool = self._create_market_research_tool()
         self.rag_tool = self._create_rag_tool()
         
-        self.rag_caller_json = None
+        self.rag_caller_json = rag_caller_json
     
     def _create_market_research_tool(self) -> Tool:
         """Create a tool for market research using SerpAPI"""
@@ -44,7 +53,8 @@ class TradingAgent(Agent):
         return Tool(
             name="market_research",
             description="Useful for getting real-time information about stocks, market trends, company news, and financial data. Input should be a stock ticker symbol or a specific market research question.",
-            func=get_stock_analysis
+            func=get_stock_analysis,
+            coroutine=aget_stock_analysis
         )
     
     def _create_rag_tool(self) -> Tool:
@@ -53,121 +63,389 @@ class TradingAgent(Agent):
         return Tool(
             name="knowledge_base",
             description="Useful for retrieving historical information about investment strategies, market research, company performance, and financial concepts from the knowledge base. Input should be a specific question.",
-            func=generate_rag_queries
+            func=generate_rag_queries,
+            coroutine=agenerate_rag_queries
         )
     
-    def _format_chat_history(self) -> str:
+    def _format_chat_history(self, state: AgentGraphState) -> str:
         """Format the chat history as context for the agents"""
-        messages = self.state.get("messages", [])
+
+        # Rendered once per turn when the human message is added; agents called outside the graph render it here
+        if state.get("chat_context") is not None:
+            return state["chat_context"]
         
-        if not messages:
-            return "No previous conversation."
+        return get_memory().render(
+            state.get("messages", []),
+            state.get("conversation_summary", ""),
+            state.get("summarized_messages", 0)
+        )
+    
+    def _summary_messages(self, state: AgentGraphState, to_fold: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        memory = get_memory()
+        system_prompt = conversation_summary_prompt.format(
+            summary=state.get("conversation_summary") or "(none yet)",
+            messages="".join(format_message(msg) for msg in to_fold),
+            # Roughly 0.75 words per token
+            max_words=int(memory.summary_tokens * 0.75)
+        )
+        return [{"role": "system", "content": system_prompt}]
+    
+    def _apply_summary(self, state: AgentGraphState, summary: Optional[str], folded: int) -> AgentGraphState:
+        summarized = state.get("summarized_messages", 0) + folded
+        messages, summarized = get_memory().trim(state.get("messages", []), summarized)
         
-        formatted_history = "Previous conversation:\n"
- 
-        for msg in messages[-10:]:
-            role = "User" if msg["role"] == "user" else "Assistant"
-            formatted_history += f"{role}: {msg['content']}\n\n"
+        if summary is not None:
+            self.update_state(state, "conversation_summary", summary.strip())
+        self.update_state(state, "messages", messages)
+        return self.update_state(state, "summarized_messages", summarized)
+    
+    def _summarize(self, api_key: str, messages: List[Dict[str, str]]) -> str:
+        with span("llm.memory_summary"):
+            return self.get_llm(AgentGraphState(api_key=api_key)).invoke(messages).content
+    
+    def apply_memory_summary(self, state: AgentGraphState) -> AgentGraphState:
+        """Fold in the summary the previous turn started in the background, if it has finished"""
+
+        # The history is what the previous turn ended with, so this finds the same fold it started
+        to_fold = get_memory().to_summarize(state.get("messages", []), state.get("summarized_messages", 0))
+        if not to_fold:
+            return state
+        summary = get_compactor().result(summary_key(state.get("conversation_summary", ""), to_fold))
+        if summary is None:
+            # Still running: the window shows the recent messages and a later turn folds them in
+            return state
+        return self._apply_summary(state, summary, len(to_fold))
+    
+    def compact_memory_agent(self, state: AgentGraphState) -> AgentGraphState:
+        """Start folding messages that no longer fit the context window into the summary, in the background"""
+
+        # The summary call runs after the turn has returned; the next turn applies it
+        to_fold = get_memory().to_summarize(state.get("messages", []), state.get("summarized_messages", 0))
+        if to_fold:
+            get_compactor().start(
+                summary_key(state.get("conversation_summary", ""), to_fold),
+                self._summarize, state.get("api_key", ""), self._summary_messages(state, to_fold)
+            )
+        return self._apply_summary(state, None, 0)
+    
+    async def acompact_memory_agent(self, state: AgentGraphState) -> AgentGraphState:
+        """Async version of compact_memory_agent; starting the background summary never blocks the loop"""
+
+        return self.compact_memory_agent(state)
+    
+    def _answer_cache_text(self, state: AgentGraphState) -> str:
+        return cache_text(state["human_input"], state.get("messages", []))
+    
+    def _apply_answer_lookup(self, state: AgentGraphState, embedding: List[float], kb_version: Any) -> AgentGraphState:
+        # Scoped before this turn's answer and any compaction change the history
+        scope = cache_scope(state.get("api_key") or "", state.get("messages", []), state.get("conversation_summary", ""))
+        self.update_state(state, "answer_cache_embedding", embedding)
+        self.update_state(state, "answer_cache_scope", scope)
+        self.update_state(state, "kb_version", kb_version)
         
-        return formatted_history
+        cached = get_answer_cache().lookup(embedding, kb_version, scope)
+        if cached is None:
+            return self.update_state(state, "answer_cache_hit", False)
+        
+        answer, route, _ = cached
+        self.update_state(state, "router_response", route)
+        self.update_state(state, "formatted_response", answer)
+        self.update_state(state, "agent_response", answer)
+        self.update_state(state, "end_chain", "end_chain")
+        return self.update_state(state, "answer_cache_hit", True)
     
-    def router_agent(self) -> AgentGraphState:
-        """Router agent that determines which agent to use based on the user's query"""
- 
-        user_query = self.state["human_input"]
+    def answer_cache_agent(self, state: AgentGraphState) -> AgentGraphState:
+        """Look the question up in the semantic answer cache, filling in the answer on a hit"""
+
+        with span("answer_cache.embed"):
+            embedding = create_embeddings(state.get("api_key", "")).embed_query(self._answer_cache_text(state))
+        with span("answer_cache.kb_version"):
+            kb_version = get_backend().version()
+        return self._apply_answer_lookup(state, embedding, kb_version)
+    
+    async def aanswer_cache_agent(self, state: AgentGraphState) -> AgentGraphState:
+        """Async version of answer_cache_agent"""
+
+        with span("answer_cache.embed"):
+            embedding = await create_embeddings(state.get("api_key", "")).aembed_query(self._answer_cache_text(state))
+        with span("answer_cache.kb_version"):
+            kb_version = await get_backend().aversion()
+        return self._apply_answer_lookup(state, embedding, kb_version)
+    
+    def store_answer_agent(self, state: AgentGraphState) -> AgentGraphState:
+        """Cache the final answer of a turn that missed, if its route is cacheable"""
+
+        if not state.get("answer_cache_hit") and state.get("answer_cache_embedding") is not None:
+            get_answer_cache().store(
+                state["answer_cache_embedding"],
+                state.get("agent_response", ""),
+                state.get("router_response", ""),
+                state.get("kb_version"),
+                state.get("answer_cache_scope") or ""
+            )
+        return state
+    
+    def _local_route(self, state: AgentGraphState) -> Optional[str]:
+        """Route locally when the classifier is confident, skipping the LLM round trip"""
+
+        # Follow-ups like "and for a retiree?" can only be routed with the conversation in view
+        if state.get("messages"):
+            return None
+        local_router = get_local_router()
+        return local_router.route(state["human_input"]) if local_router is not None else None
     
-        chat_context = self._format_chat_history()
-        system_prompt = router_prompt.format(chat_context=chat_context)
+    def _record_route(self, state: AgentGraphState, route: str) -> None:
+        """Let the local router learn from decisions it wasn't sure about"""
+
+        # A decision made from the conversation says nothing about the message on its own
+        if state.get("messages"):
+            return
+        local_router = get_local_router()
+        if local_router is not None:
+            local_router.record(state["human_input"], route)
+    
+    def _router_messages(self, state: AgentGraphState, prompt: str) -> List[Dict[str, str]]:
+        chat_context = self._format_chat_history(state)
+        system_prompt = prompt.format(chat_context=chat_context)
         
-        messages = [
+        return [
             {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_query}
+            {"role": "user", "content": state["human_input"]}
         ]
+    
+    def router_agent(self, state: AgentGraphState) -> AgentGraphState:
+        """Router agent that determines which agent to use based on the user's query"""
+ 
+        local_route = self._local_route(state)
+        if local_route is not None:
+            return self.update_state(state, "router_response", local_route)
         
-        llm = self.get_llm()
-        ai_msg = llm.invoke(messages)
+        llm = self.get_llm(state)
+        with span("llm.router"):
+            ai_msg = llm.invoke(self._router_messages(state, router_prompt))
         response = ai_msg.content.strip()
         
-        self.update_state("router_response", response)
+        self._record_route(state, response)
         
-        return self.state
+        return self.update_state(state, "router_response", response)
     
-    def rag_caller_agent(self) -> AgentGraphState:
-        """RAG caller agent that determines if RAG is necessary and formulates a query"""
+    async def arouter_agent(self, state: AgentGraphState) -> AgentGraphState:
+        """Async version of router_agent"""
+ 
+        local_route = self._local_route(state)
+        if local_route is not None:
+            return self.update_state(state, "router_response", local_route)
+        
+        llm = self.get_llm(state)
+        with span("llm.router"):
+            ai_msg = await llm.ainvoke(self._router_messages(state, router_prompt))
+        response = ai_msg.content.strip()
+        
+        self._record_route(state, response)
+        
+        return self.update_state(state, "router_response", response)
+    
+    def _apply_fused_decision(self, state: AgentGraphState, decision: Dict[str, Any]) -> AgentGraphState:
+        route = decision.get("route", "research_agent")
+        
+        self._record_route(state, route)
+        
+        self.update_state(state, "router_response", route)
+        self.update_state(state, "rag_decision", {
+            "need_rag": decision.get("need_rag", False),
+            "rag_query": decision.get("rag_query", "")
+        })
+        
+        return state
+    
+    def fused_router_agent(self, state: AgentGraphState) -> AgentGraphState:
+        """Router agent that also decides on RAG in the same structured call"""
 
-        user_query = self.state["human_input"]
+        # Fast path: a confident local route skips the LLM; rag_caller then decides on RAG itself
+        local_route = self._local_route(state)
+        if local_route is not None:
+            self.update_state(state, "router_response", local_route)
+            return self.update_state(state, "rag_decision", None)
+        
+        llm = self.get_llm(state, schema=fused_router_json)
+        with span("llm.fused_router"):
+            decision: Dict[str, Any] = llm.invoke(self._router_messages(state, fused_router_prompt))
+        
+        return self._apply_fused_decision(state, decision)
+    
+    async def afused_router_agent(self, state: AgentGraphState) -> AgentGraphState:
+        """Async version of fused_router_agent"""
 
-        chat_context = self._format_chat_history()
+        local_route = self._local_route(state)
+        if local_route is not None:
+            self.update_state(state, "router_response", local_route)
+            return self.update_state(state, "rag_decision", None)
+        
+        llm = self.get_llm(state, schema=fused_router_json)
+        with span("llm.fused_router"):
+            decision: Dict[str, Any] = await llm.ainvoke(self._router_messages(state, fused_router_prompt))
         
-        system_prompt = rag_caller_prompt.format(question=user_query, chat_context=chat_context)
+        return self._apply_fused_decision(state, decision)
+    
+    def _rag_caller_messages(self, state: AgentGraphState) -> List[Dict[str, str]]:
+        chat_context = self._format_chat_history(state)
+        
+        system_prompt = rag_caller_prompt.format(question=state["human_input"], chat_context=chat_context)
 
-        messages = [
+        return [
             {"role": "system", "content": system_prompt}
         ]
-        llm = self.get_llm()
-        
+    
+    def _parse_rag_decision(self, ai_msg: Any) -> Dict[str, Any]:
+        # If structured output is used, the response is already parsed
+        if self.rag_caller_json:
+            return ai_msg
+        return json.loads(ai_msg.content)
+    
+    def rag_caller_agent(self, state: AgentGraphState) -> AgentGraphState:
+        """RAG caller agent that determines if RAG is necessary and formulates a query"""
+
+        # The fused router already decided, so go straight to retrieval
+        if state.get("rag_decision"):
+            return self._run_rag(state, dict(state["rag_decision"]))
+
         # Use the guided_json configuration if available
-        if hasattr(self, 'rag_caller_json'):
-            llm = llm.with_structured_output(self.rag_caller_json)
+        llm = self.get_llm(state, schema=self.rag_caller_json)
             
-        ai_msg = llm.invoke(messages)
+        with span("llm.rag_caller"):
+            ai_msg = llm.invoke(self._rag_caller_messages(state))
         
-        # If structured output is used, the response is already parsed
-        if hasattr(self, 'rag_caller_json'):
-            parsed_response: Dict[str, Any] = ai_msg
-        else:
-            response = ai_msg.content
-            parsed_response = json.loads(response)
+        return self._run_rag(state, self._parse_rag_decision(ai_msg))
+    
+    async def arag_caller_agent(self, state: AgentGraphState) -> AgentGraphState:
+        """Async version of rag_caller_agent"""
+
+        if state.get("rag_decision"):
+            return await self._arun_rag(state, dict(state["rag_decision"]))
+
+        llm = self.get_llm(state, schema=self.rag_caller_json)
+            
+        with span("llm.rag_caller"):
+            ai_msg = await llm.ainvoke(self._rag_caller_messages(state))
+        
+        return await self._arun_rag(state, self._parse_rag_decision(ai_msg))
+    
+    def _apply_rag_results(
+        self,
+        state: AgentGraphState,
+        parsed_response: Dict[str, Any],
+        rag_results: str,
+        claimed: Optional[Tuple[Any, float, float]] = None
+    ) -> AgentGraphState:
+        if claimed is not None:
+            _, run_seconds, wait_seconds = claimed
+            self.update_state(state, "branch_timings", {
+                **state.get("branch_timings", {}),
+                "speculative_retrieval": run_seconds,
+                "speculative_wait": wait_seconds
+            })
+        parsed_response["rag_results"] = rag_results
+
+        return self.update_state(state, "rag_caller_response", parsed_response)
+    
+    def _run_rag(self, state: AgentGraphState, parsed_response: Dict[str, Any]) -> AgentGraphState:
+        """Execute the knowledge base lookup for a RAG decision and store the results"""
+
+        speculative = get_speculative_executor()
         
-        # If RAG is needed, execute the RAG query immediately
-        if parsed_response.get("need_rag", False):
-            rag_results = generate_rag_queries(parsed_response["rag_query"])
-            parsed_response["rag_results"] = rag_results
+        # If RAG is needed, reuse the speculative lookup if one ran, otherwise execute the RAG query immediately
+        if not parsed_response.get("need_rag", False):
+            speculative.discard(state.get("speculative_handle"))
+            return self._apply_rag_results(state, parsed_response, "")
+
+        claimed = speculative.claim(state.get("speculative_handle"), speculative.claim_timeout)
+        if claimed is not None:
+            rag_results = claimed[0]
         else:
-            parsed_response["rag_results"] = ""
+            rag_results = generate_rag_queries(parsed_response["rag_query"], state.get("api_key", ""))
+        
+        return self._apply_rag_results(state, parsed_response, rag_results, claimed)
+    
+    async def _arun_rag(self, state: AgentGraphState, parsed_response: Dict[str, Any]) -> AgentGraphState:
+        """Async version of _run_rag"""
 
-        self.update_state("rag_caller_response", parsed_response)
+        speculative = get_speculative_executor()
         
-        return self.state
+        if not parsed_response.get("need_rag", False):
+            speculative.discard(state.get("speculative_handle"))
+            return self._apply_rag_results(state, parsed_response, "")
+
+        claimed = await speculative.aclaim(state.get("speculative_handle"), speculative.claim_timeout)
+        if claimed is not None:
+            rag_results = claimed[0]
+        else:
+            rag_results = await agenerate_rag_queries(parsed_response["rag_query"], state.get("api_key", ""))
+        
+        return self._apply_rag_results(state, parsed_response, rag_results, claimed)
     
-    def investment_strategy_agent(self) -> AgentGraphState:
-        """Investment strategy agent that provides personalized advice on asset allocation"""
+    def speculative_rag_agent(self, state: AgentGraphState) -> Dict[str, Any]:
+        """Start a knowledge base lookup in the background and return only the handle to claim it"""
 
-        user_query = self.state["human_input"]
+        handle = get_speculative_executor().start(
+            generate_rag_queries, state["human_input"], state.get("api_key", "")
+        )
+        return {"speculative_handle": handle}
+    
+    async def aspeculative_rag_agent(self, state: AgentGraphState) -> Dict[str, Any]:
+        """Async version of speculative_rag_agent; the lookup runs as a task on the event loop"""
 
-        rag_response = self.state.get("rag_caller_response", {})
+        handle = get_speculative_executor().start_async(
+            agenerate_rag_queries, state["human_input"], state.get("api_key", "")
+        )
+        return {"speculative_handle": handle}
+    
+    def _investment_strategy_messages(self, state: AgentGraphState, single_pass: bool) -> List[Dict[str, str]]:
+        user_query = state["human_input"]
+
+        rag_response = state.get("rag_caller_response", {})
         rag_results = rag_response.get("rag_results", "")
 
-        chat_context = self._format_chat_history()
+        chat_context = self._format_chat_history(state)
 
         system_prompt = investment_strategy_prompt.format(
             question=user_query,
             rag_query=rag_results,
             chat_context=chat_context
         )
+        if single_pass:
+            system_prompt += single_pass_formatting
         
-        messages = [
+        return [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_query}
         ]
+    
+    def investment_strategy_agent(self, state: AgentGraphState, single_pass: bool = False) -> AgentGraphState:
+        """Investment strategy agent that provides personalized advice on asset allocation"""
+
+        llm = self.get_llm(state)
+        with span("llm.investment_strategy"):
+            ai_msg = llm.invoke(self._investment_strategy_messages(state, single_pass))
         
-        llm = self.get_llm()
-        ai_msg = llm.invoke(messages)
-        response = ai_msg.content
-        
-        self.update_state("agent_response", response)
-        
-        return self.state
+        return self.update_state(state, "agent_response", ai_msg.content)
+    
+    async def ainvestment_strategy_agent(self, state: AgentGraphState, single_pass: bool = False) -> AgentGraphState:
+        """Async version of investment_strategy_agent"""
 
-    def research_agent(self) -> AgentGraphState:
-        """Research agent that provides real-time market research and stock analysis"""
+        llm = self.get_llm(state)
+        with span("llm.investment_strategy"):
+            ai_msg = await llm.ainvoke(self._investment_strategy_messages(state, single_pass))
+        
+        return self.update_state(state, "agent_response", ai_msg.content)
 
+    def _research_executor(self, state: AgentGraphState, single_pass: bool) -> AgentExecutor:
         tools = [self.market_research_tool]
         
-        user_query = self.state["human_input"]
-        chat_context = self._format_chat_history()
+        chat_context = self._format_chat_history(state)
         
-        system_prompt = research_prompt.format(query=user_query, chat_context=chat_context)
+        system_prompt = research_prompt.format(query=state["human_input"], chat_context=chat_context)
+        if single_pass:
+            system_prompt += single_pass_formatting
         
         prompt = ChatPromptTemplate.from_messages([
             ("system", system_prompt),
@@ -175,22 +453,32 @@ class TradingAgent(Agent):
             MessagesPlaceholder(variable_name="agent_scratchpad")
         ])
         
-        llm = self.get_llm()
+        llm = self.get_llm(state)
         agent = create_openai_tools_agent(llm, tools, prompt)
-        agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=True)
-        
-        response = agent_executor.invoke({"input": user_query})["output"]
+        return AgentExecutor(agent=agent, tools=tools, verbose=True)
 
-        self.update_state("agent_response", response)
-        
-        return self.state
-    
-    def end_agent(self) -> AgentGraphState:
-        """End agent that formats the response using the formatter prompt"""
+    def research_agent(self, state: AgentGraphState, single_pass: bool = False) -> AgentGraphState:
+        """Research agent that provides real-time market research and stock analysis"""
+
+        agent_executor = self._research_executor(state, single_pass)
+        with span("agent.research_executor"):
+            response = agent_executor.invoke({"input": state["human_input"]})["output"]
+
+        return self.update_state(state, "agent_response", response)
+
+    async def aresearch_agent(self, state: AgentGraphState, single_pass: bool = False) -> AgentGraphState:
+        """Async version of research_agent; tool calls go through the tools' coroutines"""
 
-        user_query = self.state.get("human_input", "")
-        agent_response = self.state.get("agent_response", "")
-        router_response = self.state.get("router_response", "")
+        agent_executor = self._research_executor(state, single_pass)
+        with span("agent.research_executor"):
+            response = (await agent_executor.ainvoke({"input": state["human_input"]}))["output"]
+
+        return self.update_state(state, "agent_response", response)
+    
+    def _end_messages(self, state: AgentGraphState) -> List[Dict[str, str]]:
+        user_query = state.get("human_input", "")
+        agent_response = state.get("agent_response", "")
+        router_response = state.get("router_response", "")
         
         agent_type = "general"
         if router_response == "investment_strategy_agent":
@@ -204,17 +492,45 @@ class TradingAgent(Agent):
             agent_type=agent_type
         )
         
-        messages = [
+        return [
             {"role": "system", "content": formatted_prompt}
         ]
+    
+    def _apply_end(self, state: AgentGraphState, formatted_response: str) -> AgentGraphState:
+        agent_response = state.get("agent_response", "")
+        
+        self.update_state(state, "formatted_response", formatted_response)
+        self.update_state(state, "agent_response", formatted_response)  
+        self.update_state(state, "original_response", agent_response)  
+        self.update_state(state, "end_chain", "end_chain")
         
-        llm = self.get_llm()
-        ai_msg = llm.invoke(messages)
-        formatted_response = ai_msg.content
+        return state
+    
+    def end_agent(self, state: AgentGraphState) -> AgentGraphState:
+        """End agent that formats the response using the formatter prompt"""
+
+        llm = self.get_llm(state)
+        with span("llm.formatter"):
+            ai_msg = llm.invoke(self._end_messages(state))
+        
+        return self._apply_end(state, ai_msg.content)
+    
+    async def aend_agent(self, state: AgentGraphState) -> AgentGraphState:
+        """Async version of end_agent"""
+
+        llm = self.get_llm(state)
+        with span("llm.formatter"):
+            ai_msg = await llm.ainvoke(self._end_messages(state))
+        
+        return self._apply_end(state, ai_msg.content)
+    
+    def passthrough_end_agent(self, state: AgentGraphState) -> AgentGraphState:
+        """End agent for single-pass mode: the specialist already produced the formatted answer"""
+
+        agent_response = state.get("agent_response", "")
         
-        self.update_state("formatted_response", formatted_response)
-        self.update_state("agent_response", formatted_response)  
-        self.update_state("original_response", agent_response)  
-        self.update_state("end_chain", "end_chain")
+        self.update_state(state, "formatted_response", agent_response)
+        self.update_state(state, "original_response", agent_response)
+        self.update_state(state, "end_chain", "end_chain")
         
-        return self.state
\ No newline at end of file
+        return state
\ No newline at end of file
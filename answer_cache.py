@@ -0,0 +1,194 @@
+# Import other
+import os
+import time
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def cache_text(question: str, messages: List[Dict[str, str]], context_turns: int = 2, max_chars: int = 200) -> str:
+    """Text embedded for a cache lookup: the question, prefixed by a digest of the user's recent turns"""
+
+    # The history includes the current question as its last user message
+    earlier = [msg["content"] for msg in messages if msg.get("role") == "user"][:-1]
+    digest = [content[:max_chars] for content in earlier[-context_turns:]] if context_turns > 0 else []
+    if not digest:
+        return question
+    return "Earlier: " + " | ".join(digest) + "\nQuestion: " + question
+
+
+def cache_scope(caller: str, messages: List[Dict[str, str]], conversation_summary: str = "") -> str:
+    """Partition answers may only be shared within: everyone for a first turn, the caller and summary otherwise"""
+
+    # A first turn's answer depends only on the question. Later answers also depend on earlier
+    # turns and the summary, which belong to one caller's conversation and must not leak to another.
+    if len([msg for msg in messages if msg.get("role") == "user"]) <= 1 and not conversation_summary:
+        return ""
+    return hashlib.sha256(f"{caller}\0{conversation_summary}".encode()).hexdigest()
+
+
+class _Answer:
+    """A cached answer and what it was computed against"""
+
+    __slots__ = ("text", "route", "created_at", "scope")
+
+    def __init__(self, text: str, route: str, created_at: float, scope: str = "") -> None:
+        self.text = text
+        self.route = route
+        self.created_at = created_at
+        self.scope = scope
+
+
+class AnswerCache:
+    """Semantic cache of final answers, looked up by cosine similarity of question embeddings"""
+
+    def __init__(
+        self,
+        threshold: float = 0.95,
+        max_entries: int = 1000,
+        routes: Tuple[str, ...] = ("investment_strategy_agent",),
+        ttl: Optional[float] = None
+    ) -> None:
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.routes = tuple(routes)
+        self.ttl = ttl
+
+        self._answers: "OrderedDict[int, _Answer]" = OrderedDict()
+        self._vectors: Dict[int, np.ndarray] = {}
+        self._next_id = 0
+        self._kb_version: Optional[Any] = None
+        self._lock = threading.Lock()
+
+        # Unit vectors of all entries stacked in insertion order, rebuilt lazily after changes
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_ids: List[int] = []
+        self._matrix_scopes: Optional[np.ndarray] = None
+
+        # Stats
+        self._hits = 0
+        self._misses = 0
+        self._stores = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def enabled_for(self, route: Optional[str]) -> bool:
+        """Whether answers for a route may be cached"""
+
+        return route in self.routes
+
+    @staticmethod
+    def _unit(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _sync_version(self, kb_version: Optional[Any]) -> None:
+        """Drop every entry when the knowledge base has been re-ingested (lock held)"""
+
+        if kb_version != self._kb_version:
+            if self._answers:
+                self._invalidations += 1
+            self._answers.clear()
+            self._vectors.clear()
+            self._matrix = None
+            self._kb_version = kb_version
+
+    def _remove(self, answer_id: int) -> None:
+        del self._answers[answer_id]
+        del self._vectors[answer_id]
+        self._matrix = None
+
+    def lookup(self, embedding: List[float], kb_version: Optional[Any] = None, scope: str = "") -> Optional[Tuple[str, str, float]]:
+        """Return (answer, route, similarity) for the most similar cached question in scope above the threshold"""
+
+        query = self._unit(embedding)
+        now = time.monotonic()
+        with self._lock:
+            self._sync_version(kb_version)
+            if self.ttl is not None:
+                for answer_id in [i for i, a in self._answers.items() if now - a.created_at > self.ttl]:
+                    self._remove(answer_id)
+                    self._evictions += 1
+
+            if self._answers:
+                if self._matrix is None:
+                    self._matrix_ids = list(self._answers)
+                    self._matrix = np.stack([self._vectors[i] for i in self._matrix_ids])
+                    self._matrix_scopes = np.array([self._answers[i].scope for i in self._matrix_ids], dtype=object)
+                similarities = np.where(self._matrix_scopes == scope, self._matrix @ query, -np.inf)
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    answer_id = self._matrix_ids[best]
+                    self._answers.move_to_end(answer_id)
+                    self._hits += 1
+                    answer = self._answers[answer_id]
+                    return answer.text, answer.route, float(similarities[best])
+
+            self._misses += 1
+            return None
+
+    def store(self, embedding: List[float], answer: str, route: str, kb_version: Optional[Any] = None, scope: str = "") -> bool:
+        """Cache an answer from a lookup that missed, if its route is enabled; evicts least recently used"""
+
+        if not answer or not self.enabled_for(route):
+            return False
+
+        with self._lock:
+            # Answers computed against a knowledge base that has since changed are not kept
+            if kb_version != self._kb_version:
+                return False
+            answer_id = self._next_id
+            self._next_id += 1
+            self._answers[answer_id] = _Answer(answer, route, time.monotonic(), scope)
+            self._vectors[answer_id] = self._unit(embedding)
+            self._matrix = None
+            self._stores += 1
+
+            while len(self._answers) > self.max_entries:
+                self._remove(next(iter(self._answers)))
+                self._evictions += 1
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit rate, size and invalidation statistics"""
+
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "stores": self._stores,
+                "entries": len(self._answers),
+                "evictions": self._evictions,
+                "invalidations": self._invalidations,
+                "kb_version": self._kb_version
+            }
+
+
+_cache: Optional[AnswerCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> AnswerCache:
+    """Return the process-wide answer cache, configured from the environment"""
+
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                ttl = os.getenv("ANSWER_CACHE_TTL")
+                routes = os.getenv("ANSWER_CACHE_ROUTES", "investment_strategy_agent")
+                _cache = AnswerCache(
+                    threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+                    max_entries=int(os.getenv("ANSWER_CACHE_SIZE", "1000")),
+                    routes=tuple(route.strip() for route in routes.split(",") if route.strip()),
+                    ttl=float(ttl) if ttl else None
+                )
+    return _cache
@@ -1,11 +1,13 @@
 # Import streamlit 
+import os
 import streamlit as st
-from typing import Optional
+from typing import Any, Dict, Optional
 
 # Import agents and infrastructure
-from agents import TradingAgent
 from state import AgentGraphState
-from graph import Graph
+from graph import get_workflow, stream_workflow
+from tracing import get_tracer
+from metrics import serve_metrics
 
 class StockMarketAssistantApp:
     def __init__(self) -> None:
@@ -20,8 +22,16 @@ class StockMarketAssistantApp:
         if "messages" not in st.session_state:
             st.session_state.messages = []
         
-        if "graph_state" not in st.session_state:
-            st.session_state.graph_state = None
+        # Running summary of the messages that have left the context window
+        if "memory" not in st.session_state:
+            st.session_state.memory = {"conversation_summary": "", "summarized_messages": 0}
+        
+        if "turn_metrics" not in st.session_state:
+            st.session_state.turn_metrics = []
+        
+        # Prometheus endpoint, started once per process
+        if os.getenv("METRICS_PORT"):
+            serve_metrics(int(os.getenv("METRICS_PORT")))
     
     def setup_ui(self) -> None:
         """Set up the user interface including sidebar and main content area."""
@@ -46,9 +56,14 @@ class StockMarketAssistantApp:
             # Clear chat history button
             if st.button("Clear Chat History"):
                 st.session_state.messages = []
-                st.session_state.graph_state = None
+                st.session_state.memory = {"conversation_summary": "", "summarized_messages": 0}
                 st.rerun()
             
+            # Export the node-level traces recorded so far when tracing is switched on
+            tracer = get_tracer()
+            if tracer.enabled:
+                st.download_button("Download Traces", data=tracer.to_jsonl(), file_name="traces.jsonl", mime="application/json")
+            
             st.markdown("This app uses OpenAI's API. Please provide your own API key.")
         
         # Display chat history
@@ -84,30 +99,49 @@ class StockMarketAssistantApp:
                 message_placeholder = st.empty()
                 message_placeholder.markdown("Thinking...")
     
-                # Create initial state
-                if st.session_state.graph_state:
-                    initial_state = AgentGraphState(
-                        human_input=user_input,
-                        api_key=st.session_state.api_key,
-                        messages=st.session_state.graph_state.get("messages", [])
-                    )
-                else:
-                    initial_state = AgentGraphState(
-                        human_input=user_input,
-                        api_key=st.session_state.api_key
-                    )
+                # Create initial state; only the conversation is carried between turns, the graph
+                # appends this turn's user message itself
+                initial_state = AgentGraphState(
+                    human_input=user_input,
+                    api_key=st.session_state.api_key,
+                    messages=list(st.session_state.messages[:-1]),
+                    **st.session_state.memory
+                )
 
-                # Process with agent system
-                trading_agent = TradingAgent(initial_state)
-                graph = Graph(trading_agent)
-                workflow = graph.build()
-                final_state = workflow.invoke(initial_state)
+                # Process with the shared, already compiled agent system, rendering tokens as they arrive
+                workflow = get_workflow()
+                final_state = initial_state
+                streamed = ""
+                for event in stream_workflow(workflow, initial_state):
+                    if event["type"] == "progress" and not streamed:
+                        message_placeholder.markdown(f"_{event['message']}_")
+                    elif event["type"] == "token":
+                        streamed += event["text"]
+                        message_placeholder.markdown(streamed + "▌")
+                    elif event["type"] == "done":
+                        final_state = event["state"]
+                        st.session_state.turn_metrics.append(event["metrics"])
 
                 # Update UI and session state
                 response = final_state.get("agent_response", "I'm sorry, I couldn't process your request.")
                 message_placeholder.markdown(response)
+                self._show_latency(st.session_state.turn_metrics[-1] if st.session_state.turn_metrics else None)
+                # The graph bounds the raw history, so older messages drop out of the session too
                 st.session_state.messages = final_state.get("messages", [])
-                st.session_state.graph_state = final_state 
+                st.session_state.memory = {
+                    "conversation_summary": final_state.get("conversation_summary", ""),
+                    "summarized_messages": final_state.get("summarized_messages", 0)
+                }
+    
+    def _show_latency(self, metrics: Optional[Dict[str, Any]]) -> None:
+        """Show time-to-first-token and total latency for the last turn."""
+
+        if not metrics:
+            return
+        ttft = metrics.get("time_to_first_token")
+        ttft_text = f"first token {ttft:.1f}s · " if ttft is not None else ""
+        cached_text = " · cached answer" if metrics.get("answer_cache_hit") else ""
+        st.caption(f"{ttft_text}total {metrics['total_latency']:.1f}s{cached_text}")
     
     def _show_welcome_info(self) -> None:
         """Show welcome information when no API key is provided."""
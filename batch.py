@@ -0,0 +1,249 @@
+"""
+Answer a JSONL file of questions through the compiled graph, offline.
+
+Each input line is an object with a "question" and optionally an "id" and a
+"conversation_id". Questions that share a conversation_id are answered in file order with
+the history of the earlier ones; everything else runs concurrently, up to --concurrency turns
+at a time and at most --rate turns started per second.
+
+Results are appended to the output JSONL as each turn completes. Rerunning with the same
+output file resumes an interrupted run: ids already answered successfully are skipped, and
+conversations pick up from their last answered turn.
+
+Usage:
+    python batch.py questions.jsonl answers.jsonl --concurrency 8 --rate 2
+"""
+
+# Import graph and infrastructure
+from state import AgentGraphState
+from graph import RESPONSE_MODE, RESPONSE_MODES, FUSED_ROUTER, SPECULATIVE_RETRIEVAL, ANSWER_CACHE, get_workflow, astream_workflow
+from request_context import request_context
+
+# Other imports
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import numpy as np
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional, TextIO, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class RateLimiter:
+    """Space out turn starts to at most `rate` per second"""
+
+    def __init__(self, rate: Optional[float]) -> None:
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def read_questions(path: str) -> List[Dict[str, Any]]:
+    """Read input records, giving records without an id one derived from their line number"""
+
+    records = []
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if not isinstance(record.get("question"), str) or not record["question"].strip():
+                raise ValueError(f"{path}:{line_number}: every record needs a non-empty 'question'")
+            record["id"] = str(record.get("id", f"line-{line_number}"))
+            records.append(record)
+
+    duplicates = [i for i, n in Counter(r["id"] for r in records).items() if n > 1]
+    if duplicates:
+        raise ValueError(f"{path}: duplicate ids {duplicates[:5]}")
+    return records
+
+
+def read_progress(path: str) -> Tuple[set, Dict[str, Dict[str, Any]]]:
+    """Return (ids answered successfully, latest conversation state per conversation_id) from an earlier run"""
+
+    done, conversations = set(), {}
+    if not os.path.exists(path):
+        return done, conversations
+    with open(path) as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                # A run killed mid-write can leave a truncated last line
+                continue
+            if result.get("error") is None:
+                done.add(result["id"])
+                if result.get("conversation_id") is not None:
+                    conversations[result["conversation_id"]] = result["conversation"]
+    return done, conversations
+
+
+def plan(records: List[Dict[str, Any]], done: set) -> List[List[Dict[str, Any]]]:
+    """Group pending records into units run in order: one per conversation, one per standalone question"""
+
+    units: "OrderedDict[Any, List[Dict[str, Any]]]" = OrderedDict()
+    for record in records:
+        if record["id"] in done:
+            continue
+        key = ("conversation", record["conversation_id"]) if record.get("conversation_id") is not None else ("question", record["id"])
+        units.setdefault(key, []).append(record)
+    return list(units.values())
+
+
+class BatchRunner:
+    """Run planned units through the async graph and stream results to the output file"""
+
+    def __init__(self, workflow: Any, args: argparse.Namespace, output: TextIO, conversations: Dict[str, Dict[str, Any]]) -> None:
+        self.workflow = workflow
+        self.args = args
+        self.output = output
+        self.conversations = conversations
+        self.limiter = RateLimiter(args.rate)
+
+        self.latencies: List[float] = []
+        self.routes: Counter = Counter()
+        self.failed = 0
+        self.cache_hits = 0
+
+    def _write(self, result: Dict[str, Any]) -> None:
+        # Flushed per line so an interrupted run loses at most the turns in flight
+        self.output.write(json.dumps(result, default=str) + "\n")
+        self.output.flush()
+
+    async def _turn(self, record: Dict[str, Any], conversation: Dict[str, Any]) -> Dict[str, Any]:
+        state = AgentGraphState(
+            human_input=record["question"],
+            api_key=self.args.api_key,
+            messages=list(conversation.get("messages", [])),
+            conversation_summary=conversation.get("conversation_summary", ""),
+            summarized_messages=conversation.get("summarized_messages", 0)
+        )
+        async for event in astream_workflow(self.workflow, state, self.args.response_mode):
+            if event["type"] == "done":
+                return event
+        raise RuntimeError("Workflow finished without a result")
+
+    async def _run_unit(self, unit: List[Dict[str, Any]]) -> None:
+        conversation_id = unit[0].get("conversation_id")
+        conversation = self.conversations.get(conversation_id, {}) if conversation_id is not None else {}
+
+        for position, record in enumerate(unit):
+            result: Dict[str, Any] = {"id": record["id"], "conversation_id": conversation_id, "question": record["question"]}
+            await self.limiter.wait()
+            start = time.perf_counter()
+            try:
+                done = await asyncio.wait_for(self._turn(record, conversation), self.args.timeout)
+            except Exception as e:
+                self.failed += 1
+                self._write({**result, "error": f"{type(e).__name__}: {e}"})
+                # Later turns of a conversation depend on this one, so they wait for a resumed run
+                for skipped in unit[position + 1:]:
+                    self.failed += 1
+                    self._write({"id": skipped["id"], "conversation_id": conversation_id, "question": skipped["question"], "error": f"Skipped: turn {record['id']} failed"})
+                return
+
+            latency = time.perf_counter() - start
+            state = done["state"]
+            self.latencies.append(latency)
+            self.routes[state.get("router_response") or "cached"] += 1
+            self.cache_hits += bool(state.get("answer_cache_hit"))
+
+            result.update(
+                response=state.get("agent_response", ""),
+                route=state.get("router_response"),
+                latency_s=round(latency, 4),
+                answer_cache_hit=bool(state.get("answer_cache_hit")),
+                error=None
+            )
+            if conversation_id is not None:
+                conversation = {
+                    "messages": state.get("messages", []),
+                    "conversation_summary": state.get("conversation_summary", ""),
+                    "summarized_messages": state.get("summarized_messages", 0)
+                }
+                result["conversation"] = conversation
+            self._write(result)
+
+    async def run(self, units: List[List[Dict[str, Any]]]) -> None:
+        queue: asyncio.Queue = asyncio.Queue()
+        for unit in units:
+            queue.put_nowait(unit)
+
+        async def worker() -> None:
+            while not queue.empty():
+                await self._run_unit(queue.get_nowait())
+
+        with request_context(openai_api_key=self.args.api_key):
+            await asyncio.gather(*(worker() for _ in range(min(self.args.concurrency, len(units)) or 1)))
+
+    def summary(self, elapsed: float, skipped: int) -> str:
+        completed = len(self.latencies)
+        lines = [
+            f"Completed {completed}, failed {self.failed}, skipped {skipped} already answered",
+            f"Elapsed {elapsed:.1f}s, throughput {completed / elapsed if elapsed else 0.0:.2f} turns/s"
+        ]
+        if completed:
+            seconds = np.asarray(self.latencies)
+            lines.append(
+                "Latency p50 {:.2f}s  p95 {:.2f}s  p99 {:.2f}s  max {:.2f}s".format(
+                    np.percentile(seconds, 50), np.percentile(seconds, 95), np.percentile(seconds, 99), seconds.max()
+                )
+            )
+            lines.append("Routes " + ", ".join(f"{route} {count}" for route, count in self.routes.most_common()))
+            lines.append(f"Answer cache hits {self.cache_hits}")
+        return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL file of {id, question, conversation_id} records")
+    parser.add_argument("output", help="JSONL file results are appended to; reused to resume")
+    parser.add_argument("--concurrency", type=int, default=4, help="turns running at once")
+    parser.add_argument("--rate", type=float, default=None, help="maximum turns started per second")
+    parser.add_argument("--timeout", type=float, default=300.0, help="seconds before a turn is failed")
+    parser.add_argument("--api-key", default=os.getenv("OPENAI_API_KEY"))
+    parser.add_argument("--response-mode", choices=RESPONSE_MODES, default=RESPONSE_MODE)
+    parser.add_argument("--fused-router", action=argparse.BooleanOptionalAction, default=FUSED_ROUTER)
+    parser.add_argument("--speculative", action=argparse.BooleanOptionalAction, default=SPECULATIVE_RETRIEVAL)
+    parser.add_argument("--answer-cache", action=argparse.BooleanOptionalAction, default=ANSWER_CACHE)
+    args = parser.parse_args()
+
+    if not args.api_key:
+        parser.error("OPENAI_API_KEY must be set or --api-key given")
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+
+    records = read_questions(args.input)
+    done, conversations = read_progress(args.output)
+    units = plan(records, done)
+    skipped = sum(record["id"] in done for record in records)
+    print(f"{len(records)} questions, {skipped} already answered, {sum(map(len, units))} to run in {len(units)} units", file=sys.stderr)
+
+    workflow = get_workflow(args.response_mode, args.fused_router, args.speculative, True, args.answer_cache)
+    start = time.perf_counter()
+    with open(args.output, "a") as output:
+        runner = BatchRunner(workflow, args, output, conversations)
+        try:
+            asyncio.run(runner.run(units))
+        except KeyboardInterrupt:
+            print("Interrupted; rerun with the same output file to resume", file=sys.stderr)
+        print(runner.summary(time.perf_counter() - start, skipped), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Benchmark pgvector ANN indexes against exact search.
+
+For each corpus size a scratch table of synthetic clustered embeddings is loaded, the
+configured index is built, and the same queries are run with the index and with an exact
+sequential scan. Reports recall@k and p50/p99 latency for both.
+
+Usage:
+    python benchmarks/ann_benchmark.py --sizes 1000,10000,50000 --method hnsw --k 10
+"""
+
+# Database imports
+from psycopg2.extras import execute_values
+
+# Other imports
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from typing import Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db import get_pool
+from vector_index import VectorIndexConfig, apply_search_params, rebuild_vector_index
+
+TABLE = "ann_benchmark_vectors"
+
+
+def _literal(vector: np.ndarray) -> str:
+    return '[' + ','.join(f"{x:.6f}" for x in vector) + ']'
+
+
+def make_corpus(size: int, dim: int, n_queries: int, seed: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Generate clustered embeddings, loosely mimicking real text embeddings"""
+
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(1, size // 200), dim)).astype(np.float32)
+    corpus = centers[rng.integers(len(centers), size=size)] + 0.3 * rng.normal(size=(size, dim)).astype(np.float32)
+    queries = centers[rng.integers(len(centers), size=n_queries)] + 0.3 * rng.normal(size=(n_queries, dim)).astype(np.float32)
+    return corpus, queries
+
+
+def load_corpus(cursor, corpus: np.ndarray) -> None:
+    cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    cursor.execute(f"CREATE TABLE {TABLE} (id INTEGER PRIMARY KEY, embedding vector({corpus.shape[1]}))")
+    execute_values(
+        cursor,
+        f"INSERT INTO {TABLE} (id, embedding) VALUES %s",
+        [(i, _literal(vector)) for i, vector in enumerate(corpus)],
+        template="(%s, %s::vector)",
+        page_size=1000
+    )
+
+
+def run_queries(conn, queries: np.ndarray, k: int, config: VectorIndexConfig, exact: bool) -> Tuple[List[List[int]], List[float]]:
+    """Run every query in its own transaction, returning ids and latencies in ms"""
+
+    ids, latencies = [], []
+    for query in queries:
+        with conn.cursor() as cursor:
+            if exact:
+                cursor.execute("SET LOCAL enable_indexscan = off")
+            else:
+                apply_search_params(cursor, config)
+
+            start = time.perf_counter()
+            cursor.execute(
+                f"SELECT id FROM {TABLE} ORDER BY embedding <-> %s::vector LIMIT %s",
+                (_literal(query), k)
+            )
+            rows = cursor.fetchall()
+            latencies.append((time.perf_counter() - start) * 1000)
+        conn.rollback()
+        ids.append([row[0] for row in rows])
+    return ids, latencies
+
+
+def benchmark_size(conn, size: int, args: argparse.Namespace, config: VectorIndexConfig) -> Dict[str, float]:
+    corpus, queries = make_corpus(size, args.dim, args.queries, args.seed)
+
+    with conn.cursor() as cursor:
+        load_corpus(cursor, corpus)
+        start = time.perf_counter()
+        rebuild_vector_index(cursor, config, table=TABLE)
+        build_seconds = time.perf_counter() - start
+    conn.commit()
+
+    exact_ids, exact_latencies = run_queries(conn, queries, args.k, config, exact=True)
+    ann_ids, ann_latencies = run_queries(conn, queries, args.k, config, exact=False)
+
+    recall = np.mean([len(set(a) & set(e)) / len(e) for a, e in zip(ann_ids, exact_ids) if e])
+    return {
+        "size": size,
+        "build_s": build_seconds,
+        "recall": float(recall),
+        "ann_p50": float(np.percentile(ann_latencies, 50)),
+        "ann_p99": float(np.percentile(ann_latencies, 99)),
+        "exact_p50": float(np.percentile(exact_latencies, 50)),
+        "exact_p99": float(np.percentile(exact_latencies, 99))
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,50000", help="Comma-separated corpus sizes")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--method", choices=["hnsw", "ivfflat"], default=None, help="Overrides VECTOR_INDEX_METHOD")
+    parser.add_argument("--ef-search", type=int, default=None, help="Overrides HNSW_EF_SEARCH")
+    parser.add_argument("--probes", type=int, default=None, help="Overrides IVFFLAT_PROBES")
+    args = parser.parse_args()
+
+    config = VectorIndexConfig.from_env()
+    if args.method:
+        config.method = args.method
+    if args.ef_search:
+        config.hnsw_ef_search = args.ef_search
+    if args.probes:
+        config.ivfflat_probes = args.probes
+
+    print(f"method={config.method} k={args.k} dim={args.dim} queries={args.queries}")
+    print(f"{'size':>8} {'build s':>8} {'recall@k':>9} {'ann p50':>9} {'ann p99':>9} {'exact p50':>10} {'exact p99':>10}")
+
+    with get_pool().connection() as conn:
+        try:
+            for size in (int(s) for s in args.sizes.split(",")):
+                r = benchmark_size(conn, size, args, config)
+                print(
+                    f"{r['size']:>8} {r['build_s']:>8.2f} {r['recall']:>9.3f} {r['ann_p50']:>7.2f}ms "
+                    f"{r['ann_p99']:>7.2f}ms {r['exact_p50']:>8.2f}ms {r['exact_p99']:>8.2f}ms"
+                )
+        finally:
+            with conn.cursor() as cursor:
+                cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""
+Deterministic local stand-ins for OpenAI, SerpAPI and the vector store.
+
+install() swaps them in behind the repo's own seams, so the graph, agents, tools, caches
+and metrics all run unchanged:
+
+- llm_pool.create_chat_model returns a FakeChatModel
+- embedding_cache.OpenAIEmbeddings is replaced by FakeEmbeddings
+- tools._market_search / tools._amarket_search return canned results
+- the retrieval backend is a NumpyVectorBackend over a synthetic corpus in a temp directory
+
+Replies are picked from the prompt that was sent (router, RAG caller, query expansion,
+summary, research agent or answer), so every node gets well-formed output.
+"""
+
+# Import langchain
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.runnables import Runnable, RunnableLambda
+
+# Other imports
+import os
+import sys
+import json
+import time
+import atexit
+import shutil
+import asyncio
+import hashlib
+import tempfile
+import numpy as np
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import llm_pool
+import tools
+import memory
+import market_cache
+import answer_cache
+import vector_store
+import embedding_cache
+from prompts import router_prompt, fused_router_prompt, rag_caller_prompt, rag_query_prompt, conversation_summary_prompt
+
+RESEARCH_KEYWORDS = ("latest", "news", "price", "trend", "today", "earnings", "trading at")
+
+
+def _marker(prompt: str) -> str:
+    """First line of a prompt, used to recognise which agent sent a request"""
+
+    return next(line.strip() for line in prompt.splitlines() if line.strip())
+
+
+ROUTER_MARKER = _marker(router_prompt)
+FUSED_ROUTER_MARKER = _marker(fused_router_prompt)
+RAG_CALLER_MARKER = _marker(rag_caller_prompt)
+QUERY_EXPANSION_MARKER = _marker(rag_query_prompt)
+SUMMARY_MARKER = _marker(conversation_summary_prompt)
+
+
+def fake_route(question: str) -> str:
+    question = question.lower()
+    return "research_agent" if any(word in question for word in RESEARCH_KEYWORDS) else "investment_strategy_agent"
+
+
+def _words(count: int, seed: str) -> str:
+    """Deterministic filler text of a given word count"""
+
+    vocabulary = ("portfolio", "allocation", "risk", "return", "equity", "bond", "index", "fund",
+                  "volatility", "dividend", "growth", "value", "sector", "market", "yield", "hedge")
+    offset = int(hashlib.blake2b(seed.encode(), digest_size=4).hexdigest(), 16)
+    return " ".join(vocabulary[(offset + i * 7) % len(vocabulary)] for i in range(count))
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model that answers locally after a fixed latency plus a per-token delay"""
+
+    model_name: str = "gpt-4o"
+    latency: float = 0.05
+    seconds_per_token: float = 0.0
+    completion_tokens: int = 60
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _reply(self, messages: List[BaseMessage], **kwargs: Any) -> AIMessage:
+        text = "\n".join(str(message.content) for message in messages)
+        question = next((str(m.content) for m in reversed(messages) if m.type == "human"), text[-200:])
+
+        if kwargs.get("tools") and not any(isinstance(m, ToolMessage) for m in messages):
+            # Research agent: call the market research tool once, then answer
+            tool = kwargs["tools"][0]["function"]["name"]
+            return AIMessage(content="", tool_calls=[{"name": tool, "args": {"__arg1": question}, "id": "call_0"}])
+
+        if FUSED_ROUTER_MARKER in text:
+            route = fake_route(question)
+            decision = {"route": route, "need_rag": route == "investment_strategy_agent", "rag_query": question}
+            return AIMessage(content=json.dumps(decision))
+        if ROUTER_MARKER in text:
+            return AIMessage(content=fake_route(question))
+        if RAG_CALLER_MARKER in text:
+            return AIMessage(content=json.dumps({"need_rag": True, "rag_query": question[:200]}))
+        if QUERY_EXPANSION_MARKER in text:
+            return AIMessage(content="\n".join(f"{question[:80]} ({i})" for i in range(5)))
+        if SUMMARY_MARKER in text:
+            return AIMessage(content=_words(self.completion_tokens // 2, text))
+        return AIMessage(content=_words(self.completion_tokens, text))
+
+    def _result(self, messages: List[BaseMessage], **kwargs: Any) -> ChatResult:
+        message = self._reply(messages, **kwargs)
+        prompt_tokens = sum(len(str(m.content).split()) for m in messages)
+        completion_tokens = len(str(message.content).split()) + len(message.tool_calls)
+        message.usage_metadata = {
+            "input_tokens": prompt_tokens,
+            "output_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+        return ChatResult(
+            generations=[ChatGeneration(message=message)],
+            llm_output={"model_name": self.model_name}
+        )
+
+    def _delay(self) -> float:
+        return self.latency + self.seconds_per_token * self.completion_tokens
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        time.sleep(self._delay())
+        return self._result(messages, **kwargs)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self._delay())
+        return self._result(messages, **kwargs)
+
+    def with_structured_output(self, schema: Any, **kwargs: Any) -> Runnable:
+        # Replies to structured prompts are already JSON
+        return self | RunnableLambda(lambda message: json.loads(message.content))
+
+
+class FakeEmbeddings(Embeddings):
+    """Hash-seeded unit vectors, so the same text always gets the same embedding"""
+
+    def __init__(self, dim: int = 256, latency: float = 0.02, **kwargs: Any) -> None:
+        self.dim = dim
+        self.latency = latency
+
+    def _vector(self, text: str) -> List[float]:
+        seed = int(hashlib.blake2b(text.encode(), digest_size=8).hexdigest(), 16)
+        vector = np.random.default_rng(seed).normal(size=self.dim).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        await asyncio.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+
+class FakeMarketSearch:
+    """Canned SerpAPI results after a fixed latency"""
+
+    def __init__(self, latency: float = 0.1) -> None:
+        self.latency = latency
+
+    def _results(self, query: str) -> str:
+        return f"Search results for '{query}': " + _words(120, query)
+
+    def run(self, query: str) -> str:
+        time.sleep(self.latency)
+        return self._results(query)
+
+    async def arun(self, query: str) -> str:
+        await asyncio.sleep(self.latency)
+        return self._results(query)
+
+
+class _WhitespaceEncoding:
+    """Used in place of tiktoken's cl100k_base when it can't be loaded offline"""
+
+    def encode(self, text: str) -> List[str]:
+        return text.split(" ")
+
+    def decode(self, tokens: List[str]) -> str:
+        return " ".join(tokens)
+
+
+def build_vector_store(path: str, embeddings: FakeEmbeddings, size: int = 2000) -> vector_store.NumpyVectorBackend:
+    """Export a synthetic knowledge base of `size` chunks and open it with the numpy backend"""
+
+    texts = [f"Chunk {i}: " + _words(80, str(i)) for i in range(size)]
+    rows = ((
+        {"content": text, "book_id": i // 100, "chunk_index": i % 100},
+        embeddings._vector(text)
+    ) for i, text in enumerate(texts))
+    vector_store.export_numpy_store(rows, path, embeddings.dim, size, version=1)
+    return vector_store.NumpyVectorBackend(path)
+
+
+def install(
+    llm_latency: float = 0.05,
+    seconds_per_token: float = 0.0,
+    completion_tokens: int = 60,
+    embedding_latency: float = 0.02,
+    search_latency: float = 0.1,
+    corpus_size: int = 2000,
+    dim: int = 256
+) -> Dict[str, Any]:
+    """Swap every external dependency for a local stand-in, returning the configuration used"""
+
+    def create_chat_model(api_key, model, temperature, http_client, http_async_client, callbacks):
+        return FakeChatModel(
+            model_name=model,
+            latency=llm_latency,
+            seconds_per_token=seconds_per_token,
+            completion_tokens=completion_tokens,
+            callbacks=callbacks
+        )
+
+    llm_pool.create_chat_model = create_chat_model
+    embedding_cache.OpenAIEmbeddings = lambda **kwargs: FakeEmbeddings(dim, embedding_latency)
+
+    search = FakeMarketSearch(search_latency)
+    tools._market_search = search.run
+    tools._amarket_search = search.arun
+
+    path = tempfile.mkdtemp(prefix="bench-vector-store-")
+    atexit.register(shutil.rmtree, path, True)
+    vector_store._backend = build_vector_store(path, FakeEmbeddings(dim, 0.0), corpus_size)
+
+    tokenizer = "cl100k_base"
+    try:
+        memory._encoding()
+    except Exception:
+        # tiktoken downloads its encoding on first use; token counts are approximate without it
+        memory._encoding = lambda: _WhitespaceEncoding()
+        memory.count_tokens.cache_clear()
+        tokenizer = "whitespace"
+
+    return {
+        "llm_latency": llm_latency,
+        "seconds_per_token": seconds_per_token,
+        "completion_tokens": completion_tokens,
+        "embedding_latency": embedding_latency,
+        "search_latency": search_latency,
+        "corpus_size": corpus_size,
+        "dim": dim,
+        "tokenizer": tokenizer
+    }
+
+
+def reset_caches() -> None:
+    """Drop the process-wide embedding, research and answer caches so every turn does the full work"""
+
+    embedding_cache._cache = None
+    market_cache._cache = None
+    answer_cache._cache = None
@@ -0,0 +1,81 @@
+"""
+Compare latency and token cost of the two-pass and single-pass response modes.
+
+Every question is run through the compiled workflow in each mode against the real OpenAI
+API (OPENAI_API_KEY must be set; research questions also need SERP_API_KEY, and strategy
+questions that trigger retrieval need the knowledge base). Token counts and cost come from
+the OpenAI usage reported for every model call in the turn.
+
+Usage:
+    python benchmarks/response_mode_benchmark.py --repeats 3
+"""
+
+# Import langchain
+from langchain_community.callbacks import get_openai_callback
+
+# Other imports
+import os
+import sys
+import time
+import argparse
+import statistics
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from graph import RESPONSE_MODES, get_workflow
+from state import AgentGraphState
+
+DEFAULT_QUESTIONS = [
+    "What investment strategy would you recommend for a beginner?",
+    "How should I allocate my portfolio between stocks and bonds?",
+    "Explain the concept of dollar-cost averaging",
+    "What are the latest market trends in the tech sector?"
+]
+
+
+def run_mode(mode: str, questions: List[str], repeats: int, api_key: str) -> Dict[str, float]:
+    workflow = get_workflow(mode)
+    latencies, prompt_tokens, completion_tokens, costs = [], [], [], []
+
+    for _ in range(repeats):
+        for question in questions:
+            with get_openai_callback() as usage:
+                start = time.perf_counter()
+                workflow.invoke(AgentGraphState(human_input=question, api_key=api_key))
+                latencies.append(time.perf_counter() - start)
+            prompt_tokens.append(usage.prompt_tokens)
+            completion_tokens.append(usage.completion_tokens)
+            costs.append(usage.total_cost)
+
+    return {
+        "p50_s": statistics.median(latencies),
+        "mean_s": statistics.mean(latencies),
+        "max_s": max(latencies),
+        "prompt_tokens": statistics.mean(prompt_tokens),
+        "completion_tokens": statistics.mean(completion_tokens),
+        "cost_usd": statistics.mean(costs)
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", nargs="*", default=DEFAULT_QUESTIONS)
+    parser.add_argument("--repeats", type=int, default=1)
+    args = parser.parse_args()
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        parser.error("OPENAI_API_KEY must be set")
+
+    print(f"{len(args.questions)} questions x {args.repeats} repeats, means are per turn")
+    print(f"{'mode':<12} {'p50 s':>7} {'mean s':>7} {'max s':>7} {'prompt tok':>11} {'compl tok':>10} {'cost $':>9}")
+    for mode in RESPONSE_MODES:
+        r = run_mode(mode, args.questions, args.repeats, api_key)
+        print(
+            f"{mode:<12} {r['p50_s']:>7.2f} {r['mean_s']:>7.2f} {r['max_s']:>7.2f} "
+            f"{r['prompt_tokens']:>11.0f} {r['completion_tokens']:>10.0f} {r['cost_usd']:>9.4f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
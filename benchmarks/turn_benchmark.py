@@ -0,0 +1,336 @@
+"""
+Offline benchmark of turns through the graph, with local stand-ins for every external service.
+
+OpenAI, SerpAPI and the knowledge base are replaced by the deterministic fakes in
+benchmarks/fakes.py, so runs need no keys or network and differ only by the code under test.
+Measures:
+
+- end-to-end turns for each route (investment strategy with RAG, research with a tool call),
+  through the synchronous and async graphs
+- microbenchmarks for generate_rag_queries, TradingAgent._format_chat_history and
+  Graph._track_state
+
+Latency is timed without tracemalloc; allocations (peak and retained KiB per call) come from a
+separate, shorter pass with tracemalloc on. Results can be saved as a baseline and later runs
+compared against it; a p50, p95 or peak allocation more than --tolerance above the baseline
+(and by more than a small absolute amount) is reported as a regression and makes the script
+exit non-zero.
+
+Usage:
+    python benchmarks/turn_benchmark.py --save-baseline benchmarks/baseline.json
+    python benchmarks/turn_benchmark.py --baseline benchmarks/baseline.json
+"""
+
+# Other imports
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import tracemalloc
+import contextlib
+import numpy as np
+from typing import Any, Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fakes
+from state import AgentGraphState
+from agents import TradingAgent
+from graph import Graph, get_workflow
+from tools import generate_rag_queries
+from tracing import Tracer
+
+STRATEGY_QUESTIONS = [
+    "What investment strategy would you recommend for a beginner?",
+    "How should I allocate my portfolio between stocks and bonds?",
+    "Explain the concept of dollar-cost averaging",
+    "How often should I rebalance a 60/40 portfolio?",
+    "Is it worth holding international equities for diversification?"
+]
+
+RESEARCH_QUESTIONS = [
+    "What are the latest market trends in the tech sector?",
+    "What is the current price of AAPL?",
+    "Any news on NVDA earnings this quarter?",
+    "How is the energy sector trading today?",
+    "What are the latest developments for Tesla?"
+]
+
+ROUTES = {
+    "investment_strategy": STRATEGY_QUESTIONS,
+    "research": RESEARCH_QUESTIONS
+}
+
+# Metrics compared against the baseline (higher is worse for all of them), with the smallest
+# absolute increase counted as a regression, so microsecond jitter isn't flagged
+COMPARED = {"p50_ms": 0.05, "p95_ms": 0.05, "peak_kib": 1.0}
+
+
+def _summarize(latencies: List[float], peaks: List[float], retained: List[float]) -> Dict[str, float]:
+    ms = np.asarray(latencies) * 1000
+    return {
+        "n": len(latencies),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+        # Median, since a single turn that lazily builds a client or a background thread allocating
+        # during the window would otherwise swing the compared value run to run
+        "peak_kib": float(np.median(peaks)) / 1024 if peaks else 0.0,
+        "retained_kib": float(np.mean(retained)) / 1024 if retained else 0.0
+    }
+
+
+def measure(fn: Callable[[int], Any], iterations: int, alloc_iterations: int, warmup: int = 1) -> Dict[str, float]:
+    """Time fn(i) over iterations, then sample its allocations with tracemalloc"""
+
+    for i in range(warmup):
+        fn(i)
+
+    latencies = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        fn(i)
+        latencies.append(time.perf_counter() - start)
+
+    peaks, retained = [], []
+    tracemalloc.start()
+    try:
+        for i in range(alloc_iterations):
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            fn(i)
+            after, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before)
+            retained.append(after - before)
+    finally:
+        tracemalloc.stop()
+
+    return _summarize(latencies, peaks, retained)
+
+
+class Conversation:
+    """Carries messages and memory between turns the way the app does, restarting every few turns"""
+
+    def __init__(self, questions: List[str], turns_per_conversation: int) -> None:
+        self.questions = questions
+        self.turns_per_conversation = turns_per_conversation
+        self.reset()
+
+    def reset(self) -> None:
+        self.messages: List[Dict[str, str]] = []
+        self.memory: Dict[str, Any] = {"conversation_summary": "", "summarized_messages": 0}
+
+    def state(self, i: int) -> AgentGraphState:
+        if i % self.turns_per_conversation == 0:
+            self.reset()
+        return AgentGraphState(
+            human_input=self.questions[i % len(self.questions)],
+            api_key="benchmark",
+            messages=list(self.messages),
+            **self.memory
+        )
+
+    def update(self, final_state: Dict[str, Any]) -> None:
+        self.messages = final_state.get("messages", [])
+        self.memory = {
+            "conversation_summary": final_state.get("conversation_summary", ""),
+            "summarized_messages": final_state.get("summarized_messages", 0)
+        }
+
+
+def turn_benchmark(questions: List[str], args: argparse.Namespace, asynchronous: bool) -> Callable[[int], Any]:
+    workflow = get_workflow(asynchronous=asynchronous)
+    conversation = Conversation(questions, args.turns_per_conversation)
+    loop = asyncio.new_event_loop() if asynchronous else None
+    devnull = open(os.devnull, "w")
+
+    def turn(i: int) -> None:
+        if not args.warm_caches:
+            fakes.reset_caches()
+        state = conversation.state(i)
+        # The research agent's executor is verbose; its output is not part of the measurement
+        with contextlib.redirect_stdout(devnull):
+            if loop is not None:
+                final_state = loop.run_until_complete(workflow.ainvoke(state))
+            else:
+                final_state = workflow.invoke(state)
+        conversation.update(final_state)
+
+    return turn
+
+
+def rag_queries_benchmark() -> Callable[[int], Any]:
+    def run(i: int) -> None:
+        # A fresh embedding cache each call, so the embedding and search path is measured too
+        fakes.reset_caches()
+        generate_rag_queries(STRATEGY_QUESTIONS[i % len(STRATEGY_QUESTIONS)], api_key="benchmark")
+
+    return run
+
+
+def _history(turns: int) -> List[Dict[str, str]]:
+    messages = []
+    for i in range(turns):
+        messages.append({"role": "user", "content": STRATEGY_QUESTIONS[i % len(STRATEGY_QUESTIONS)]})
+        messages.append({"role": "assistant", "content": fakes._words(150, str(i))})
+    return messages
+
+
+def chat_history_benchmark(turns: int) -> Callable[[int], Any]:
+    agent = TradingAgent()
+    # No pre-rendered chat_context, so the history is rendered from the messages
+    state = AgentGraphState(human_input="How should I rebalance?", messages=_history(turns), conversation_summary=fakes._words(200, "summary"))
+
+    def run(i: int) -> None:
+        agent._format_chat_history(state)
+
+    return run
+
+
+def track_state_benchmark(mode: str) -> Callable[[int], Any]:
+    graph = Graph(TradingAgent(), tracer=Tracer(mode=mode, buffer_size=1000))
+    nodes = ("router", "rag_caller", "investment_strategy", "end", "add_ai_message")
+    history = _history(10)
+    chat_context = fakes._words(1200, "context")
+
+    def new_turn() -> AgentGraphState:
+        return AgentGraphState(
+            human_input="How should I rebalance?",
+            messages=list(history),
+            chat_context=chat_context,
+            trace_id=graph.tracer.start_trace()
+        )
+
+    holder = {"state": new_turn()}
+
+    def run(i: int) -> None:
+        state = holder["state"]
+        node = nodes[i % len(nodes)]
+        if node == "add_ai_message":
+            state["messages"].append({"role": "assistant", "content": "answer"})
+        else:
+            state[f"{node}_response"] = f"{node} output {i}"
+        graph._track_state(state, node)
+        if node == nodes[-1]:
+            graph.tracer.end_trace(state["trace_id"])
+            holder["state"] = new_turn()
+
+    return run
+
+
+def run_all(args: argparse.Namespace) -> Dict[str, Dict[str, float]]:
+    results: Dict[str, Dict[str, float]] = {}
+
+    variants = [False, True] if args.include_async else [False]
+    for asynchronous in variants:
+        for route, questions in ROUTES.items():
+            name = f"turn.{'async.' if asynchronous else ''}{route}"
+            results[name] = measure(turn_benchmark(questions, args, asynchronous), args.turns, args.alloc_turns)
+            print(f"  {name}", file=sys.stderr)
+
+    micro = {
+        "micro.generate_rag_queries": rag_queries_benchmark(),
+        "micro.format_chat_history": chat_history_benchmark(20),
+        "micro.track_state.off": track_state_benchmark("off"),
+        "micro.track_state.all": track_state_benchmark("all")
+    }
+    for name, fn in micro.items():
+        iterations = args.micro_iterations if name != "micro.generate_rag_queries" else max(1, args.micro_iterations // 10)
+        results[name] = measure(fn, iterations, max(1, iterations // 10), warmup=10)
+        print(f"  {name}", file=sys.stderr)
+
+    return results
+
+
+def print_results(results: Dict[str, Dict[str, float]], baseline: Optional[Dict[str, Dict[str, float]]], tolerance: float) -> List[str]:
+    """Print the results table, with deltas against the baseline; returns the regressions found"""
+
+    regressions = []
+    header = f"{'benchmark':<30} {'n':>5} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'peak KiB':>9} {'kept KiB':>9}"
+    if baseline is not None:
+        header += f" {'p50 Δ':>8} {'p95 Δ':>8} {'peak Δ':>8}"
+    print(header)
+
+    for name, r in results.items():
+        line = (
+            f"{name:<30} {r['n']:>5} {r['mean_ms']:>9.3f} {r['p50_ms']:>9.3f} {r['p95_ms']:>9.3f} "
+            f"{r['p99_ms']:>9.3f} {r['peak_kib']:>9.1f} {r['retained_kib']:>9.1f}"
+        )
+        base = (baseline or {}).get(name)
+        if base is not None:
+            for metric, floor in COMPARED.items():
+                change = (r[metric] - base[metric]) / base[metric] if base[metric] else 0.0
+                line += f" {change:>+7.1%}"
+                if change > tolerance and r[metric] - base[metric] > floor:
+                    regressions.append(f"{name} {metric}: {base[metric]:.3f} -> {r[metric]:.3f} ({change:+.1%})")
+        elif baseline is not None:
+            line += f" {'new':>8}"
+        print(line)
+
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=20, help="timed turns per route")
+    parser.add_argument("--alloc-turns", type=int, default=10, help="turns per route run under tracemalloc")
+    parser.add_argument("--turns-per-conversation", type=int, default=5)
+    parser.add_argument("--micro-iterations", type=int, default=2000)
+    parser.add_argument("--include-async", action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument("--warm-caches", action="store_true", help="keep embedding, research and answer caches between turns")
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--seconds-per-token", type=float, default=0.0)
+    parser.add_argument("--completion-tokens", type=int, default=60)
+    parser.add_argument("--embedding-latency", type=float, default=0.02)
+    parser.add_argument("--search-latency", type=float, default=0.1)
+    parser.add_argument("--corpus-size", type=int, default=2000)
+    parser.add_argument("--baseline", help="compare against a baseline JSON file")
+    parser.add_argument("--save-baseline", help="write the results as a baseline JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="relative increase reported as a regression")
+    args = parser.parse_args()
+
+    config = fakes.install(
+        llm_latency=args.llm_latency,
+        seconds_per_token=args.seconds_per_token,
+        completion_tokens=args.completion_tokens,
+        embedding_latency=args.embedding_latency,
+        search_latency=args.search_latency,
+        corpus_size=args.corpus_size
+    )
+    config.update(turns=args.turns, warm_caches=args.warm_caches)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            saved = json.load(f)
+        baseline = saved["results"]
+        if saved.get("config") != config:
+            print(f"Warning: baseline was recorded with a different configuration: {saved.get('config')}", file=sys.stderr)
+
+    print(f"Running benchmarks with {config}", file=sys.stderr)
+    results = run_all(args)
+    regressions = print_results(results, baseline, args.tolerance)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({
+                "config": config,
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "results": results
+            }, f, indent=2)
+        print(f"Saved baseline to {args.save_baseline}", file=sys.stderr)
+
+    if regressions:
+        print("\nRegressions over baseline:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+# Import db connection
+import psycopg2
+from psycopg2 import extensions
+
+# Import other
+import os
+import time
+import atexit
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available within the checkout timeout"""
+
+
+class _PooledConnection:
+    """Bookkeeping for a single connection owned by the pool"""
+
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn: Any) -> None:
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class ConnectionPool:
+    """Thread-safe Postgres connection pool with health checks and usage metrics"""
+
+    def __init__(
+        self,
+        dsn: str,
+        min_size: int = 1,
+        max_size: int = 10,
+        timeout: float = 30.0,
+        health_check_interval: float = 30.0,
+        max_lifetime: float = 1800.0
+    ) -> None:
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError(f"Invalid pool size: min_size={min_size}, max_size={max_size}")
+
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.max_lifetime = max_lifetime
+
+        self._idle: Deque[_PooledConnection] = deque()
+        self._checked_out: Dict[int, _PooledConnection] = {}
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+        # Metrics
+        self._checkouts = 0
+        self._timeouts = 0
+        self._created = 0
+        self._recycled = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+        for _ in range(min_size):
+            self._idle.append(self._connect())
+            self._size += 1
+
+    def _connect(self) -> _PooledConnection:
+        """Open a new physical connection"""
+
+        conn = psycopg2.connect(self.dsn)
+        with self._cond:
+            self._created += 1
+        return _PooledConnection(conn)
+
+    def _is_healthy(self, entry: _PooledConnection) -> bool:
+        """Check that an idle connection is still usable before handing it out"""
+
+        conn = entry.conn
+        if conn.closed:
+            return False
+        if time.monotonic() - entry.created_at > self.max_lifetime:
+            return False
+        if time.monotonic() - entry.last_used < self.health_check_interval:
+            return True
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _close_quietly(self, entry: _PooledConnection) -> None:
+        """Close a physical connection, ignoring errors from already-broken ones"""
+
+        try:
+            if not entry.conn.closed:
+                entry.conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _discard(self, entry: _PooledConnection) -> None:
+        """Close a connection and release its slot"""
+
+        self._close_quietly(entry)
+        with self._cond:
+            self._size -= 1
+            self._recycled += 1
+            self._cond.notify()
+
+    def getconn(self) -> Any:
+        """Borrow a connection, waiting up to the pool timeout if all are in use"""
+
+        start = time.monotonic()
+        deadline = start + self.timeout
+        entry: Optional[_PooledConnection] = None
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout("Connection pool is closed")
+                if self._idle:
+                    entry = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(f"No connection available after {self.timeout:.1f}s")
+                self._cond.wait(remaining)
+
+            waited = time.monotonic() - start
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+
+        # Health check and connect outside the lock so other threads aren't blocked
+        # A broken connection keeps its slot and is replaced in place
+        if entry is not None and not self._is_healthy(entry):
+            self._close_quietly(entry)
+            with self._cond:
+                self._recycled += 1
+            entry = None
+
+        if entry is None:
+            try:
+                entry = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+
+        with self._cond:
+            self._checked_out[id(entry.conn)] = entry
+
+        return entry.conn
+
+    def putconn(self, conn: Any, discard: bool = False) -> None:
+        """Return a connection to the pool, recycling it if it is broken"""
+
+        with self._cond:
+            entry = self._checked_out.pop(id(conn), None)
+        if entry is None:
+            raise ValueError("Connection does not belong to this pool")
+
+        if not discard and not conn.closed:
+            status = conn.get_transaction_status()
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                discard = True
+            elif status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    discard = True
+
+        if discard or conn.closed or self._closed:
+            self._discard(entry)
+            return
+
+        entry.last_used = time.monotonic()
+        with self._cond:
+            self._idle.append(entry)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        """Borrow a connection for the duration of a with-block"""
+
+        conn = self.getconn()
+        discard = False
+        try:
+            yield conn
+            conn.commit()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            discard = True
+            raise
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            self.putconn(conn, discard=discard)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return a snapshot of the pool metrics"""
+
+        with self._cond:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": len(self._checked_out),
+                "max_size": self.max_size,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "connections_created": self._created,
+                "connections_recycled": self._recycled,
+                "wait_time_total": self._wait_total,
+                "wait_time_max": self._wait_max,
+                "wait_time_avg": self._wait_total / self._checkouts if self._checkouts else 0.0
+            }
+
+    def close(self) -> None:
+        """Close all idle connections and refuse further checkouts"""
+
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+
+        for entry in idle:
+            if not entry.conn.closed:
+                entry.conn.close()
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Return the process-wide connection pool, creating it on first use"""
+
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    dsn=os.getenv("PG_CONNECTION_STRING"),
+                    min_size=int(os.getenv("PG_POOL_MIN_SIZE", "1")),
+                    max_size=int(os.getenv("PG_POOL_MAX_SIZE", "10")),
+                    timeout=float(os.getenv("PG_POOL_TIMEOUT", "30")),
+                    health_check_interval=float(os.getenv("PG_POOL_HEALTH_CHECK_INTERVAL", "30")),
+                    max_lifetime=float(os.getenv("PG_POOL_MAX_LIFETIME", "1800"))
+                )
+    return _pool
+
+
+_async_pool: Optional[Any] = None
+
+
+async def get_async_pool() -> Any:
+    """Return the process-wide asyncio pool (psycopg 3), opening it on first use"""
+
+    # psycopg 3 is only needed by the async graph, so it is imported lazily
+    from psycopg_pool import AsyncConnectionPool
+
+    global _async_pool
+    if _async_pool is None:
+        pool = AsyncConnectionPool(
+            os.getenv("PG_CONNECTION_STRING"),
+            min_size=int(os.getenv("PG_POOL_MIN_SIZE", "1")),
+            max_size=int(os.getenv("PG_POOL_MAX_SIZE", "10")),
+            timeout=float(os.getenv("PG_POOL_TIMEOUT", "30")),
+            max_lifetime=float(os.getenv("PG_POOL_MAX_LIFETIME", "1800")),
+            check=AsyncConnectionPool.check_connection,
+            open=False
+        )
+        await pool.open()
+        # Another task may have opened a pool while this one was connecting
+        if _async_pool is None:
+            _async_pool = pool
+        else:
+            await pool.close()
+    return _async_pool
+
+
+def pool_metrics() -> Dict[str, Any]:
+    """Return metrics for the process-wide pools, or an empty dict if none is open"""
+
+    metrics = _pool.stats() if _pool is not None else {}
+    if _async_pool is not None:
+        metrics["async"] = _async_pool.get_stats()
+    return metrics
+
+
+@atexit.register
+def close_pool() -> None:
+    """Close the process-wide pool"""
+
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
@@ -0,0 +1,280 @@
+# Import langchain
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+
+# Import pooled HTTP clients, token counting and usage accounting
+from llm_pool import get_llm_pool
+from memory import count_tokens
+from metrics import get_metrics
+
+# Import other
+import os
+import time
+import array
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+
+def normalize_text(text: str) -> str:
+    """Normalize text so trivially different strings share a cache entry"""
+
+    return " ".join(unicodedata.normalize("NFKC", text).split()).lower()
+
+
+def cache_key(model: str, text: str) -> str:
+    """Build the cache key for a (model, normalized text) pair"""
+
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Two-tier embedding cache: an in-memory LRU in front of an optional SQLite store"""
+
+    def __init__(
+        self,
+        max_entries: int = 10000,
+        disk_path: Optional[str] = None,
+        disk_max_entries: int = 200000,
+        ttl: Optional[float] = None
+    ) -> None:
+        self.max_entries = max_entries
+        self.disk_max_entries = disk_max_entries
+        self.ttl = ttl
+
+        self._memory: "OrderedDict[str, Tuple[List[float], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk: Optional[sqlite3.Connection] = None
+        self._disk_writes = 0
+
+        # Stats
+        self._memory_hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+        if disk_path:
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False, isolation_level=None)
+            self._disk.execute("PRAGMA journal_mode=WAL")
+            self._disk.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            self._disk.execute("CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings (last_access)")
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl is not None and now - created_at > self.ttl
+
+    def _remember(self, key: str, vector: List[float], created_at: float) -> None:
+        """Insert into the memory tier, evicting least recently used entries (lock held)"""
+
+        self._memory[key] = (vector, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._evictions += 1
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """Look up embeddings for texts, returning None for misses"""
+
+        now = time.time()
+        keys = [cache_key(model, text) for text in texts]
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        disk_lookups: Dict[str, List[int]] = {}
+
+        with self._lock:
+            for i, key in enumerate(keys):
+                entry = self._memory.get(key)
+                if entry is not None and not self._expired(entry[1], now):
+                    self._memory.move_to_end(key)
+                    results[i] = entry[0]
+                    self._memory_hits += 1
+                else:
+                    if entry is not None:
+                        del self._memory[key]
+                    disk_lookups.setdefault(key, []).append(i)
+
+            if disk_lookups and self._disk is not None:
+                placeholders = ", ".join("?" * len(disk_lookups))
+                rows = self._disk.execute(
+                    f"SELECT key, vector, created_at FROM embeddings WHERE key IN ({placeholders})",
+                    list(disk_lookups)
+                ).fetchall()
+
+                found = []
+                for key, blob, created_at in rows:
+                    if self._expired(created_at, now):
+                        continue
+                    vector = array.array("f", blob).tolist()
+                    self._remember(key, vector, created_at)
+                    for i in disk_lookups.pop(key):
+                        results[i] = vector
+                        self._disk_hits += 1
+                    found.append(key)
+
+                if found:
+                    self._disk.executemany(
+                        "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                        [(now, key) for key in found]
+                    )
+
+            self._misses += sum(len(indexes) for indexes in disk_lookups.values())
+
+        return results
+
+    def put_many(self, model: str, texts: List[str], vectors: List[List[float]]) -> None:
+        """Store embeddings for texts in both tiers"""
+
+        now = time.time()
+        rows = []
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                key = cache_key(model, text)
+                self._remember(key, list(vector), now)
+                rows.append((key, model, array.array("f", vector).tobytes(), now, now))
+
+            if self._disk is not None and rows:
+                self._disk.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, model, vector, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                    rows
+                )
+                self._disk_writes += len(rows)
+                if self._disk_writes >= 1000:
+                    self._evict_disk(now)
+                    self._disk_writes = 0
+
+    def _evict_disk(self, now: float) -> None:
+        """Apply TTL and size limits to the disk tier (lock held)"""
+
+        if self.ttl is not None:
+            cursor = self._disk.execute("DELETE FROM embeddings WHERE created_at < ?", (now - self.ttl,))
+            self._evictions += cursor.rowcount
+
+        count = self._disk.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        overflow = count - self.disk_max_entries
+        if overflow > 0:
+            cursor = self._disk.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_access LIMIT ?)",
+                (overflow,)
+            )
+            self._evictions += cursor.rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss statistics for the cache"""
+
+        with self._lock:
+            lookups = self._memory_hits + self._disk_hits + self._misses
+            return {
+                "memory_hits": self._memory_hits,
+                "disk_hits": self._disk_hits,
+                "misses": self._misses,
+                "hit_rate": (self._memory_hits + self._disk_hits) / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "evictions": self._evictions
+            }
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only sends cache misses to the underlying model"""
+
+    def __init__(self, embeddings: Embeddings, model: str, cache: EmbeddingCache) -> None:
+        self.embeddings = embeddings
+        self.model = model
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts, serving repeats from the cache"""
+
+        results = self.cache.get_many(self.model, texts)
+        missing = [i for i, vector in enumerate(results) if vector is None]
+
+        if missing:
+            # Embed each distinct normalized text once
+            by_key: Dict[str, str] = {}
+            for i in missing:
+                by_key.setdefault(cache_key(self.model, texts[i]), texts[i])
+            unique_texts = list(by_key.values())
+            with get_metrics().span("embeddings.api", texts=len(unique_texts)):
+                vectors = dict(zip(by_key, self.embeddings.embed_documents(unique_texts)))
+                get_metrics().record_usage(self.model, sum(count_tokens(text) for text in unique_texts))
+            self.cache.put_many(self.model, unique_texts, list(vectors.values()))
+            for i in missing:
+                results[i] = vectors[cache_key(self.model, texts[i])]
+
+        return results
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Async version of embed_documents; cache lookups are local, only misses await the API"""
+
+        results = self.cache.get_many(self.model, texts)
+        missing = [i for i, vector in enumerate(results) if vector is None]
+
+        if missing:
+            by_key: Dict[str, str] = {}
+            for i in missing:
+                by_key.setdefault(cache_key(self.model, texts[i]), texts[i])
+            unique_texts = list(by_key.values())
+            with get_metrics().span("embeddings.api", texts=len(unique_texts)):
+                vectors = dict(zip(by_key, await self.embeddings.aembed_documents(unique_texts)))
+                get_metrics().record_usage(self.model, sum(count_tokens(text) for text in unique_texts))
+            self.cache.put_many(self.model, unique_texts, list(vectors.values()))
+            for i in missing:
+                results[i] = vectors[cache_key(self.model, texts[i])]
+
+        return results
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """Async version of embed_query"""
+
+        return (await self.aembed_documents([text]))[0]
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a single query, serving repeats from the cache"""
+
+        # Goes through embed_documents so misses get the same span and token accounting
+        return self.embed_documents([text])[0]
+
+
+_cache: Optional[EmbeddingCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Return the process-wide embedding cache, configured from the environment"""
+
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                ttl = os.getenv("EMBEDDING_CACHE_TTL")
+                _cache = EmbeddingCache(
+                    max_entries=int(os.getenv("EMBEDDING_CACHE_SIZE", "10000")),
+                    disk_path=os.getenv("EMBEDDING_CACHE_PATH") or None,
+                    disk_max_entries=int(os.getenv("EMBEDDING_CACHE_DISK_MAX_ENTRIES", "200000")),
+                    ttl=float(ttl) if ttl else None
+                )
+    return _cache
+
+
+def create_embeddings(api_key: Optional[str] = None, model: str = EMBEDDING_MODEL) -> CachedEmbeddings:
+    """Create an OpenAI embeddings model backed by the shared cache"""
+
+    pool = get_llm_pool()
+    kwargs = {"openai_api_key": api_key} if api_key else {}
+    embeddings = OpenAIEmbeddings(
+        model=model, http_client=pool.http_client, http_async_client=pool.http_async_client, **kwargs
+    )
+    return CachedEmbeddings(embeddings, model, get_embedding_cache())
@@ -0,0 +1,178 @@
+# Import token counting shared with the conversation memory
+from memory import count_tokens, truncate_tokens
+
+# Import other
+import os
+import threading
+import numpy as np
+from typing import Any, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def reciprocal_rank_fusion(query_indexes: np.ndarray, distances: np.ndarray, keys: np.ndarray, k: float = 60.0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Score each distinct key by the sum of 1 / (k + rank) over queries, returning (keys, scores, first hit index)"""
+
+    # Rank hits within their own query by distance, without a Python loop over queries
+    order = np.lexsort((distances, query_indexes))
+    sorted_queries = query_indexes[order]
+    starts = np.flatnonzero(np.r_[True, sorted_queries[1:] != sorted_queries[:-1]])
+    group_start = np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+    ranks = np.empty(len(order), dtype=np.float64)
+    ranks[order] = np.arange(len(order)) - group_start + 1
+
+    unique_keys, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    scores = np.zeros(len(unique_keys), dtype=np.float64)
+    np.add.at(scores, inverse, 1.0 / (k + ranks))
+    return unique_keys, scores, first
+
+
+def mmr_order(embeddings: np.ndarray, relevance: np.ndarray, lambda_mult: float = 0.7, dedup_threshold: float = 0.9) -> List[int]:
+    """Order candidates by maximal marginal relevance, dropping any too similar to one already chosen"""
+
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    unit = embeddings / np.where(norms == 0, 1.0, norms)
+    similarity = unit @ unit.T
+
+    available = np.ones(len(relevance), dtype=bool)
+    max_similarity = np.zeros(len(relevance), dtype=np.float64)
+    order: List[int] = []
+    while available.any():
+        scores = np.where(available, lambda_mult * relevance - (1 - lambda_mult) * max_similarity, -np.inf)
+        best = int(np.argmax(scores))
+        order.append(best)
+        available[best] = False
+        max_similarity = np.maximum(max_similarity, similarity[best])
+        # Overlapping chunks of the same passage embed almost identically
+        available &= similarity[best] < dedup_threshold
+    return order
+
+
+def pack_context(chunks: List[str], max_tokens: int, min_chunk_tokens: int = 100, separator: str = "\n\n") -> List[str]:
+    """Take chunks in order until the token budget is spent, cutting the last one to fit"""
+
+    packed: List[str] = []
+    remaining = max_tokens
+    separator_tokens = count_tokens(separator)
+    for chunk in chunks:
+        cost = count_tokens(chunk) + (separator_tokens if packed else 0)
+        if cost <= remaining:
+            packed.append(chunk)
+            remaining -= cost
+        elif remaining >= min_chunk_tokens:
+            packed.append(truncate_tokens(chunk, remaining - (separator_tokens if packed else 0)))
+            break
+        else:
+            break
+    return packed
+
+
+class ContextFuser:
+    """Turn the hits of all query variations into one deduplicated, token-budgeted context"""
+
+    def __init__(
+        self,
+        candidates_per_query: int = 5,
+        rrf_k: float = 60.0,
+        lambda_mult: float = 0.7,
+        dedup_threshold: float = 0.9,
+        max_tokens: int = 1000,
+        min_chunk_tokens: int = 100
+    ) -> None:
+        self.candidates_per_query = candidates_per_query
+        self.rrf_k = rrf_k
+        self.lambda_mult = lambda_mult
+        self.dedup_threshold = dedup_threshold
+        self.max_tokens = max_tokens
+        self.min_chunk_tokens = min_chunk_tokens
+        self._lock = threading.Lock()
+
+        # Stats
+        self._calls = 0
+        self._candidates = 0
+        self._unique = 0
+        self._near_duplicates = 0
+        self._chunks = 0
+        self._tokens = 0
+
+    def fuse(self, results: List[Dict[str, Any]]) -> List[str]:
+        """Rank hits by RRF, reorder them by MMR and return the chunks to include, best first"""
+
+        if not results:
+            return []
+
+        # Rows are identified by id where the backend reports one, by content otherwise
+        keys = np.array([r.get("id", r["content"]) for r in results])
+        unique_keys, scores, first = reciprocal_rank_fusion(
+            np.array([r["query_index"] for r in results]),
+            np.array([r["distance"] for r in results], dtype=np.float64),
+            keys,
+            self.rrf_k
+        )
+        candidates = [results[i] for i in first]
+        # Backends may attach a chunk's embedding to only one of its rows
+        embeddings = {key: r["embedding"] for key, r in zip(keys.tolist(), results) if r.get("embedding") is not None}
+        candidate_embeddings = [embeddings.get(key) for key in unique_keys.tolist()]
+
+        if all(embedding is not None for embedding in candidate_embeddings):
+            order = mmr_order(
+                np.stack([np.asarray(embedding, dtype=np.float32) for embedding in candidate_embeddings]),
+                scores / scores.max(),
+                self.lambda_mult,
+                self.dedup_threshold
+            )
+        else:
+            order = [int(i) for i in np.argsort(-scores, kind="stable")]
+        chunks = [candidates[i]["content"] for i in order]
+
+        with self._lock:
+            self._calls += 1
+            self._candidates += len(results)
+            self._unique += len(candidates)
+            self._near_duplicates += len(candidates) - len(order)
+        return chunks
+
+    def build_context(self, results: List[Dict[str, Any]]) -> str:
+        """Fuse the hits and pack them into the token budget"""
+
+        packed = pack_context(self.fuse(results), self.max_tokens, self.min_chunk_tokens)
+        with self._lock:
+            self._chunks += len(packed)
+            self._tokens += sum(count_tokens(chunk) for chunk in packed)
+        return "\n\n".join(packed)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return candidate, dedup and packing statistics"""
+
+        with self._lock:
+            calls = self._calls or 1
+            return {
+                "calls": self._calls,
+                "candidates": self._candidates,
+                "unique_chunks": self._unique,
+                "near_duplicates_dropped": self._near_duplicates,
+                "avg_chunks_packed": self._chunks / calls,
+                "avg_tokens_packed": self._tokens / calls
+            }
+
+
+_fuser: Optional[ContextFuser] = None
+_fuser_lock = threading.Lock()
+
+
+def get_fuser() -> ContextFuser:
+    """Return the process-wide context fuser, configured from the environment"""
+
+    global _fuser
+    if _fuser is None:
+        with _fuser_lock:
+            if _fuser is None:
+                _fuser = ContextFuser(
+                    candidates_per_query=int(os.getenv("RAG_CANDIDATES_PER_QUERY", "5")),
+                    rrf_k=float(os.getenv("RAG_RRF_K", "60")),
+                    lambda_mult=float(os.getenv("RAG_MMR_LAMBDA", "0.7")),
+                    dedup_threshold=float(os.getenv("RAG_DEDUP_THRESHOLD", "0.9")),
+                    max_tokens=int(os.getenv("RAG_CONTEXT_TOKENS", "1000"))
+                )
+    return _fuser
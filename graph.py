@@ -1,39 +1,61 @@
 # Import langgraph
 from langgraph.graph import StateGraph
 
-# Import state, agents and prompts
+# Import state and agents
 from state import AgentGraphState
 from agents import TradingAgent
-from prompts import rag_caller_json
+from speculative import get_speculative_executor
+from tracing import Tracer, get_tracer
+from memory import get_memory
+from metrics import get_metrics
+from request_context import request_context
+
+# Import other
+import os
+import time
+import threading
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+RESPONSE_MODES = ("two_pass", "single_pass")
+RESPONSE_MODE = os.getenv("RESPONSE_MODE", "two_pass")
+FUSED_ROUTER = os.getenv("FUSED_ROUTER", "false").lower() in ("1", "true", "yes")
+SPECULATIVE_RETRIEVAL = os.getenv("SPECULATIVE_RETRIEVAL", "false").lower() in ("1", "true", "yes")
+ANSWER_CACHE = os.getenv("ANSWER_CACHE", "false").lower() in ("1", "true", "yes")
+
+# Nodes whose LLM output is the answer shown to the user, per response mode
+ANSWER_NODES = {
+    "two_pass": ("end",),
+    "single_pass": ("investment_strategy", "research")
+}
 
 class Graph:
-    def __init__(self, trading_agent: TradingAgent) -> None:
+    def __init__(
+        self,
+        trading_agent: TradingAgent,
+        response_mode: str = "two_pass",
+        fused_router: bool = False,
+        speculative: bool = False,
+        asynchronous: bool = False,
+        answer_cache: bool = False,
+        tracer: Optional[Tracer] = None
+    ) -> None:
+        if response_mode not in RESPONSE_MODES:
+            raise ValueError(f"Unknown response mode '{response_mode}', expected one of {RESPONSE_MODES}")
+
         self.trading_agent = trading_agent
+        self.response_mode = response_mode
+        self.single_pass = response_mode == "single_pass"
+        self.fused_router = fused_router
+        self.speculative = speculative
+        self.asynchronous = asynchronous
+        self.answer_cache = answer_cache
         self.graph = StateGraph(AgentGraphState)
-        self.debug = True  
+        self.tracer = tracer or get_tracer()
 
     def _track_state(self, state: AgentGraphState, node_name: str) -> AgentGraphState:
-        """Track the state at each node for debugging purposes"""
-        if not self.debug:
-            return state
-            
-        if "execution_path" not in state:
-            state["execution_path"] = []
-        if "state_history" not in state:
-            state["state_history"] = []
+        """Record the keys this node changed in the tracer; a no-op for turns that aren't traced"""
 
-        state["current_node"] = node_name
-        state["execution_path"].append(node_name)
-        
-        state_snapshot = {k: v for k, v in state.items() 
-                         if k not in ["execution_path", "state_history", "current_node"]}
-        
-        # Add the snapshot to the history
-        state["state_history"].append({
-            "node": node_name,
-            "state": state_snapshot
-        })
-        
+        self.tracer.record(state.get("trace_id"), node_name, state)
         return state
     
     def _initialize_memory(self, state: AgentGraphState) -> AgentGraphState:
@@ -41,18 +63,28 @@ class Graph:
 
         if "messages" not in state:
             state["messages"] = []
-        return state
+        # The sampling decision is made once per turn
+        state["trace_id"] = self.tracer.start_trace()
+        return self._track_state(state, "initialize_memory")
     
     def _add_human_message(self, state: AgentGraphState) -> AgentGraphState:
         """Add the human message to the conversation history"""
         
         if "messages" not in state:
             state["messages"] = []
+        
+        # Pick up the summary the previous turn started compacting, before this turn's message is added
+        state = self.trading_agent.apply_memory_summary(state)
             
         # Add the human message to the conversation history
         human_input = state.get("human_input", "")
         if human_input:
             state["messages"].append({"role": "user", "content": human_input})
+        
+        # Render the token-budgeted context once; every agent in the turn reads it from the state
+        state["chat_context"] = get_memory().render(
+            state["messages"], state.get("conversation_summary", ""), state.get("summarized_messages", 0)
+        )
             
         return state
     
@@ -69,21 +101,103 @@ class Graph:
             
         return state
     
+    def compact_memory_node(self, state: AgentGraphState) -> AgentGraphState:
+        """Start summarizing history that has left the context window and bound the raw messages"""
+
+        state = self._track_state(state, "compact_memory_before")
+        updated_state = self.trading_agent.compact_memory_agent(state)
+        self._track_state(updated_state, "compact_memory_after")
+        self.tracer.end_trace(updated_state.get("trace_id"))
+        return updated_state
+    
+    async def acompact_memory_node(self, state: AgentGraphState) -> AgentGraphState:
+        """Async version of compact_memory_node"""
+
+        state = self._track_state(state, "compact_memory_before")
+        updated_state = await self.trading_agent.acompact_memory_agent(state)
+        self._track_state(updated_state, "compact_memory_after")
+        self.tracer.end_trace(updated_state.get("trace_id"))
+        return updated_state
+    
+    def answer_cache_node(self, state: AgentGraphState) -> AgentGraphState:
+        """Answer from the semantic cache when a similar question was answered before"""
+
+        state = self._track_state(state, "answer_cache_before")
+        updated_state = self.trading_agent.answer_cache_agent(state)
+        return self._track_state(updated_state, "answer_cache_after")
+    
+    async def aanswer_cache_node(self, state: AgentGraphState) -> AgentGraphState:
+        """Async version of answer_cache_node"""
+
+        state = self._track_state(state, "answer_cache_before")
+        updated_state = await self.trading_agent.aanswer_cache_agent(state)
+        return self._track_state(updated_state, "answer_cache_after")
+    
+    def store_answer_node(self, state: AgentGraphState) -> AgentGraphState:
+        """Store the turn's answer in the semantic cache"""
+
+        return self.trading_agent.store_answer_agent(state)
+    
+    def _route_after_answer_cache(self, state: AgentGraphState) -> Union[str, List[str]]:
+        """Skip the agents on a cache hit; otherwise start the router (and speculative retrieval)"""
+
+        if state.get("answer_cache_hit"):
+            return "add_ai_message"
+        return ["router", "speculative_retrieval"] if self.speculative else "router"
+    
     def router_node(self, state: AgentGraphState) -> AgentGraphState:
         """Call the router agent and update state"""
 
 
         state = self._track_state(state, "router_before")
+        start = time.perf_counter()
         
-        # Call the agent - pass the state to the agent
-        self.trading_agent.state = state
-        updated_state = self.trading_agent.router_agent()
+        # Call the agent - pass the state to the agent; the fused router also makes the RAG decision
+        if self.fused_router:
+            updated_state = self.trading_agent.fused_router_agent(state)
+        else:
+            updated_state = self.trading_agent.router_agent(state)
+        
+        updated_state["branch_timings"] = {"router": time.perf_counter() - start}
         
         # Track state after execution
         updated_state = self._track_state(updated_state, "router_after")
         
         return updated_state
     
+    async def arouter_node(self, state: AgentGraphState) -> AgentGraphState:
+        """Async version of router_node"""
+
+        state = self._track_state(state, "router_before")
+        start = time.perf_counter()
+        
+        if self.fused_router:
+            updated_state = await self.trading_agent.afused_router_agent(state)
+        else:
+            updated_state = await self.trading_agent.arouter_agent(state)
+        
+        updated_state["branch_timings"] = {"router": time.perf_counter() - start}
+        
+        return self._track_state(updated_state, "router_after")
+    
+    def speculative_retrieval_node(self, state: AgentGraphState) -> Dict[str, Any]:
+        """Start knowledge base retrieval on the raw input while the router runs"""
+
+        # Runs in parallel with the router, so it returns only its own key
+        return self.trading_agent.speculative_rag_agent(state)
+    
+    async def aspeculative_retrieval_node(self, state: AgentGraphState) -> Dict[str, Any]:
+        """Async version of speculative_retrieval_node"""
+
+        return await self.trading_agent.aspeculative_rag_agent(state)
+    
+    def dispatch_node(self, state: AgentGraphState) -> AgentGraphState:
+        """Join the router and speculative branches, dropping retrieval the route doesn't need"""
+
+        if self._route_based_on_response(state) != "rag_caller":
+            get_speculative_executor().discard(state.get("speculative_handle"))
+        return state
+    
     def _route_based_on_response(self, state: AgentGraphState) -> str:
         """Determine which node to route to based on the router response"""
 
@@ -100,11 +214,20 @@ class Graph:
         state = self._track_state(state, "rag_caller_before")
         
         # Call the agent - pass the state to the agent
-        self.trading_agent.state = state
+        updated_state = self.trading_agent.rag_caller_agent(state)
+        
+        updated_state = self._track_state(updated_state, "rag_caller_after")
+        
+        updated_state["next_node"] = "investment_strategy"
+        
+        return updated_state
+    
+    async def arag_caller_node(self, state: AgentGraphState) -> AgentGraphState:
+        """Async version of rag_caller_node"""
 
-        # Pass the guided_json configuration to the agent
-        self.trading_agent.rag_caller_json = rag_caller_json
-        updated_state = self.trading_agent.rag_caller_agent()
+        state = self._track_state(state, "rag_caller_before")
+        
+        updated_state = await self.trading_agent.arag_caller_agent(state)
         
         updated_state = self._track_state(updated_state, "rag_caller_after")
         
@@ -118,67 +241,146 @@ class Graph:
         state = self._track_state(state, "investment_strategy_before")
         
         # Call the agent - pass the state to the agent
-        self.trading_agent.state = state
-        updated_state = self.trading_agent.investment_strategy_agent()
+        updated_state = self.trading_agent.investment_strategy_agent(state, single_pass=self.single_pass)
         
         # Track state after execution
         updated_state = self._track_state(updated_state, "investment_strategy_after")
         
         return updated_state
     
+    async def ainvestment_strategy_node(self, state: AgentGraphState) -> AgentGraphState:
+        """Async version of investment_strategy_node"""
+
+        state = self._track_state(state, "investment_strategy_before")
+        
+        updated_state = await self.trading_agent.ainvestment_strategy_agent(state, single_pass=self.single_pass)
+        
+        return self._track_state(updated_state, "investment_strategy_after")
+    
     def research_node(self, state: AgentGraphState) -> AgentGraphState:
         """Call the research agent and update state"""
 
         state = self._track_state(state, "research_before")
-        self.trading_agent.state = state
-        updated_state = self.trading_agent.research_agent()
+        updated_state = self.trading_agent.research_agent(state, single_pass=self.single_pass)
         
         # Track state after execution
         updated_state = self._track_state(updated_state, "research_after")
         
         return updated_state
     
+    async def aresearch_node(self, state: AgentGraphState) -> AgentGraphState:
+        """Async version of research_node"""
+
+        state = self._track_state(state, "research_before")
+        updated_state = await self.trading_agent.aresearch_agent(state, single_pass=self.single_pass)
+        
+        return self._track_state(updated_state, "research_after")
+    
     def end_node(self, state: AgentGraphState) -> AgentGraphState:
         """Call the end agent and update state"""
 
         # Track state before execution
         state = self._track_state(state, "end_before")
         
-        # Call the agent - pass the state to the agent
-        self.trading_agent.state = state
-        updated_state = self.trading_agent.end_agent()
+        # Call the agent - pass the state to the agent; in single-pass mode the answer is already formatted
+        if self.single_pass:
+            updated_state = self.trading_agent.passthrough_end_agent(state)
+        else:
+            updated_state = self.trading_agent.end_agent(state)
         
         # Track state after execution
         updated_state = self._track_state(updated_state, "end_after")
         
         return updated_state
     
+    async def aend_node(self, state: AgentGraphState) -> AgentGraphState:
+        """Async version of end_node"""
+
+        state = self._track_state(state, "end_before")
+        
+        if self.single_pass:
+            updated_state = self.trading_agent.passthrough_end_agent(state)
+        else:
+            updated_state = await self.trading_agent.aend_agent(state)
+        
+        return self._track_state(updated_state, "end_after")
+    
+    def _node(self, name: str, sync_fn: Callable[..., Any], async_fn: Optional[Callable[..., Any]] = None) -> Callable[..., Any]:
+        """Pick the node implementation for this graph's execution model, timed as a node.<name> span"""
+
+        # The turn's API key is also put in the request context, for tools that agents call
+        # without the state, e.g. from an AgentExecutor
+        metrics = get_metrics()
+        stage = f"node.{name}"
+
+        if not self.asynchronous:
+            def run_sync(state: AgentGraphState) -> Any:
+                with request_context(openai_api_key=state.get("api_key")), metrics.span(stage):
+                    return sync_fn(state)
+            return run_sync
+
+        if async_fn is not None:
+            async def run_async(state: AgentGraphState) -> Any:
+                with request_context(openai_api_key=state.get("api_key")), metrics.span(stage):
+                    return await async_fn(state)
+            return run_async
+
+        # Cheap bookkeeping nodes run inline on the event loop instead of hopping to a thread
+        async def run_inline(state: AgentGraphState) -> Any:
+            with request_context(openai_api_key=state.get("api_key")), metrics.span(stage):
+                return sync_fn(state)
+        return run_inline
+    
     def build(self) -> StateGraph:
         """Build the graph"""
 
         # Add memory management nodes
-        self.graph.add_node("initialize_memory", self._initialize_memory)
-        self.graph.add_node("add_human_message", self._add_human_message)
-        self.graph.add_node("add_ai_message", self._add_ai_message)
-        self.graph.add_node("router", self.router_node)
+        self.graph.add_node("initialize_memory", self._node("initialize_memory", self._initialize_memory))
+        self.graph.add_node("add_human_message", self._node("add_human_message", self._add_human_message))
+        self.graph.add_node("add_ai_message", self._node("add_ai_message", self._add_ai_message))
+        self.graph.add_node("compact_memory", self._node("compact_memory", self.compact_memory_node, self.acompact_memory_node))
+        self.graph.add_node("router", self._node("router", self.router_node, self.arouter_node))
 
         self.graph.add_node(
             "rag_caller",
-            self.rag_caller_node
+            self._node("rag_caller", self.rag_caller_node, self.arag_caller_node)
         )
         
-        self.graph.add_node("research", self.research_node)
-        self.graph.add_node("investment_strategy", self.investment_strategy_node)
-        self.graph.add_node("end", self.end_node)
+        self.graph.add_node("research", self._node("research", self.research_node, self.aresearch_node))
+        self.graph.add_node("investment_strategy", self._node("investment_strategy", self.investment_strategy_node, self.ainvestment_strategy_node))
+        self.graph.add_node("end", self._node("end", self.end_node, self.aend_node))
 
         self.graph.set_entry_point("initialize_memory")
-        self.graph.set_finish_point("add_ai_message")
+        self.graph.add_edge("add_ai_message", "compact_memory")
+        self.graph.set_finish_point("compact_memory")
 
         self.graph.add_edge("initialize_memory", "add_human_message")
-        self.graph.add_edge("add_human_message", "router")
+
+        route_source = "router"
+        if self.speculative:
+            # Fan out: retrieval starts alongside the router; fan in before routing
+            self.graph.add_node("speculative_retrieval", self._node("speculative_retrieval", self.speculative_retrieval_node, self.aspeculative_retrieval_node))
+            self.graph.add_node("dispatch", self._node("dispatch", self.dispatch_node))
+            self.graph.add_edge(["router", "speculative_retrieval"], "dispatch")
+            route_source = "dispatch"
+
+        if self.answer_cache:
+            # A cached answer goes straight to the history; fresh answers are stored after the end node
+            self.graph.add_node("answer_cache", self._node("answer_cache", self.answer_cache_node, self.aanswer_cache_node))
+            self.graph.add_node("store_answer", self._node("store_answer", self.store_answer_node))
+            self.graph.add_edge("add_human_message", "answer_cache")
+            self.graph.add_conditional_edges(
+                "answer_cache",
+                self._route_after_answer_cache,
+                ["add_ai_message", "router"] + (["speculative_retrieval"] if self.speculative else [])
+            )
+        else:
+            self.graph.add_edge("add_human_message", "router")
+            if self.speculative:
+                self.graph.add_edge("add_human_message", "speculative_retrieval")
 
         self.graph.add_conditional_edges(
-            "router",
+            route_source,
             self._route_based_on_response,
             {
                 "rag_caller": "rag_caller",
@@ -190,7 +392,116 @@ class Graph:
 
         self.graph.add_edge("research", "end")
         self.graph.add_edge("investment_strategy", "end")
-        self.graph.add_edge("end", "add_ai_message")
+        if self.answer_cache:
+            self.graph.add_edge("end", "store_answer")
+            self.graph.add_edge("store_answer", "add_ai_message")
+        else:
+            self.graph.add_edge("end", "add_ai_message")
         
         # Compile the workflow
-        return self.graph.compile()
\ No newline at end of file
+        return self.graph.compile()
+
+
+_workflows: Dict[Tuple[str, bool, bool, bool, bool], Any] = {}
+_workflow_lock = threading.Lock()
+
+
+def get_workflow(
+    response_mode: str = RESPONSE_MODE,
+    fused_router: bool = FUSED_ROUTER,
+    speculative: bool = SPECULATIVE_RETRIEVAL,
+    asynchronous: bool = False,
+    answer_cache: bool = ANSWER_CACHE
+) -> Any:
+    """Return the process-wide compiled workflow for a configuration, building it on first use"""
+
+    # The compiled graph and the agent's tools hold no per-request data, so one instance
+    # serves every session; the API key, history and input travel in AgentGraphState
+    key = (response_mode, fused_router, speculative, asynchronous, answer_cache)
+    workflow = _workflows.get(key)
+    if workflow is None:
+        with _workflow_lock:
+            workflow = _workflows.get(key)
+            if workflow is None:
+                workflow = Graph(TradingAgent(), response_mode, fused_router, speculative, asynchronous, answer_cache).build()
+                _workflows[key] = workflow
+    return workflow
+
+
+def _progress_message(node: str, update: Dict[str, Any]) -> Optional[str]:
+    """Describe a finished node for the progress display"""
+
+    if node == "answer_cache":
+        return "Answered from cache..." if update.get("answer_cache_hit") else None
+    if node == "router":
+        return f"Routing to {update.get('router_response', 'an agent')}..."
+    if node == "rag_caller":
+        rag_response = update.get("rag_caller_response") or {}
+        return "Knowledge base retrieval done..." if rag_response.get("need_rag") else "No knowledge base lookup needed..."
+    if node == "research":
+        return "Market research done..."
+    if node == "investment_strategy":
+        return "Strategy drafted..."
+    return None
+
+
+class _StreamEvents:
+    """Turn raw LangGraph stream chunks into progress, token and done events"""
+
+    def __init__(self, state: AgentGraphState, response_mode: str) -> None:
+        # Only tokens generated inside the answer nodes are forwarded, so the router's label and
+        # intermediate drafts never reach the user
+        self.token_nodes = set(ANSWER_NODES[response_mode])
+        self.start = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self.final_state: Dict[str, Any] = dict(state)
+
+    def events(self, mode: str, chunk: Any) -> Iterator[Dict[str, Any]]:
+        if mode == "messages":
+            message, metadata = chunk
+            if metadata.get("langgraph_node") in self.token_nodes and message.content:
+                if self.first_token_at is None:
+                    self.first_token_at = time.perf_counter()
+                yield {"type": "token", "text": message.content}
+        elif mode == "updates":
+            for node, update in chunk.items():
+                message = _progress_message(node, update or {})
+                if message:
+                    yield {"type": "progress", "node": node, "message": message}
+        else:
+            self.final_state = chunk
+
+    def done(self) -> Dict[str, Any]:
+        total = time.perf_counter() - self.start
+        metrics = get_metrics()
+        metrics.observe("turn.total", total)
+        if self.first_token_at is not None:
+            metrics.observe("turn.time_to_first_token", self.first_token_at - self.start)
+        return {
+            "type": "done",
+            "state": self.final_state,
+            "metrics": {
+                "time_to_first_token": self.first_token_at - self.start if self.first_token_at is not None else None,
+                "total_latency": total,
+                "answer_cache_hit": bool(self.final_state.get("answer_cache_hit"))
+            }
+        }
+
+
+def stream_workflow(workflow: Any, state: AgentGraphState, response_mode: str = RESPONSE_MODE) -> Iterator[Dict[str, Any]]:
+    """Run the workflow, yielding progress, token and done events"""
+
+    stream = _StreamEvents(state, response_mode)
+    for mode, chunk in workflow.stream(state, stream_mode=["updates", "messages", "values"]):
+        yield from stream.events(mode, chunk)
+    yield stream.done()
+
+
+async def astream_workflow(workflow: Any, state: AgentGraphState, response_mode: str = RESPONSE_MODE) -> AsyncIterator[Dict[str, Any]]:
+    """Async version of stream_workflow, for workflows built with asynchronous=True"""
+
+    stream = _StreamEvents(state, response_mode)
+    async for mode, chunk in workflow.astream(state, stream_mode=["updates", "messages", "values"]):
+        for event in stream.events(mode, chunk):
+            yield event
+    yield stream.done()
@@ -0,0 +1,84 @@
+# Import other
+import os
+import threading
+from typing import Any, Dict, List, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class HybridSearch:
+    """Settings and bookkeeping for hybrid retrieval and its lexical-only fast path"""
+
+    def __init__(self, enabled: bool = False, fast_path: bool = True, min_rank: float = 0.3, min_hits: int = 2) -> None:
+        self.enabled = enabled
+        self.fast_path = fast_path
+        self.min_rank = min_rank
+        self.min_hits = min_hits
+        self._lock = threading.Lock()
+
+        # Stats
+        self._lookups = 0
+        self._fast_path_hits = 0
+        self._fast_path_seconds = 0.0
+        self._full_path_seconds = 0.0
+
+    @property
+    def probe(self) -> bool:
+        """Whether lookups should try the lexical fast path first"""
+
+        return self.enabled and self.fast_path
+
+    def accept(self, lexical_results: List[Dict[str, Any]]) -> bool:
+        """Whether keyword matches are strong enough to answer without query expansion or embeddings"""
+
+        return len(lexical_results) >= self.min_hits and lexical_results[0]["text_rank"] >= self.min_rank
+
+    def record(self, fast_path: bool, seconds: float) -> None:
+        """Record a lookup's latency; full-path latencies include any lexical probe that missed"""
+
+        with self._lock:
+            self._lookups += 1
+            if fast_path:
+                self._fast_path_hits += 1
+                self._fast_path_seconds += seconds
+            else:
+                self._full_path_seconds += seconds
+
+    def stats(self) -> Dict[str, Any]:
+        """Return how often the fast path fired and the latency it saved against the full path"""
+
+        with self._lock:
+            full_path = self._lookups - self._fast_path_hits
+            mean_fast = self._fast_path_seconds / self._fast_path_hits if self._fast_path_hits else 0.0
+            mean_full = self._full_path_seconds / full_path if full_path else 0.0
+            return {
+                "enabled": self.enabled,
+                "lookups": self._lookups,
+                "fast_path_hits": self._fast_path_hits,
+                "fast_path_rate": self._fast_path_hits / self._lookups if self._lookups else 0.0,
+                "mean_fast_path_seconds": mean_fast,
+                "mean_full_path_seconds": mean_full,
+                # Estimated from the mean full-path latency, so only meaningful once both paths have run
+                "seconds_saved": self._fast_path_hits * (mean_full - mean_fast) if full_path else 0.0
+            }
+
+
+_hybrid: Optional[HybridSearch] = None
+_hybrid_lock = threading.Lock()
+
+
+def get_hybrid_search() -> HybridSearch:
+    """Return the process-wide hybrid search settings, configured from the environment"""
+
+    global _hybrid
+    if _hybrid is None:
+        with _hybrid_lock:
+            if _hybrid is None:
+                _hybrid = HybridSearch(
+                    enabled=os.getenv("HYBRID_SEARCH", "false").lower() in ("1", "true", "yes"),
+                    fast_path=os.getenv("LEXICAL_FAST_PATH", "true").lower() in ("1", "true", "yes"),
+                    min_rank=float(os.getenv("LEXICAL_FAST_PATH_MIN_RANK", "0.3")),
+                    min_hits=int(os.getenv("LEXICAL_FAST_PATH_MIN_HITS", "2"))
+                )
+    return _hybrid
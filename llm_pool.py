@@ -0,0 +1,238 @@
+# Import langchain
+from langchain_openai import ChatOpenAI
+from langchain_core.runnables import Runnable
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Import token and cost accounting
+from metrics import get_metrics
+
+# Import other
+import os
+import json
+import time
+import httpx
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class _RequestCounter(BaseCallbackHandler):
+    """Count model requests issued through one pooled client"""
+
+    def __init__(self) -> None:
+        self._requests = 0
+        # One pooled client is shared across request threads and worker pools
+        self._lock = threading.Lock()
+
+    @property
+    def requests(self) -> int:
+        with self._lock:
+            return self._requests
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: Any, **kwargs: Any) -> None:
+        with self._lock:
+            self._requests += 1
+
+
+class _ConnectionTracker:
+    """Count new versus reused HTTP connections from httpx response hooks"""
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.new_connections = 0
+        self.reused_connections = 0
+        self._seen: "weakref.WeakSet[Any]" = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def _record(self, response: httpx.Response) -> None:
+        stream = response.extensions.get("network_stream")
+        with self._lock:
+            self.requests += 1
+            if stream is None:
+                return
+            if stream in self._seen:
+                self.reused_connections += 1
+            else:
+                self._seen.add(stream)
+                self.new_connections += 1
+
+    def snapshot(self) -> Tuple[int, int, int]:
+        """Return request, new and reused connection counts read together"""
+        with self._lock:
+            return self.requests, self.new_connections, self.reused_connections
+
+    def on_response(self, response: httpx.Response) -> None:
+        self._record(response)
+
+    async def aon_response(self, response: httpx.Response) -> None:
+        self._record(response)
+
+
+class _PooledClient:
+    """A cached chat model and its usage bookkeeping"""
+
+    def __init__(self, runnable: Runnable, counter: _RequestCounter) -> None:
+        self.runnable = runnable
+        self.counter = counter
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+def create_chat_model(
+    api_key: str,
+    model: str,
+    temperature: float,
+    http_client: httpx.Client,
+    http_async_client: httpx.AsyncClient,
+    callbacks: list
+) -> ChatOpenAI:
+    """Construct a chat model on the shared HTTP clients"""
+
+    return ChatOpenAI(
+        model=model,
+        openai_api_key=api_key,
+        temperature=temperature,
+        http_client=http_client,
+        http_async_client=http_async_client,
+        callbacks=callbacks,
+        # Report token usage for streamed responses too, so every call can be costed
+        stream_usage=True
+    )
+
+
+class LLMClientPool:
+    """Bounded cache of chat model clients that share one HTTP connection pool"""
+
+    def __init__(
+        self,
+        max_clients: int = 64,
+        idle_timeout: float = 900.0,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 60.0
+    ) -> None:
+        self.max_clients = max_clients
+        self.idle_timeout = idle_timeout
+
+        self.connections = _ConnectionTracker()
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        timeout = httpx.Timeout(600.0, connect=10.0)
+        self.http_client = httpx.Client(
+            limits=limits, timeout=timeout, event_hooks={"response": [self.connections.on_response]}
+        )
+        self.http_async_client = httpx.AsyncClient(
+            limits=limits, timeout=timeout, event_hooks={"response": [self.connections.aon_response]}
+        )
+
+        self._clients: "OrderedDict[Tuple[str, str, float, Optional[str]], _PooledClient]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @staticmethod
+    def _key(api_key: str, model: str, temperature: float, schema: Optional[Dict[str, Any]]) -> Tuple[str, str, float, Optional[str]]:
+        # Only a hash of the key is held in the cache key so it never shows up in stats or logs
+        key_hash = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+        schema_key = json.dumps(schema, sort_keys=True) if schema is not None else None
+        return key_hash, model, temperature, schema_key
+
+    def _evict_idle(self, now: float) -> None:
+        """Drop clients idle longer than the timeout, then the least recently used over the bound (lock held)"""
+
+        for key in [key for key, client in self._clients.items() if now - client.last_used > self.idle_timeout]:
+            del self._clients[key]
+            self._evictions += 1
+        while len(self._clients) > self.max_clients:
+            self._clients.popitem(last=False)
+            self._evictions += 1
+
+    def get(self, api_key: str, model: str = "gpt-4o", temperature: float = 0.6, schema: Optional[Dict[str, Any]] = None) -> Runnable:
+        """Return a cached chat model for these settings, creating it on first use"""
+
+        key = self._key(api_key, model, temperature, schema)
+        now = time.monotonic()
+
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._clients.move_to_end(key)
+                client.last_used = now
+                self._hits += 1
+                return client.runnable
+            self._misses += 1
+
+        counter = _RequestCounter()
+        runnable: Runnable = create_chat_model(
+            api_key, model, temperature, self.http_client, self.http_async_client, [counter, get_metrics().llm_callback]
+        )
+        if schema is not None:
+            runnable = runnable.with_structured_output(schema)
+
+        with self._lock:
+            client = self._clients.setdefault(key, _PooledClient(runnable, counter))
+            client.last_used = now
+            self._clients.move_to_end(key)
+            self._evict_idle(now)
+            return client.runnable
+
+    def stats(self) -> Dict[str, Any]:
+        """Return cache, per-client request and connection reuse statistics"""
+
+        http_requests, new_connections, reused_connections = self.connections.snapshot()
+        with self._lock:
+            clients = [
+                {
+                    "key_hash": key[0],
+                    "model": key[1],
+                    "temperature": key[2],
+                    "structured": key[3] is not None,
+                    "requests": client.counter.requests,
+                    "idle_seconds": time.monotonic() - client.last_used
+                }
+                for key, client in self._clients.items()
+            ]
+            return {
+                "clients": clients,
+                "cache_hits": self._hits,
+                "cache_misses": self._misses,
+                "evictions": self._evictions,
+                "http_requests": http_requests,
+                "new_connections": new_connections,
+                "reused_connections": reused_connections
+            }
+
+
+_pool: Optional[LLMClientPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_llm_pool() -> LLMClientPool:
+    """Return the process-wide LLM client pool"""
+
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = LLMClientPool(
+                    max_clients=int(os.getenv("LLM_POOL_MAX_CLIENTS", "64")),
+                    idle_timeout=float(os.getenv("LLM_POOL_IDLE_TIMEOUT", "900")),
+                    max_connections=int(os.getenv("LLM_POOL_MAX_CONNECTIONS", "100")),
+                    max_keepalive_connections=int(os.getenv("LLM_POOL_MAX_KEEPALIVE", "20"))
+                )
+    return _pool
+
+
+def get_chat_model(api_key: str, model: str = "gpt-4o", temperature: float = 0.6, schema: Optional[Dict[str, Any]] = None) -> Runnable:
+    """Return a pooled chat model for the given settings"""
+
+    return get_llm_pool().get(api_key, model, temperature, schema)
@@ -0,0 +1,252 @@
+# Import text normalization shared with the embedding cache
+from embedding_cache import normalize_text
+
+# Import other
+import os
+import time
+import asyncio
+import threading
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, time as clock_time
+from zoneinfo import ZoneInfo
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MARKET_TIMEZONE = "America/New_York"
+MARKET_OPEN = clock_time(9, 30)
+MARKET_CLOSE = clock_time(16, 0)
+
+
+class _Entry:
+    """A cached search result and when it stops being fresh and stale"""
+
+    __slots__ = ("value", "fetched_at", "fresh_until", "stale_until")
+
+    def __init__(self, value: str, fetched_at: datetime, fresh_until: float, stale_until: float) -> None:
+        self.value = value
+        self.fetched_at = fetched_at
+        self.fresh_until = fresh_until
+        self.stale_until = stale_until
+
+
+class ResearchCache:
+    """TTL cache for market research lookups with single-flight fetches and stale-while-revalidate"""
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl_market_open: float = 60.0,
+        ttl_market_closed: float = 900.0,
+        stale_ttl: float = 120.0,
+        market_timezone: str = MARKET_TIMEZONE
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl_market_open = ttl_market_open
+        self.ttl_market_closed = ttl_market_closed
+        self.stale_ttl = stale_ttl
+        self.market_timezone = ZoneInfo(market_timezone)
+
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        # One future per key being fetched; concurrent lookups of the same key wait on it
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._refresher = ThreadPoolExecutor(max_workers=2, thread_name_prefix="research-refresh")
+        # Background refreshes and leader fetches, referenced until done so they aren't collected
+        self._tasks: Set["asyncio.Task"] = set()
+
+        # Stats
+        self._hits = 0
+        self._stale_hits = 0
+        self._misses = 0
+        self._coalesced = 0
+        self._refreshes = 0
+        self._errors = 0
+
+    def market_open(self, now: Optional[datetime] = None) -> bool:
+        """Whether the exchange is in regular trading hours (holidays are not accounted for)"""
+
+        now = (now or datetime.now(self.market_timezone)).astimezone(self.market_timezone)
+        return now.weekday() < 5 and MARKET_OPEN <= now.time() < MARKET_CLOSE
+
+    def ttl(self, now: Optional[datetime] = None) -> float:
+        """Freshness window for a result fetched now: short while prices move, longer otherwise"""
+
+        return self.ttl_market_open if self.market_open(now) else self.ttl_market_closed
+
+    def _store(self, key: str, value: str, fetched_at: datetime) -> None:
+        now = time.monotonic()
+        fresh_until = now + self.ttl()
+        with self._lock:
+            self._entries[key] = _Entry(value, fetched_at, fresh_until, fresh_until + self.stale_ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _lookup(self, key: str) -> Tuple[Optional[_Entry], bool, Optional[Future], bool]:
+        """Return (entry, needs refresh, in-flight future, is leader) for a key"""
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now < entry.fresh_until:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry, False, None, False
+
+            if entry is not None and now < entry.stale_until:
+                # Serve the stale result now and refresh it in the background, once
+                self._entries.move_to_end(key)
+                self._stale_hits += 1
+                if key in self._inflight:
+                    return entry, False, None, False
+                self._inflight[key] = Future()
+                self._refreshes += 1
+                return entry, True, None, False
+
+            future = self._inflight.get(key)
+            if future is not None:
+                self._coalesced += 1
+                return None, False, future, False
+
+            future = Future()
+            self._inflight[key] = future
+            self._misses += 1
+            return None, False, future, True
+
+    def _finish(self, key: str, value: Optional[str] = None, fetched_at: Optional[datetime] = None, error: Optional[BaseException] = None) -> None:
+        """Store a fetch result and release everyone waiting on it"""
+
+        if error is None:
+            self._store(key, value, fetched_at)
+        with self._lock:
+            future = self._inflight.pop(key, None)
+            if error is not None:
+                self._errors += 1
+        if future is not None:
+            if error is None:
+                future.set_result((value, fetched_at))
+            else:
+                future.set_exception(error)
+
+    def _release(self, key: str, query: str, error: BaseException) -> None:
+        # Waiters get fetch errors as they are, but an interrupted fetch (cancellation, Ctrl-C) as an
+        # ordinary error: the interruption belongs to the leader, and waiters only catch Exception
+        if not isinstance(error, Exception):
+            error = RuntimeError(f"Research fetch for '{query}' was interrupted")
+        self._finish(key, error=error)
+
+    def _fetch(self, key: str, query: str, fetch: Callable[[str], str]) -> Tuple[str, datetime]:
+        fetched_at = datetime.now()
+        try:
+            value = fetch(query)
+        except BaseException as e:
+            self._release(key, query, e)
+            raise
+        self._finish(key, value, fetched_at)
+        return value, fetched_at
+
+    async def _afetch(self, key: str, query: str, fetch: Callable[[str], Awaitable[str]]) -> Tuple[str, datetime]:
+        fetched_at = datetime.now()
+        try:
+            value = await fetch(query)
+        except BaseException as e:
+            self._release(key, query, e)
+            raise
+        self._finish(key, value, fetched_at)
+        return value, fetched_at
+
+    def _refresh(self, key: str, query: str, fetch: Callable[[str], str]) -> None:
+        try:
+            self._fetch(key, query, fetch)
+        except Exception:
+            # The stale entry keeps being served until it expires; the error is counted
+            pass
+
+    async def _arefresh(self, key: str, query: str, fetch: Callable[[str], Awaitable[str]]) -> None:
+        try:
+            await self._afetch(key, query, fetch)
+        except Exception:
+            pass
+
+    def _track(self, task: "asyncio.Task") -> "asyncio.Task":
+        self._tasks.add(task)
+        task.add_done_callback(self._untrack)
+        return task
+
+    def _untrack(self, task: "asyncio.Task") -> None:
+        self._tasks.discard(task)
+        # A leader fetch whose caller was cancelled has nobody awaiting it; its error already
+        # reached the waiters through the shared future and is counted
+        if not task.cancelled():
+            task.exception()
+
+    def get(self, query: str, fetch: Callable[[str], str]) -> Tuple[str, datetime]:
+        """Return (result, time of the original fetch) for a query, calling fetch at most once per key"""
+
+        key = normalize_text(query)
+        entry, refresh, future, leader = self._lookup(key)
+        if entry is not None:
+            if refresh:
+                # Worker threads don't inherit context variables, so the refresh would otherwise run
+                # without the triggering request's credentials (asyncio tasks below copy them already)
+                self._refresher.submit(contextvars.copy_context().run, self._refresh, key, query, fetch)
+            return entry.value, entry.fetched_at
+        if not leader:
+            return future.result()
+        return self._fetch(key, query, fetch)
+
+    async def aget(self, query: str, fetch: Callable[[str], Awaitable[str]]) -> Tuple[str, datetime]:
+        """Async version of get; waits on in-flight fetches started by sync or async callers alike"""
+
+        key = normalize_text(query)
+        entry, refresh, future, leader = self._lookup(key)
+        if entry is not None:
+            if refresh:
+                self._track(asyncio.ensure_future(self._arefresh(key, query, fetch)))
+            return entry.value, entry.fetched_at
+        # Shielded on both sides: a caller cancelled mid-wait, e.g. by the server's request timeout,
+        # must neither cancel the shared future nor the fetch other requests are waiting on
+        if not leader:
+            return await asyncio.shield(asyncio.wrap_future(future))
+        return await asyncio.shield(self._track(asyncio.ensure_future(self._afetch(key, query, fetch))))
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit, coalescing and refresh statistics"""
+
+        with self._lock:
+            lookups = self._hits + self._stale_hits + self._misses + self._coalesced
+            return {
+                "hits": self._hits,
+                "stale_hits": self._stale_hits,
+                "misses": self._misses,
+                "coalesced": self._coalesced,
+                "refreshes": self._refreshes,
+                "errors": self._errors,
+                "hit_rate": (self._hits + self._stale_hits + self._coalesced) / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "in_flight": len(self._inflight)
+            }
+
+
+_cache: Optional[ResearchCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_research_cache() -> ResearchCache:
+    """Return the process-wide market research cache, configured from the environment"""
+
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResearchCache(
+                    max_entries=int(os.getenv("RESEARCH_CACHE_SIZE", "1024")),
+                    ttl_market_open=float(os.getenv("RESEARCH_CACHE_TTL_MARKET_OPEN", "60")),
+                    ttl_market_closed=float(os.getenv("RESEARCH_CACHE_TTL_MARKET_CLOSED", "900")),
+                    stale_ttl=float(os.getenv("RESEARCH_CACHE_STALE_TTL", "120"))
+                )
+    return _cache
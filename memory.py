@@ -0,0 +1,222 @@
+# Import other
+import os
+import json
+import hashlib
+import logging
+import threading
+import contextvars
+import tiktoken
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=1)
+def _encoding() -> "tiktoken.Encoding":
+    # Loaded on first use, since tiktoken may fetch the encoding file
+    return tiktoken.get_encoding("cl100k_base")
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    """Token length of a text; cached because the same messages are measured every turn"""
+
+    return len(_encoding().encode(text))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Cut a text down to at most max_tokens tokens"""
+
+    if count_tokens(text) <= max_tokens:
+        return text
+    return _encoding().decode(_encoding().encode(text)[:max_tokens]) + "..."
+
+
+def format_message(msg: Dict[str, str]) -> str:
+    role = "User" if msg["role"] == "user" else "Assistant"
+    return f"{role}: {msg['content']}\n\n"
+
+
+class ConversationMemory:
+    """Token-budgeted view of a conversation: a running summary of older turns plus a recent window"""
+
+    def __init__(self, window_tokens: int = 1500, summary_tokens: int = 300, max_messages: int = 40) -> None:
+        self.window_tokens = window_tokens
+        self.summary_tokens = summary_tokens
+        self.max_messages = max_messages
+
+    def window(self, messages: List[Dict[str, str]], summarized: int = 0) -> List[str]:
+        """Most recent unsummarized messages, formatted, that fit the window budget (oldest first)"""
+
+        lines: List[str] = []
+        budget = self.window_tokens
+        for msg in reversed(messages[summarized:]):
+            line = format_message(msg)
+            tokens = count_tokens(line)
+            if tokens > budget:
+                # The newest message is always shown, cut to whatever budget is left
+                if not lines:
+                    lines.append(truncate_tokens(line, budget))
+                break
+            lines.append(line)
+            budget -= tokens
+        lines.reverse()
+        return lines
+
+    def render(self, messages: List[Dict[str, str]], summary: str = "", summarized: int = 0) -> str:
+        """Format the chat context passed to every agent in a turn"""
+
+        lines = self.window(messages, summarized)
+        if not lines and not summary:
+            return "No previous conversation."
+
+        formatted_history = ""
+        if summary:
+            formatted_history += f"Summary of earlier conversation:\n{truncate_tokens(summary, self.summary_tokens)}\n\n"
+        formatted_history += "Previous conversation:\n" + "".join(lines)
+        return formatted_history
+
+    def to_summarize(self, messages: List[Dict[str, str]], summarized: int = 0) -> List[Dict[str, str]]:
+        """Oldest unsummarized messages to fold into the summary, or [] if the window still has room"""
+
+        pending = messages[summarized:]
+        tokens = [count_tokens(format_message(msg)) for msg in pending]
+        if sum(tokens) <= self.window_tokens:
+            return []
+
+        # Fold enough messages to leave half the window free, so summarizing happens every few turns
+        # rather than every turn; the latest exchange always stays verbatim
+        keep_tokens = self.window_tokens // 2
+        fold = 0
+        remaining = sum(tokens)
+        while fold < len(pending) - 2 and remaining > keep_tokens:
+            remaining -= tokens[fold]
+            fold += 1
+        return pending[:fold]
+
+    def trim(self, messages: List[Dict[str, str]], summarized: int = 0) -> Tuple[List[Dict[str, str]], int]:
+        """Drop already summarized messages beyond max_messages, returning (messages, summarized)"""
+
+        drop = min(summarized, max(0, len(messages) - self.max_messages))
+        return messages[drop:], summarized - drop
+
+
+def summary_key(summary: str, to_fold: List[Dict[str, str]]) -> str:
+    """Identify a fold by the summary it extends and the messages it folds in"""
+
+    payload = json.dumps([summary, [[msg["role"], msg["content"]] for msg in to_fold]])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class BackgroundCompactor:
+    """Summarize folded history off the request path, keeping results for the conversation's next turn"""
+
+    def __init__(self, max_workers: int = 2, max_results: int = 1000) -> None:
+        self.max_results = max_results
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="memory-compaction")
+        self._running: Set[str] = set()
+        self._results: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Stats
+        self._started = 0
+        self._failed = 0
+        self._applied = 0
+        self._not_ready = 0
+
+    def _begin(self, key: str) -> bool:
+        with self._lock:
+            if key in self._running or key in self._results:
+                return False
+            self._running.add(key)
+            self._started += 1
+            return True
+
+    def _finish(self, key: str, summary: Optional[str]) -> None:
+        with self._lock:
+            self._running.discard(key)
+            if summary is None:
+                self._failed += 1
+                return
+            self._results[key] = summary
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_results:
+                self._results.popitem(last=False)
+
+    def _run(self, key: str, fn: Callable[..., str], args: Tuple[Any, ...]) -> None:
+        summary = None
+        try:
+            summary = fn(*args)
+        except Exception as e:
+            logger.warning("Memory compaction failed: %s: %s", type(e).__name__, e)
+        finally:
+            self._finish(key, summary)
+
+    def start(self, key: str, fn: Callable[..., str], *args: Any) -> None:
+        """Run fn(*args) in a worker thread unless this fold is already running or done"""
+
+        # Async graphs use the threads too: a task would die with an event loop that only lives for
+        # one turn. The context is copied so the call is attributed to the turn that triggered it.
+        if self._begin(key):
+            self._executor.submit(contextvars.copy_context().run, self._run, key, fn, args)
+
+    def result(self, key: str) -> Optional[str]:
+        """Return the finished summary for a fold, or None if it is still running, failed or was never started"""
+
+        with self._lock:
+            summary = self._results.get(key)
+            if summary is None:
+                self._not_ready += 1
+            else:
+                self._results.move_to_end(key)
+                self._applied += 1
+            return summary
+
+    def stats(self) -> Dict[str, Any]:
+        """Return how many summaries were started, failed, and ready in time for the next turn"""
+
+        with self._lock:
+            return {
+                "started": self._started,
+                "running": len(self._running),
+                "failed": self._failed,
+                "applied": self._applied,
+                "not_ready": self._not_ready
+            }
+
+
+_memory: Optional[ConversationMemory] = None
+_memory_lock = threading.Lock()
+_compactor: Optional[BackgroundCompactor] = None
+
+
+def get_memory() -> ConversationMemory:
+    """Return the process-wide conversation memory settings, configured from the environment"""
+
+    global _memory
+    if _memory is None:
+        with _memory_lock:
+            if _memory is None:
+                _memory = ConversationMemory(
+                    window_tokens=int(os.getenv("MEMORY_WINDOW_TOKENS", "1500")),
+                    summary_tokens=int(os.getenv("MEMORY_SUMMARY_TOKENS", "300")),
+                    max_messages=int(os.getenv("MEMORY_MAX_MESSAGES", "40"))
+                )
+    return _memory
+
+
+def get_compactor() -> BackgroundCompactor:
+    """Return the process-wide background compactor"""
+
+    global _compactor
+    if _compactor is None:
+        with _memory_lock:
+            if _compactor is None:
+                _compactor = BackgroundCompactor(max_workers=int(os.getenv("MEMORY_COMPACTION_WORKERS", "2")))
+    return _compactor
@@ -0,0 +1,360 @@
+# Import langchain
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+# Import other
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+import numpy as np
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# USD per million tokens as (prompt, completion); dated model names match by prefix
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "text-embedding-3-small": (0.02, 0.0),
+    "text-embedding-3-large": (0.13, 0.0)
+}
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def estimate_cost(model: Optional[str], prompt_tokens: int, completion_tokens: int = 0) -> float:
+    """Estimated USD cost of a call, or 0.0 for models without a known price"""
+
+    for name in sorted(MODEL_PRICES, key=len, reverse=True):
+        if model and model.startswith(name):
+            prompt_price, completion_price = MODEL_PRICES[name]
+            return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+    return 0.0
+
+
+class Span:
+    """A timed unit of work; token usage reported while it is the innermost open span is charged to it"""
+
+    __slots__ = ("name", "span_id", "parent_id", "attributes", "started_at", "prompt_tokens", "completion_tokens", "cost_usd")
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: Dict[str, Any]) -> None:
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = attributes
+        self.started_at = time.time()
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost_usd = 0.0
+
+    def add_usage(self, model: Optional[str], prompt_tokens: int, completion_tokens: int = 0) -> None:
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.cost_usd += estimate_cost(model, prompt_tokens, completion_tokens)
+
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+class _StageStats:
+    """Running totals and a sliding window of durations for one stage"""
+
+    def __init__(self, window: int) -> None:
+        self.durations: Deque[float] = deque(maxlen=window)
+        self.count = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost_usd = 0.0
+
+
+class UsageCallback(BaseCallbackHandler):
+    """Charge prompt/completion tokens reported by chat models to the current span"""
+
+    # Run in the caller's context, even for async calls, so the current span is visible
+    run_inline = True
+
+    def __init__(self, metrics: "Metrics") -> None:
+        self.metrics = metrics
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        llm_output = response.llm_output or {}
+        model = llm_output.get("model_name")
+        prompt_tokens = completion_tokens = 0
+
+        usage = llm_output.get("token_usage") or {}
+        if usage:
+            prompt_tokens = usage.get("prompt_tokens", 0)
+            completion_tokens = usage.get("completion_tokens", 0)
+        else:
+            # Streamed responses carry usage on the message instead
+            for generations in response.generations:
+                for generation in generations:
+                    message = getattr(generation, "message", None)
+                    usage_metadata = getattr(message, "usage_metadata", None) or {}
+                    prompt_tokens += usage_metadata.get("input_tokens", 0)
+                    completion_tokens += usage_metadata.get("output_tokens", 0)
+                    model = model or (getattr(message, "response_metadata", None) or {}).get("model_name")
+
+        self.metrics.record_usage(model, prompt_tokens, completion_tokens)
+
+
+class Metrics:
+    """Process-wide spans, per-stage latency percentiles and token/cost totals"""
+
+    def __init__(self, window: int = 2048, span_log_path: Optional[str] = None) -> None:
+        self.window = window
+        self.span_log_path = span_log_path
+        self.llm_callback = UsageCallback(self)
+
+        self._stages: Dict[str, _StageStats] = {}
+        self._unattributed = _StageStats(1)
+        self._lock = threading.Lock()
+        self._log_lock = threading.Lock()
+
+    def _stage(self, name: str) -> _StageStats:
+        """Stats for a stage, created on first use (lock held)"""
+
+        stats = self._stages.get(name)
+        if stats is None:
+            stats = self._stages[name] = _StageStats(self.window)
+        return stats
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Span]:
+        """Time a block as a stage, nested under the enclosing span"""
+
+        span = Span(name, _current_span.get(), attributes)
+        token = _current_span.set(span)
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            yield span
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            _current_span.reset(token)
+            self._finish(span, duration, status)
+
+    def _finish(self, span: Span, duration: float, status: str) -> None:
+        with self._lock:
+            stats = self._stage(span.name)
+            stats.durations.append(duration)
+            stats.count += 1
+            stats.total_seconds += duration
+            stats.errors += status == "error"
+            stats.prompt_tokens += span.prompt_tokens
+            stats.completion_tokens += span.completion_tokens
+            stats.cost_usd += span.cost_usd
+
+        if self.span_log_path:
+            record = {
+                "name": span.name,
+                "span_id": span.span_id,
+                "parent_id": span.parent_id,
+                "start": span.started_at,
+                "duration_ms": duration * 1000,
+                "status": status,
+                "prompt_tokens": span.prompt_tokens,
+                "completion_tokens": span.completion_tokens,
+                "cost_usd": span.cost_usd,
+                **span.attributes
+            }
+            line = json.dumps(record, default=str) + "\n"
+            with self._log_lock:
+                with open(self.span_log_path, "a") as f:
+                    f.write(line)
+
+    def observe(self, name: str, seconds: float) -> None:
+        """Record a duration measured outside a span, e.g. time to first token"""
+
+        with self._lock:
+            stats = self._stage(name)
+            stats.durations.append(seconds)
+            stats.count += 1
+            stats.total_seconds += seconds
+
+    def record_usage(self, model: Optional[str], prompt_tokens: int, completion_tokens: int = 0) -> None:
+        """Charge token usage to the innermost open span"""
+
+        span = _current_span.get()
+        if span is not None:
+            span.add_usage(model, prompt_tokens, completion_tokens)
+            return
+        with self._lock:
+            self._unattributed.prompt_tokens += prompt_tokens
+            self._unattributed.completion_tokens += completion_tokens
+            self._unattributed.cost_usd += estimate_cost(model, prompt_tokens, completion_tokens)
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """Per-stage count, errors, p50/p95/p99 latency and token/cost totals"""
+
+        with self._lock:
+            snapshot = [(name, list(stats.durations), stats) for name, stats in self._stages.items()]
+
+        summary = {}
+        for name, durations, stats in sorted(snapshot):
+            percentiles = np.percentile(durations, [q * 100 for q in QUANTILES]) if durations else [0.0] * len(QUANTILES)
+            summary[name] = {
+                "count": stats.count,
+                "errors": stats.errors,
+                "mean_s": stats.total_seconds / stats.count if stats.count else 0.0,
+                **{f"p{int(q * 100)}_s": float(p) for q, p in zip(QUANTILES, percentiles)},
+                "prompt_tokens": stats.prompt_tokens,
+                "completion_tokens": stats.completion_tokens,
+                "cost_usd": stats.cost_usd
+            }
+        return summary
+
+    def render_prometheus(self) -> str:
+        """Render stage metrics and component stats in the Prometheus text exposition format"""
+
+        lines = [
+            "# HELP agent_stage_duration_seconds Latency of graph nodes and external calls",
+            "# TYPE agent_stage_duration_seconds summary"
+        ]
+        summary = self.summary()
+        for name, stats in summary.items():
+            for q in QUANTILES:
+                lines.append(f'agent_stage_duration_seconds{{stage="{name}",quantile="{q}"}} {stats[f"p{int(q * 100)}_s"]:.6f}')
+            lines.append(f'agent_stage_duration_seconds_sum{{stage="{name}"}} {stats["mean_s"] * stats["count"]:.6f}')
+            lines.append(f'agent_stage_duration_seconds_count{{stage="{name}"}} {stats["count"]}')
+
+        lines += ["# HELP agent_stage_errors_total Stage executions that raised", "# TYPE agent_stage_errors_total counter"]
+        lines += [f'agent_stage_errors_total{{stage="{name}"}} {stats["errors"]}' for name, stats in summary.items()]
+
+        with self._lock:
+            unattributed = self._unattributed
+            usage = [(name, s["prompt_tokens"], s["completion_tokens"], s["cost_usd"]) for name, s in summary.items()]
+            usage.append(("unattributed", unattributed.prompt_tokens, unattributed.completion_tokens, unattributed.cost_usd))
+        usage = [entry for entry in usage if entry[1] or entry[2]]
+
+        # The exposition format requires each family's samples to follow its own HELP/TYPE lines contiguously
+        lines += ["# HELP agent_llm_tokens_total Model tokens charged to a stage", "# TYPE agent_llm_tokens_total counter"]
+        for name, prompt_tokens, completion_tokens, _ in usage:
+            lines.append(f'agent_llm_tokens_total{{stage="{name}",type="prompt"}} {prompt_tokens}')
+            lines.append(f'agent_llm_tokens_total{{stage="{name}",type="completion"}} {completion_tokens}')
+
+        lines += ["# HELP agent_llm_cost_usd_total Estimated model cost charged to a stage", "# TYPE agent_llm_cost_usd_total counter"]
+        lines += [f'agent_llm_cost_usd_total{{stage="{name}"}} {cost:.6f}' for name, _, _, cost in usage]
+
+        lines += ["# HELP agent_component_stat Numeric stats reported by caches, pools and routers", "# TYPE agent_component_stat gauge"]
+        for component, stats in component_stats().items():
+            for stat, value in _numeric_items(stats):
+                lines.append(f'agent_component_stat{{component="{component}",stat="{stat}"}} {float(value)}')
+
+        return "\n".join(lines) + "\n"
+
+
+def _numeric_items(stats: Dict[str, Any], prefix: str = "") -> List[Tuple[str, float]]:
+    """Flatten nested stats into (name, number) pairs, skipping everything non-numeric"""
+
+    items = []
+    for key, value in stats.items():
+        if isinstance(value, bool):
+            items.append((prefix + key, float(value)))
+        elif isinstance(value, (int, float)):
+            items.append((prefix + key, value))
+        elif isinstance(value, dict):
+            items.extend(_numeric_items(value, f"{prefix}{key}_"))
+    return items
+
+
+def component_stats() -> Dict[str, Dict[str, Any]]:
+    """Collect the stats() of every cache, pool and router in one place"""
+
+    # Imported here to avoid import cycles; these modules report through this one
+    from db import pool_metrics
+    from llm_pool import get_llm_pool
+    from embedding_cache import get_embedding_cache
+    from answer_cache import get_answer_cache
+    from market_cache import get_research_cache
+    from router_classifier import get_local_router
+    from speculative import get_speculative_executor
+    from tracing import get_tracer
+    from fusion import get_fuser
+    from hybrid_search import get_hybrid_search
+    from memory import get_compactor
+
+    sources: Dict[str, Callable[[], Dict[str, Any]]] = {
+        "pg_pool": pool_metrics,
+        "llm_pool": lambda: get_llm_pool().stats(),
+        "embedding_cache": lambda: get_embedding_cache().stats(),
+        "answer_cache": lambda: get_answer_cache().stats(),
+        "research_cache": lambda: get_research_cache().stats(),
+        "local_router": lambda: get_local_router().stats() if get_local_router() is not None else {},
+        "speculative": lambda: get_speculative_executor().stats(),
+        "tracer": lambda: get_tracer().stats(),
+        "rag_fusion": lambda: get_fuser().stats(),
+        "hybrid_search": lambda: get_hybrid_search().stats(),
+        "memory_compaction": lambda: get_compactor().stats()
+    }
+    return {name: source() for name, source in sources.items()}
+
+
+_metrics: Optional[Metrics] = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics() -> Metrics:
+    """Return the process-wide metrics registry, configured from the environment"""
+
+    global _metrics
+    if _metrics is None:
+        with _metrics_lock:
+            if _metrics is None:
+                _metrics = Metrics(
+                    window=int(os.getenv("METRICS_WINDOW", "2048")),
+                    span_log_path=os.getenv("METRICS_SPAN_LOG") or None
+                )
+    return _metrics
+
+
+def span(name: str, **attributes: Any) -> Any:
+    """Time a block as a stage in the process-wide registry"""
+
+    return get_metrics().span(name, **attributes)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path == "/metrics":
+            body, content_type = get_metrics().render_prometheus(), "text/plain; version=0.0.4"
+        elif self.path == "/metrics/summary":
+            body, content_type = json.dumps(get_metrics().summary(), indent=2), "application/json"
+        else:
+            self.send_error(404)
+            return
+        payload = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+_server: Optional[ThreadingHTTPServer] = None
+
+
+def serve_metrics(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Serve /metrics (Prometheus text) and /metrics/summary (JSON) from a background thread, once per process"""
+
+    global _server
+    with _metrics_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+    return _server
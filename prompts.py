@@ -48,6 +48,48 @@ rag_caller_json = {
     "required": ["need_rag", "rag_query"]
 }
 
+fused_router_prompt = """
+You are a query router that determines which specialized agent should handle a user request and, for investment strategy requests, whether the knowledge base should be searched.
+
+Available agents:
+    - investment_strategy_agent: For assets allocation, portfolio rebalancing and trading strategies
+    - research_agent: For market research, news analysis and funds and position tracking
+
+In our vector store we have the book THE MARKET WIZARDS by Jack D. Schwager. If the query goes to investment_strategy_agent and is related to trading, you should formulate the best possible query for vector search.
+If the query goes to research_agent, is not related to trading or you can't decide, or its related to investment strategies you shouldn't call RAG.
+
+This previous conversation context for your better decision:
+{chat_context}
+
+Your response must take the following json format:
+
+  "route": "investment_strategy_agent" or "research_agent",
+  "need_rag": true or false,
+  "rag_query": "If RAG is necessary, formulate the best possible query for vector search. Otherwise, leave empty."
+"""
+
+fused_router_json = {
+    "title": "FusedRouterResponse",
+    "description": "Routing decision together with the RAG decision for investment strategy queries",
+    "type": "object",
+    "properties": {
+        "route": {
+            "type": "string",
+            "enum": ["investment_strategy_agent", "research_agent"],
+            "description": "The agent that should handle the query"
+        },
+        "need_rag": {
+            "type": "boolean",
+            "description": "True/False"
+        },
+        "rag_query": {
+            "type": "string",
+            "description": "Your query here."
+        }
+    },
+    "required": ["route", "need_rag", "rag_query"]
+}
+
 investment_strategy_prompt = """
 You are an investment strategy expert tasked with offering personalized, data-driven advice on asset allocation, portfolio rebalancing, 
 and trading strategies. Analyze the user's query: {question} and previous chat conext: {chat_context}
@@ -128,4 +170,25 @@ Guidelines:
 4. Ensure a consistent tone and style throughout
 
 The final response should be professional, easy to read, and maintain all the valuable information from the original agent response.
-"""
\ No newline at end of file
+"""
+single_pass_formatting = """
+Your answer is shown to the user as-is, without a separate formatting step, so format it as the final response:
+1. Organize the content with appropriate headings and bullet points where relevant
+2. Use correct spacing between words and after punctuation, and never split words across lines
+3. Format numbers and currency properly
+4. Keep a consistent, professional tone throughout
+"""
+
+conversation_summary_prompt = """
+You maintain a running summary of a conversation between a user and a stock market assistant.
+
+Current summary:
+{summary}
+
+Messages to add to the summary:
+{messages}
+
+Rewrite the summary so it also covers the new messages. Keep the user's goals, holdings, risk preferences,
+tickers and any figures or recommendations that later questions may refer to, and drop pleasantries.
+Respond with the summary only, in at most {max_words} words.
+"""
@@ -0,0 +1,56 @@
+# Import other
+import os
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class RequestContext:
+    """Credentials and identifiers of the request being served"""
+
+    __slots__ = ("openai_api_key", "serp_api_key", "request_id")
+
+    def __init__(self, openai_api_key: Optional[str] = None, serp_api_key: Optional[str] = None, request_id: Optional[str] = None) -> None:
+        self.openai_api_key = openai_api_key
+        self.serp_api_key = serp_api_key
+        self.request_id = request_id
+
+
+# Context variables follow the request into asyncio tasks and the worker threads LangChain and
+# LangGraph run sync code in, so concurrent requests never see each other's credentials
+_current: contextvars.ContextVar[RequestContext] = contextvars.ContextVar("request_context", default=RequestContext())
+
+
+def current_context() -> RequestContext:
+    return _current.get()
+
+
+@contextmanager
+def request_context(**values: Any) -> Iterator[RequestContext]:
+    """Set credentials for the enclosed code; values that are None keep the outer context's"""
+
+    outer = _current.get()
+    context = RequestContext(**{
+        name: values[name] if values.get(name) is not None else getattr(outer, name)
+        for name in RequestContext.__slots__
+    })
+    token = _current.set(context)
+    try:
+        yield context
+    finally:
+        _current.reset(token)
+
+
+def openai_api_key() -> Optional[str]:
+    """OpenAI key of the current request"""
+
+    return _current.get().openai_api_key
+
+
+def serp_api_key() -> Optional[str]:
+    """SerpAPI key of the current request, falling back to the process-wide SERP_API_KEY"""
+
+    return _current.get().serp_api_key or os.getenv("SERP_API_KEY")
@@ -0,0 +1,194 @@
+# Import other
+import os
+import re
+import json
+import math
+import threading
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ROUTES = ("investment_strategy_agent", "research_agent")
+EXAMPLES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "router_examples.jsonl")
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9$%]+")
+
+
+def _features(text: str) -> List[str]:
+    """Unigram and bigram features of a query"""
+
+    tokens = _TOKEN_PATTERN.findall(text.lower())
+    return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+
+def load_examples(path: str) -> List[Tuple[str, str]]:
+    """Read (text, label) pairs from a JSONL file, skipping unknown labels"""
+
+    if not path or not os.path.exists(path):
+        return []
+
+    examples = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if record.get("label") in ROUTES:
+                examples.append((record["text"], record["label"]))
+    return examples
+
+
+class LocalRouter:
+    """Multinomial naive Bayes router that answers locally when it is confident"""
+
+    def __init__(self, threshold: float = 0.97, log_path: Optional[str] = None, temperature: float = 1.0) -> None:
+        self.threshold = threshold
+        self.log_path = log_path
+        # Naive Bayes treats overlapping n-grams as independent evidence, so its raw posteriors sit
+        # near 0 or 1; log-scores are divided by this before the softmax
+        self.temperature = temperature
+
+        self._class_counts: Counter = Counter()
+        self._feature_counts: Dict[str, Counter] = defaultdict(Counter)
+        self._feature_totals: Counter = Counter()
+        self._vocabulary: set = set()
+        self._lock = threading.Lock()
+
+        # Stats
+        self._fast_path = 0
+        self._fallbacks = 0
+
+    def train(self, examples: Iterable[Tuple[str, str]]) -> None:
+        """Add labelled examples to the model"""
+
+        with self._lock:
+            for text, label in examples:
+                self._learn(text, label)
+
+    def _learn(self, text: str, label: str) -> None:
+        features = _features(text)
+        self._class_counts[label] += 1
+        self._feature_counts[label].update(features)
+        self._feature_totals[label] += len(features)
+        self._vocabulary.update(features)
+
+    def _scores(self, features: List[str]) -> Optional[Dict[str, float]]:
+        """Uncalibrated log-posterior of each route, or None if the model can't score the query"""
+
+        with self._lock:
+            if len(self._class_counts) < len(ROUTES) or not features:
+                return None
+
+            total = sum(self._class_counts.values())
+            vocabulary_size = len(self._vocabulary)
+            scores = {}
+            for label in ROUTES:
+                counts = self._feature_counts[label]
+                denominator = self._feature_totals[label] + vocabulary_size
+                scores[label] = math.log(self._class_counts[label] / total) + sum(
+                    math.log((counts[feature] + 1) / denominator) for feature in features
+                )
+            return scores
+
+    def predict(self, text: str) -> Tuple[Optional[str], float]:
+        """Return the most likely route and its calibrated probability"""
+
+        scores = self._scores(_features(text))
+        if scores is None:
+            return None, 0.0
+
+        best = max(scores, key=scores.get)
+        top = scores[best]
+        confidence = 1.0 / sum(math.exp((score - top) / self.temperature) for score in scores.values())
+        return best, confidence
+
+    def calibrate(self, examples: List[Tuple[str, str]], folds: int = 5) -> float:
+        """Fit the temperature on held-out predictions by cross-validation and return it"""
+
+        # Margin of the true route over the best other route, scored by a model that never saw the example
+        margins = []
+        for fold in range(folds):
+            held_out = examples[fold::folds]
+            model = LocalRouter()
+            model.train(example for i, example in enumerate(examples) if i % folds != fold)
+            for text, label in held_out:
+                scores = model._scores(_features(text))
+                if scores is not None:
+                    margins.append(scores[label] - max(score for route, score in scores.items() if route != label))
+        if not margins:
+            return self.temperature
+
+        def held_out_loss(temperature: float) -> float:
+            # Binary log loss of softmax(scores / temperature), computed stably from the margin
+            return sum(max(0.0, -m / temperature) + math.log1p(math.exp(-abs(m) / temperature)) for m in margins)
+
+        # Never sharpen the model, only soften it
+        candidates = [1.0 + 0.5 * step for step in range(199)]
+        self.temperature = min(candidates, key=held_out_loss)
+        return self.temperature
+
+    def route(self, text: str) -> Optional[str]:
+        """Return a route if the local model is confident, otherwise None to fall back to the LLM"""
+
+        label, confidence = self.predict(text)
+        with self._lock:
+            if label is not None and confidence >= self.threshold:
+                self._fast_path += 1
+                return label
+            self._fallbacks += 1
+            return None
+
+    def record(self, text: str, label: str) -> None:
+        """Learn from an LLM routing decision and append it to the router log"""
+
+        if label not in ROUTES:
+            return
+
+        with self._lock:
+            self._learn(text, label)
+            if self.log_path:
+                with open(self.log_path, "a") as f:
+                    f.write(json.dumps({"text": text, "label": label}) + "\n")
+
+    def stats(self) -> Dict[str, Any]:
+        """Return how often the local fast path answered"""
+
+        with self._lock:
+            decisions = self._fast_path + self._fallbacks
+            return {
+                "fast_path": self._fast_path,
+                "llm_fallbacks": self._fallbacks,
+                "fast_path_rate": self._fast_path / decisions if decisions else 0.0,
+                "training_examples": sum(self._class_counts.values()),
+                "temperature": self.temperature
+            }
+
+
+_router: Optional[LocalRouter] = None
+_router_lock = threading.Lock()
+
+
+def get_local_router() -> Optional[LocalRouter]:
+    """Return the process-wide local router, or None if it is disabled"""
+
+    global _router
+    # Off by default: the LLM router sees the conversation, this one only the latest message
+    if os.getenv("LOCAL_ROUTER_ENABLED", "false").lower() not in ("1", "true", "yes"):
+        return None
+
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                log_path = os.getenv("ROUTER_LOG_PATH") or None
+                router = LocalRouter(
+                    threshold=float(os.getenv("LOCAL_ROUTER_THRESHOLD", "0.97")),
+                    log_path=log_path
+                )
+                examples = load_examples(os.getenv("ROUTER_EXAMPLES_PATH", EXAMPLES_PATH)) + load_examples(log_path)
+                router.train(examples)
+                router.calibrate(examples)
+                _router = router
+    return _router
@@ -0,0 +1,376 @@
+# Import graph and infrastructure
+from state import AgentGraphState
+from graph import RESPONSE_MODE, RESPONSE_MODES, FUSED_ROUTER, SPECULATIVE_RETRIEVAL, ANSWER_CACHE, get_workflow, astream_workflow
+from metrics import get_metrics
+from request_context import request_context
+
+# Import other
+import os
+import json
+import uuid
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+Scope = Dict[str, Any]
+Receive = Callable[[], Awaitable[Dict[str, Any]]]
+Send = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class HTTPError(Exception):
+    """An error answered with a JSON body and the given status"""
+
+    def __init__(self, status: int, message: str, headers: Optional[List[Tuple[bytes, bytes]]] = None) -> None:
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or []
+
+
+def _header(scope: Scope, name: bytes) -> Optional[str]:
+    for key, value in scope.get("headers", []):
+        if key.lower() == name:
+            return value.decode("latin-1")
+    return None
+
+
+def _flag(settings: Dict[str, Any], name: str, default: bool) -> bool:
+    value = settings.get(name, default)
+    if not isinstance(value, bool):
+        raise HTTPError(400, f"settings.{name} must be a boolean")
+    return value
+
+
+class ChatServer:
+    """ASGI app that runs the async graph for many concurrent, stateless conversations"""
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        max_queue: int = 64,
+        queue_timeout: float = 30.0,
+        request_timeout: float = 120.0,
+        max_body_bytes: int = 1_000_000,
+        drain_seconds: float = 5.0
+    ) -> None:
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.request_timeout = request_timeout
+        self.max_body_bytes = max_body_bytes
+        self.drain_seconds = drain_seconds
+
+        # At most max_concurrency turns run at once and up to max_queue more wait for a slot;
+        # beyond that requests are turned away rather than piling up in memory
+        self._slots = asyncio.Semaphore(max_concurrency)
+        # Only touched from the event loop, so no lock is needed
+        self._waiting = 0
+        self._in_flight = 0
+        self._draining = False
+
+        # Stats
+        self._completed = 0
+        self._rejected_queue_full = 0
+        self._rejected_queue_timeout = 0
+        self._timeouts = 0
+        self._errors = 0
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        request_id = _header(scope, b"x-request-id") or uuid.uuid4().hex
+        try:
+            route = (scope["method"], scope["path"])
+            if route == ("GET", "/healthz"):
+                await self._health(send)
+            elif route == ("GET", "/metrics"):
+                await self._respond(send, 200, self.render_prometheus().encode("utf-8"), b"text/plain; version=0.0.4")
+            elif route == ("POST", "/v1/chat"):
+                await self._chat(scope, receive, send, request_id)
+            elif scope["path"] in ("/healthz", "/metrics", "/v1/chat"):
+                raise HTTPError(405, "Method not allowed")
+            else:
+                raise HTTPError(404, "Not found")
+        except HTTPError as e:
+            await self._json(send, e.status, {"error": e.message, "request_id": request_id}, e.headers)
+
+    async def _lifespan(self, receive: Receive, send: Send) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                # Compile the default workflow before the first request rather than during it
+                get_workflow(asynchronous=True)
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                # Sent once the server has stopped accepting connections and finished its requests;
+                # draining itself happens earlier, in drain()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def drain(self) -> None:
+        """Fail health checks, keep serving for drain_seconds, then wait for queued and running turns"""
+
+        # The grace period gives the load balancer time to see the failing health check and stop
+        # routing here; requests it still sends meanwhile are served normally
+        self._draining = True
+        await asyncio.sleep(self.drain_seconds)
+        deadline = asyncio.get_running_loop().time() + self.queue_timeout + self.request_timeout
+        while (self._in_flight or self._waiting) and asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(0.1)
+
+    async def _respond(self, send: Send, status: int, body: bytes, content_type: bytes, headers: Optional[List[Tuple[bytes, bytes]]] = None) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", content_type), (b"content-length", str(len(body)).encode())] + (headers or [])
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def _json(self, send: Send, status: int, payload: Dict[str, Any], headers: Optional[List[Tuple[bytes, bytes]]] = None) -> None:
+        await self._respond(send, status, json.dumps(payload, default=str).encode("utf-8"), b"application/json", headers)
+
+    async def _health(self, send: Send) -> None:
+        status = "draining" if self._draining else "ok"
+        await self._json(send, 503 if self._draining else 200, {"status": status, **self.stats()})
+
+    async def _read_json(self, receive: Receive) -> Dict[str, Any]:
+        body = b""
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                raise HTTPError(400, "Client disconnected")
+            body += message.get("body", b"")
+            if len(body) > self.max_body_bytes:
+                raise HTTPError(413, "Request body too large")
+            if not message.get("more_body"):
+                break
+        try:
+            payload = json.loads(body or b"{}")
+        except ValueError:
+            raise HTTPError(400, "Request body must be JSON")
+        if not isinstance(payload, dict):
+            raise HTTPError(400, "Request body must be a JSON object")
+        return payload
+
+    @asynccontextmanager
+    async def _slot(self) -> AsyncIterator[None]:
+        """Hold one of the worker slots, queueing for it within the configured bounds"""
+
+        if not self._slots.locked():
+            # A free slot is taken without suspending, so the count of waiters stays exact
+            await self._slots.acquire()
+        elif self._waiting >= self.max_queue:
+            self._rejected_queue_full += 1
+            raise HTTPError(429, "Server is at capacity, retry later", [(b"retry-after", b"1")])
+        else:
+            self._waiting += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._rejected_queue_timeout += 1
+                raise HTTPError(503, "Timed out waiting for a worker", [(b"retry-after", b"5")])
+            finally:
+                self._waiting -= 1
+
+        self._in_flight += 1
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+            self._slots.release()
+
+    def _parse_turn(self, scope: Scope, payload: Dict[str, Any]) -> Tuple[AgentGraphState, Dict[str, Any], Optional[str]]:
+        """Validate a chat request, returning (initial state, workflow settings, SerpAPI key)"""
+
+        authorization = _header(scope, b"authorization") or ""
+        api_key = authorization[7:].strip() if authorization.lower().startswith("bearer ") else _header(scope, b"x-openai-api-key")
+        if not api_key:
+            raise HTTPError(401, "An OpenAI API key is required as a Bearer token or X-OpenAI-Api-Key header")
+
+        message = payload.get("message")
+        if not isinstance(message, str) or not message.strip():
+            raise HTTPError(400, "message must be a non-empty string")
+        messages = payload.get("messages", [])
+        if not isinstance(messages, list) or not all(
+            isinstance(m, dict) and m.get("role") in ("user", "assistant") and isinstance(m.get("content"), str) for m in messages
+        ):
+            raise HTTPError(400, "messages must be a list of {role, content} objects")
+        summarized = payload.get("summarized_messages", 0)
+        if not isinstance(summarized, int) or not 0 <= summarized <= len(messages):
+            raise HTTPError(400, "summarized_messages must be between 0 and the number of messages")
+
+        settings = payload.get("settings") or {}
+        if not isinstance(settings, dict):
+            raise HTTPError(400, "settings must be an object")
+        response_mode = settings.get("response_mode", RESPONSE_MODE)
+        if response_mode not in RESPONSE_MODES:
+            raise HTTPError(400, f"settings.response_mode must be one of {RESPONSE_MODES}")
+        workflow_settings = {
+            "response_mode": response_mode,
+            "fused_router": _flag(settings, "fused_router", FUSED_ROUTER),
+            "speculative": _flag(settings, "speculative", SPECULATIVE_RETRIEVAL),
+            "answer_cache": _flag(settings, "answer_cache", ANSWER_CACHE)
+        }
+
+        state = AgentGraphState(
+            human_input=message,
+            api_key=api_key,
+            messages=[{"role": m["role"], "content": m["content"]} for m in messages],
+            conversation_summary=str(payload.get("conversation_summary") or ""),
+            summarized_messages=summarized
+        )
+        return state, workflow_settings, _header(scope, b"x-serpapi-key")
+
+    def _result(self, event: Dict[str, Any], request_id: str) -> Dict[str, Any]:
+        """Client-facing part of a finished turn; the rest of the state, including the key, stays here"""
+
+        state = event["state"]
+        return {
+            "request_id": request_id,
+            "response": state.get("agent_response", ""),
+            "route": state.get("router_response"),
+            "messages": state.get("messages", []),
+            "conversation_summary": state.get("conversation_summary", ""),
+            "summarized_messages": state.get("summarized_messages", 0),
+            "metrics": event["metrics"]
+        }
+
+    async def _chat(self, scope: Scope, receive: Receive, send: Send, request_id: str) -> None:
+        payload = await self._read_json(receive)
+        state, settings, serp_key = self._parse_turn(scope, payload)
+        workflow = get_workflow(asynchronous=True, **settings)
+        headers = [(b"x-request-id", request_id.encode())]
+
+        async with self._slot():
+            with request_context(openai_api_key=state["api_key"], serp_api_key=serp_key, request_id=request_id):
+                if payload.get("stream"):
+                    await self._stream_turn(send, workflow, state, settings["response_mode"], request_id, headers)
+                else:
+                    await self._run_turn(send, workflow, state, settings["response_mode"], request_id, headers)
+
+    async def _run_turn(self, send: Send, workflow: Any, state: AgentGraphState, response_mode: str, request_id: str, headers: List[Tuple[bytes, bytes]]) -> None:
+        async def run() -> Dict[str, Any]:
+            async for event in astream_workflow(workflow, state, response_mode):
+                if event["type"] == "done":
+                    return event
+            raise RuntimeError("Workflow finished without a result")
+
+        try:
+            done = await asyncio.wait_for(run(), self.request_timeout)
+        except asyncio.TimeoutError:
+            self._timeouts += 1
+            raise HTTPError(504, "Turn timed out", headers)
+        except Exception:
+            self._errors += 1
+            logger.exception("Turn %s failed", request_id)
+            raise HTTPError(500, "Internal error", headers)
+
+        self._completed += 1
+        await self._json(send, 200, self._result(done, request_id), headers)
+
+    async def _stream_turn(self, send: Send, workflow: Any, state: AgentGraphState, response_mode: str, request_id: str, headers: List[Tuple[bytes, bytes]]) -> None:
+        """Send progress, token and done events as server-sent events"""
+
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache")] + headers
+        })
+
+        async def event(payload: Dict[str, Any]) -> None:
+            await send({"type": "http.response.body", "body": f"data: {json.dumps(payload, default=str)}\n\n".encode("utf-8"), "more_body": True})
+
+        async def run() -> None:
+            async for item in astream_workflow(workflow, state, response_mode):
+                if item["type"] == "done":
+                    await event({"type": "done", **self._result(item, request_id)})
+                else:
+                    await event(item)
+
+        # Headers are already sent, so failures are reported as a final error event
+        try:
+            await asyncio.wait_for(run(), self.request_timeout)
+            self._completed += 1
+        except asyncio.TimeoutError:
+            self._timeouts += 1
+            await event({"type": "error", "error": "Turn timed out"})
+        except Exception:
+            self._errors += 1
+            logger.exception("Turn %s failed", request_id)
+            await event({"type": "error", "error": "Internal error"})
+        await send({"type": "http.response.body", "body": b""})
+
+    def stats(self) -> Dict[str, Any]:
+        """Return concurrency, queue and outcome statistics"""
+
+        return {
+            "in_flight": self._in_flight,
+            "queued": self._waiting,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "completed": self._completed,
+            "rejected_queue_full": self._rejected_queue_full,
+            "rejected_queue_timeout": self._rejected_queue_timeout,
+            "timeouts": self._timeouts,
+            "errors": self._errors
+        }
+
+    def render_prometheus(self) -> str:
+        """Process metrics followed by this server's admission stats"""
+
+        lines = ["# HELP agent_server_stat Concurrency, queue and outcome counts of the chat server", "# TYPE agent_server_stat gauge"]
+        lines += [f'agent_server_stat{{stat="{stat}"}} {float(value)}' for stat, value in self.stats().items()]
+        return get_metrics().render_prometheus() + "\n".join(lines) + "\n"
+
+
+def create_app() -> ChatServer:
+    """Build the chat server, configured from the environment"""
+
+    return ChatServer(
+        max_concurrency=int(os.getenv("SERVER_MAX_CONCURRENCY", "8")),
+        max_queue=int(os.getenv("SERVER_MAX_QUEUE", "64")),
+        queue_timeout=float(os.getenv("SERVER_QUEUE_TIMEOUT", "30")),
+        request_timeout=float(os.getenv("SERVER_REQUEST_TIMEOUT", "120")),
+        drain_seconds=float(os.getenv("SERVER_DRAIN_SECONDS", "5"))
+    )
+
+
+app = create_app()
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    class DrainingServer(uvicorn.Server):
+        """Uvicorn server that drains the app on the first SIGTERM/SIGINT before shutting down"""
+
+        async def serve(self, sockets: Any = None) -> None:
+            self._loop = asyncio.get_running_loop()
+            await super().serve(sockets)
+
+        def handle_exit(self, sig: int, frame: Any) -> None:
+            # Uvicorn stops accepting connections as soon as it handles the signal, so the app is
+            # drained first; a second signal shuts down immediately
+            if app._draining or not hasattr(self, "_loop"):
+                super().handle_exit(sig, frame)
+                return
+            app._draining = True
+
+            async def drain_then_exit() -> None:
+                await app.drain()
+                super(DrainingServer, self).handle_exit(sig, frame)
+
+            self._loop.call_soon_threadsafe(lambda: asyncio.ensure_future(drain_then_exit()))
+
+    config = uvicorn.Config(app, host=os.getenv("SERVER_HOST", "0.0.0.0"), port=int(os.getenv("SERVER_PORT", "8000")))
+    DrainingServer(config).run()
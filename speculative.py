@@ -0,0 +1,164 @@
+# Import other
+import os
+import logging
+import time
+import uuid
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Union
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+class SpeculativeExecutor:
+    """Run work before it is known to be needed, so it can be claimed later or discarded"""
+
+    def __init__(self, max_workers: int = 4, ttl: float = 120.0, claim_timeout: float = 30.0) -> None:
+        self.ttl = ttl
+        self.claim_timeout = claim_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="speculative")
+        self._pending: Dict[str, Tuple[Union[Future, "asyncio.Task"], float]] = {}
+        self._lock = threading.Lock()
+
+        # Stats
+        self._started = 0
+        self._claimed = 0
+        self._discarded = 0
+
+    def _run(self, fn: Callable[..., Any], args: Tuple[Any, ...]) -> Tuple[Any, float]:
+        start = time.perf_counter()
+        result = fn(*args)
+        return result, time.perf_counter() - start
+
+    async def _arun(self, fn: Callable[..., Awaitable[Any]], args: Tuple[Any, ...]) -> Tuple[Any, float]:
+        start = time.perf_counter()
+        result = await fn(*args)
+        return result, time.perf_counter() - start
+
+    def _register(self, work: Union[Future, "asyncio.Task"]) -> str:
+        now = time.monotonic()
+        handle = uuid.uuid4().hex
+        with self._lock:
+            # Drop work nobody came back for, e.g. turns that failed before claiming it
+            for stale in [h for h, (_, started) in self._pending.items() if now - started > self.ttl]:
+                self._pending.pop(stale)[0].cancel()
+                self._discarded += 1
+
+            self._pending[handle] = (work, now)
+            self._started += 1
+        return handle
+
+    def start(self, fn: Callable[..., Any], *args: Any) -> str:
+        """Start fn(*args) in the background and return a handle for claiming its result"""
+
+        return self._register(self._executor.submit(self._run, fn, args))
+
+    def start_async(self, fn: Callable[..., Awaitable[Any]], *args: Any) -> str:
+        """Start the coroutine fn(*args) as a task on the running loop and return a handle"""
+
+        return self._register(asyncio.ensure_future(self._arun(fn, args)))
+
+    def _failed(self, handle: str, error: BaseException) -> None:
+        # Speculative work is an optimisation, so its failure only means the caller runs the work itself
+        logger.warning("Speculative work %s failed: %s: %s", handle, type(error).__name__, error)
+        with self._lock:
+            self._discarded += 1
+
+    def claim(self, handle: Optional[str], timeout: Optional[float] = None) -> Optional[Tuple[Any, float, float]]:
+        """Wait for speculative work, returning (result, run seconds, wait seconds) or None if it is unavailable or failed"""
+
+        with self._lock:
+            entry = self._pending.pop(handle, None) if handle else None
+        if entry is None:
+            return None
+
+        start = time.perf_counter()
+        try:
+            result, elapsed = entry[0].result(timeout=timeout)
+        except TimeoutError:
+            entry[0].cancel()
+            with self._lock:
+                self._discarded += 1
+            return None
+        except Exception as e:
+            self._failed(handle, e)
+            return None
+
+        with self._lock:
+            self._claimed += 1
+        return result, elapsed, time.perf_counter() - start
+
+    async def aclaim(self, handle: Optional[str], timeout: Optional[float] = None) -> Optional[Tuple[Any, float, float]]:
+        """Async version of claim for work started with start_async"""
+
+        with self._lock:
+            entry = self._pending.pop(handle, None) if handle else None
+        if entry is None:
+            return None
+
+        start = time.perf_counter()
+        work = entry[0] if isinstance(entry[0], asyncio.Future) else asyncio.wrap_future(entry[0])
+        try:
+            result, elapsed = await asyncio.wait_for(work, timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._discarded += 1
+            return None
+        except asyncio.CancelledError as e:
+            # Only swallow the work's own cancellation, never the claiming task's
+            if not work.cancelled():
+                raise
+            self._failed(handle, e)
+            return None
+        except Exception as e:
+            self._failed(handle, e)
+            return None
+
+        with self._lock:
+            self._claimed += 1
+        return result, elapsed, time.perf_counter() - start
+
+    def discard(self, handle: Optional[str]) -> None:
+        """Cancel speculative work that turned out not to be needed"""
+
+        with self._lock:
+            entry = self._pending.pop(handle, None) if handle else None
+            if entry is not None:
+                # Threaded work that already started runs to completion and its result is dropped;
+                # async tasks are cancelled at their next await
+                entry[0].cancel()
+                self._discarded += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Return how much speculative work was used versus thrown away"""
+
+        with self._lock:
+            return {
+                "started": self._started,
+                "claimed": self._claimed,
+                "discarded": self._discarded,
+                "pending": len(self._pending)
+            }
+
+
+_executor: Optional[SpeculativeExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_speculative_executor() -> SpeculativeExecutor:
+    """Return the process-wide speculative executor"""
+
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = SpeculativeExecutor(
+                    max_workers=int(os.getenv("SPECULATIVE_MAX_WORKERS", "4")),
+                    ttl=float(os.getenv("SPECULATIVE_TTL", "120")),
+                    claim_timeout=float(os.getenv("SPECULATIVE_CLAIM_TIMEOUT", "30"))
+                )
+    return _executor
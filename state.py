@@ -1,5 +1,10 @@
 # Import typing
-from typing import TypedDict, Optional, List, Dict, Any
+from typing import TypedDict, Optional, List, Dict, Any, Annotated
+
+def merge_timings(left: Optional[Dict[str, float]], right: Optional[Dict[str, float]]) -> Dict[str, float]:
+    """Reducer that lets parallel branches each record their own timings"""
+
+    return {**(left or {}), **(right or {})}
 
 class AgentGraphState(TypedDict, total=False):
     """State for the agent graph"""
@@ -8,13 +13,22 @@ class AgentGraphState(TypedDict, total=False):
     api_key: str
     router_response: Optional[str]
     rag_caller_response: Optional[Dict[str, Any]]
+    rag_decision: Optional[Dict[str, Any]]
+    speculative_handle: Optional[str]
+    answer_cache_hit: Optional[bool]
+    answer_cache_embedding: Optional[List[float]]
+    answer_cache_scope: Optional[str]
+    kb_version: Optional[Any]
     agent_response: Optional[str]
     end_chain: Optional[str]
 
-    # Chat history
+    # Chat history: a bounded raw window, a running summary of the messages before it, and
+    # the context rendered from both once per turn
     messages: Optional[List[Dict[str, str]]]
+    conversation_summary: Optional[str]
+    summarized_messages: Optional[int]
+    chat_context: Optional[str]
     
-    # State tracking fields
-    current_node: Optional[str]
-    execution_path: List[str]
-    state_history: List[Dict[str, Any]]
\ No newline at end of file
+    # Tracing and timing fields
+    trace_id: Optional[str]
+    branch_timings: Annotated[Dict[str, float], merge_timings]
\ No newline at end of file
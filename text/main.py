@@ -2,49 +2,130 @@
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import TextLoader
 from langchain.schema import Document
-from langchain_openai import OpenAIEmbeddings
 
 # Database imports
 import psycopg2 
+from psycopg2.extras import execute_values
 
 # Other imports
 import os
+import sys
+import time
+import hashlib
+import argparse
+import tiktoken
+import numpy as np
 from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Iterator, List
+
+# Share the embedding cache with the retrieval tools in the project root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from embedding_cache import EMBEDDING_MODEL, create_embeddings, get_embedding_cache
+from vector_index import rebuild_vector_index_concurrently, vector_index_needs_rebuild
+from vector_store import bump_kb_version, ensure_full_text_index, export_numpy_store, read_kb_version, to_pgvector
 
 load_dotenv()
 
+parser = argparse.ArgumentParser(description="Load a book into the knowledge base, embedding only new or changed chunks")
+parser.add_argument("--file", default="Market Wizards.txt", help="Text file of the book to ingest")
+parser.add_argument("--title", default="Market Wizards", help="Book title, used to scope re-ingestion")
+parser.add_argument("--author", default="Jack D. Schwager", help="Book author")
+parser.add_argument("--chunk-size", type=int, default=2000, help="Characters per chunk")
+parser.add_argument("--chunk-overlap", type=int, default=200, help="Characters shared by neighbouring chunks")
+parser.add_argument("--export-numpy", metavar="PATH", help="Also export book_vectors to a memory-mapped store for RETRIEVAL_BACKEND=numpy")
+parser.add_argument("--export-dtype", choices=["float32", "float16"], default="float32", help="Storage precision of the exported matrix")
+parser.add_argument("--batch-tokens", type=int, default=250000, help="Maximum tokens per embeddings request")
+parser.add_argument("--batch-size", type=int, default=1000, help="Maximum chunks per embeddings request")
+parser.add_argument("--concurrency", type=int, default=4, help="Embeddings requests in flight at once")
+parser.add_argument("--commit-rows", type=int, default=5000, help="Rows written per database transaction")
+parser.add_argument("--reindex", action="store_true", help="Rebuild the ANN index even if it isn't stale")
+args = parser.parse_args()
+
+def batch_by_tokens(docs: List[Document], max_tokens: int, max_items: int) -> Iterator[List[Document]]:
+    """Group chunks into embeddings requests that respect the API's per-request token and input limits"""
+
+    encoding = tiktoken.get_encoding("cl100k_base")
+    batch, batch_tokens = [], 0
+    for doc in docs:
+        tokens = len(encoding.encode(doc.page_content))
+        if batch and (batch_tokens + tokens > max_tokens or len(batch) >= max_items):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(doc)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+def content_hash(text: str) -> str:
+    """Hash chunk content so unchanged chunks can be recognised on re-ingestion"""
+
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def write_rows(cursor, docs: List[Document], vectors: List[List[float]]) -> None:
+    """Insert a batch of embedded chunks with a single multi-row statement, skipping ones already stored"""
+
+    execute_values(
+        cursor,
+        """
+        INSERT INTO book_vectors (title, author, content, embedding, content_hash, chunk_size, chunk_overlap, embedding_model)
+        VALUES %s
+        ON CONFLICT DO NOTHING
+        """,
+        [
+            (
+                doc.metadata["title"],
+                doc.metadata["author"],
+                doc.page_content,
+                to_pgvector(vector),
+                doc.metadata["content_hash"],
+                args.chunk_size,
+                args.chunk_overlap,
+                EMBEDDING_MODEL
+            )
+            for doc, vector in zip(docs, vectors)
+        ],
+        template="(%s, %s, %s, %s::vector, %s, %s, %s, %s)",
+        page_size=500
+    )
+
 # Load environment variables from .env file
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 CONNECTION_STRING = os.getenv("PG_CONNECTION_STRING")
 
 # Load and clean the document
-documents = TextLoader("Market Wizards.txt").load()
+documents = TextLoader(args.file).load()
 
 text = documents[0].page_content
 
 page_9_marker = "\n9\n"
 page_9_index = text.find(page_9_marker)
 
-text = text[page_9_index + len(page_9_marker):]
+if page_9_index != -1:
+    text = text[page_9_index + len(page_9_marker):]
 
 cleaned_document = Document(page_content=text)
 
 # Split the document into chunks
-text_splitter = RecursiveCharacterTextSplitter(chunk_size=2000, chunk_overlap=200)
+text_splitter = RecursiveCharacterTextSplitter(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap)
 splits = text_splitter.split_documents([cleaned_document])
 
-# Add book metadata to each document chunk
-book_title = "Market Wizards"
-book_author = "Jack D. Schwager"
+# Add book metadata and a content hash to each document chunk, dropping repeated chunks
+book_title = args.title
+book_author = args.author
 
+unique_splits = {}
 for doc in splits:
     doc.metadata = {
         "title": book_title,
-        "author": book_author
+        "author": book_author,
+        "content_hash": content_hash(doc.page_content)
     }
+    unique_splits.setdefault(doc.metadata["content_hash"], doc)
+splits = list(unique_splits.values())
 
 # Initialize the embeddings model and connect to the database
-embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
+embeddings = create_embeddings(OPENAI_API_KEY)
 
 conn = psycopg2.connect(CONNECTION_STRING)
 cursor = conn.cursor()
@@ -63,23 +144,138 @@ CREATE TABLE IF NOT EXISTS book_vectors (
 );
 """)
 
-# Generate embeddings and store in book_vectors table
-for doc in splits:
-    # Generate embedding for this document chunk
-    doc_embedding = embeddings.embed_query(doc.page_content)
-    
-    cursor.execute(
-        "INSERT INTO book_vectors (title, author, content, embedding) VALUES (%s, %s, %s, %s)",
-        (
-            doc.metadata["title"],
-            doc.metadata["author"],
-            doc.page_content,
-            doc_embedding
-        )
-    )
+# Track each chunk's content hash, chunker parameters and embedding model so re-runs are idempotent
+cursor.execute("""
+ALTER TABLE book_vectors
+    ADD COLUMN IF NOT EXISTS content_hash TEXT,
+    ADD COLUMN IF NOT EXISTS chunk_size INTEGER,
+    ADD COLUMN IF NOT EXISTS chunk_overlap INTEGER,
+    ADD COLUMN IF NOT EXISTS embedding_model TEXT;
+""")
+cursor.execute("""
+CREATE UNIQUE INDEX IF NOT EXISTS book_vectors_chunk_key
+ON book_vectors (title, content_hash, chunk_size, chunk_overlap, embedding_model);
+""")
+
+# Keyword index for hybrid search; Postgres fills the generated column for existing and new rows
+ensure_full_text_index(cursor)
+
+# Only chunks that aren't already stored with the same parameters need embedding
+cursor.execute(
+    """
+    SELECT content_hash FROM book_vectors
+    WHERE title = %s AND chunk_size = %s AND chunk_overlap = %s AND embedding_model = %s
+    """,
+    (book_title, args.chunk_size, args.chunk_overlap, EMBEDDING_MODEL)
+)
+stored_hashes = {row[0] for row in cursor.fetchall()}
+current_hashes = list(unique_splits)
+new_splits = [doc for doc in splits if doc.metadata["content_hash"] not in stored_hashes]
+print(f"{len(splits)} chunks, {len(splits) - len(new_splits)} unchanged, {len(new_splits)} to embed")
+
+# Generate embeddings in concurrent token-bounded batches and stream them into book_vectors
+batches = batch_by_tokens(new_splits, args.batch_tokens, args.batch_size)
+start_time = time.perf_counter()
+embedded = 0
+uncommitted = 0
+
+with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+    in_flight = {}
+
+    def submit_next() -> bool:
+        batch = next(batches, None)
+        if batch is None:
+            return False
+        in_flight[executor.submit(embeddings.embed_documents, [doc.page_content for doc in batch])] = batch
+        return True
+
+    # Keep a bounded number of requests in flight, refilling as each one completes
+    for _ in range(args.concurrency):
+        if not submit_next():
+            break
+
+    while in_flight:
+        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in done:
+            batch = in_flight.pop(future)
+            write_rows(cursor, batch, future.result())
+            submit_next()
+
+            embedded += len(batch)
+            uncommitted += len(batch)
+            if uncommitted >= args.commit_rows:
+                # Committed rows are visible to retrieval straight away, so the version is bumped in
+                # the same transaction; a later failed batch can't leave cached answers unaware of them
+                bump_kb_version(cursor)
+                conn.commit()
+                uncommitted = 0
+
+            elapsed = time.perf_counter() - start_time
+            print(f"Embedded {embedded}/{len(new_splits)} chunks ({embedded / elapsed:.1f} chunks/s)")
+
+# Delete this book's chunks that are no longer produced (changed text, chunker parameters or model)
+cursor.execute(
+    """
+    DELETE FROM book_vectors
+    WHERE title = %s
+      AND (
+        content_hash IS NULL
+        OR chunk_size IS DISTINCT FROM %s
+        OR chunk_overlap IS DISTINCT FROM %s
+        OR embedding_model IS DISTINCT FROM %s
+        OR NOT content_hash = ANY(%s)
+      )
+    """,
+    (book_title, args.chunk_size, args.chunk_overlap, EMBEDDING_MODEL, current_hashes)
+)
+deleted = cursor.rowcount
+
+# Bump the knowledge base version for the rows and deletions this last transaction commits, so
+# answers cached against the old contents are invalidated
+if uncommitted or deleted:
+    print(f"Knowledge base version is now {bump_kb_version(cursor)}")
+
+# HNSW absorbs the inserts and deletes above, so the index is only rebuilt when it is missing, was
+# built for another method, or IVFFlat's row count drifted far enough to need re-clustering
+reindex = args.reindex or vector_index_needs_rebuild(cursor)
 
 conn.commit()
-print(f"Successfully stored {len(splits)} document chunks in PostgreSQL book_vectors table.")
+
+# Rebuild after the commit, beside the live index, so searches keep using the old one until the
+# new one is swapped in
+if reindex:
+    print("Rebuilding the vector index")
+    rebuild_vector_index_concurrently(conn)
+elapsed = time.perf_counter() - start_time
+print(f"Stored {embedded} new and deleted {deleted} stale chunks of '{book_title}' in {elapsed:.1f}s.")
+print(f"Embedding cache stats: {get_embedding_cache().stats()}")
+
+# Export the whole table for the in-process numpy backend
+if args.export_numpy:
+    cursor.execute("SELECT COUNT(*), MAX(vector_dims(embedding)) FROM book_vectors")
+    count, dim = cursor.fetchone()
+    kb_version = read_kb_version(cursor)
+
+    if not count:
+        # MAX() over no rows is NULL, so there is no dimension to shape the matrix with
+        print(f"book_vectors is empty; nothing exported to {args.export_numpy}")
+    else:
+        export_cursor = conn.cursor(name="export_book_vectors")
+        export_cursor.itersize = 1000
+        export_cursor.execute("SELECT title, author, content, embedding::text FROM book_vectors ORDER BY id")
+        export_numpy_store(
+            (
+                ({"title": title, "author": author, "content": content}, np.fromstring(embedding.strip("[]"), sep=","))
+                for title, author, content, embedding in export_cursor
+            ),
+            args.export_numpy,
+            dim=dim,
+            count=count,
+            dtype=args.export_dtype,
+            version=kb_version
+        )
+        export_cursor.close()
+        print(f"Exported {count} vectors to {args.export_numpy}")
 
 # Close the connection
 cursor.close()
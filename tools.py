@@ -1,110 +1,158 @@
 # Import langchain
 from langchain_core.tools import Tool
 from langchain_core.prompts import PromptTemplate
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain_core.output_parsers import StrOutputParser
 from langchain_community.utilities import SerpAPIWrapper
 
 # Import prompts
 from prompts import rag_query_prompt
 
-# Import db connection
-import psycopg2 
+# Import pooled clients, embedding cache and retrieval backend
+from llm_pool import get_chat_model
+from embedding_cache import create_embeddings
+from vector_store import get_backend
+from market_cache import get_research_cache
+from fusion import get_fuser
+from hybrid_search import get_hybrid_search
+from metrics import span
+from request_context import openai_api_key, serp_api_key
 
 # Import other
-import os
+import time
 from dotenv import load_dotenv
 from datetime import datetime
+from typing import Any, Optional
 
 load_dotenv()
-OPENAI_API_KEY = None
 
-def set_openai_api_key(api_key: str) -> None:
-    """Set the OpenAI API key globally for all tools"""
+def _query_generator(api_key: Optional[str]) -> Any:
+    """Chain that turns a question into several query variations"""
 
-    global OPENAI_API_KEY
-    OPENAI_API_KEY = api_key
-
-def generate_rag_queries(question: str) -> str:
-    """Generate RAG queries for a given question"""
-
-    global OPENAI_API_KEY
-        
-    connection_string = os.getenv("PG_CONNECTION_STRING")
-    conn = psycopg2.connect(connection_string)
-    cursor = conn.cursor()
-    
-    # Step 1: Generate multiple query variations using user-provided API key
     prompt_template = PromptTemplate(
         input_variables=["question"],
         template=rag_query_prompt
     )
-    generate_queries = (
+    return (
         prompt_template 
-        | ChatOpenAI(model_name="gpt-4o", temperature=0.6, openai_api_key=OPENAI_API_KEY) 
+        | get_chat_model(api_key, "gpt-4o", 0.6)
         | StrOutputParser() 
-        | (lambda x: x.split("\n"))
+        | (lambda x: [query for query in x.split("\n") if query.strip()])
     )
-    queries = generate_queries.invoke({"question": question})
-    
-    # Use user-provided API key for embeddings
-    embeddings = OpenAIEmbeddings(model="text-embedding-3-small", openai_api_key=OPENAI_API_KEY)
-    
-    all_results = []
+
+def generate_rag_queries(question: str, api_key: Optional[str] = None) -> str:
+    """Generate RAG queries for a given question"""
+
+    # Called as a tool, the key comes from the request being served
+    api_key = api_key or openai_api_key()
+    backend = get_backend()
+    fuser = get_fuser()
+    hybrid = get_hybrid_search()
+    start = time.perf_counter()
+
+    # Fast path: strong keyword matches for a named trader or term answer without query
+    # expansion or embeddings
+    if hybrid.probe:
+        with span("rag.lexical_search", backend=backend.name):
+            lexical_results = backend.lexical_search(question, k=fuser.candidates_per_query)
+        if hybrid.accept(lexical_results):
+            context = fuser.build_context(lexical_results)
+            hybrid.record(True, time.perf_counter() - start)
+            return context
     
-    # Step 2: Search vector database with each query
-    for i, query in enumerate(queries):
-        if not query.strip():  
-            continue
-            
-        query_embedding = embeddings.embed_query(query)
-        
-        # Convert the embedding to the format PostgreSQL expects
-        embedding_str = '[' + ','.join(map(str, query_embedding)) + ']'
-        
-        cursor.execute("""
-            SELECT content, embedding <-> %s::vector AS distance
-            FROM book_vectors
-            ORDER BY distance
-            LIMIT %s
-        """, (embedding_str, 2))
-        
-        results_count = 0
-        for content, distance in cursor.fetchall():
-            results_count += 1
-            all_results.append({
-                "content": content,
-                "distance": distance
-            })
-
-    cursor.close()
-    conn.close()
+    # Step 1: Generate multiple query variations using user-provided API key
+    with span("rag.query_expansion"):
+        queries = _query_generator(api_key).invoke({"question": question})
+    if not queries:
+        return ""
+
+    # Use user-provided API key for embeddings, embedding every uncached variation in one request
+    embeddings = create_embeddings(api_key)
+    with span("rag.embeddings", queries=len(queries)):
+        query_embeddings = embeddings.embed_documents(queries)
     
-    all_results.sort(key=lambda x: x["distance"])
-   
+    # Step 2: Search the knowledge base with all queries in a single batch, fetching enough
+    # candidates per query for rank fusion to work with; in hybrid mode the same statement
+    # also ranks keyword matches for the question
+    query_text = question if hybrid.enabled else None
+    with span("rag.vector_search", backend=backend.name):
+        all_results = backend.search(query_embeddings, k=fuser.candidates_per_query, with_embeddings=True, query_text=query_text)
     
-    # Deduplicate results
-    seen_content = set()
-    unique_results = []
+    # Step 3: Fuse the rankings, drop overlapping chunks and pack the rest into the token budget
+    with span("rag.fusion", candidates=len(all_results)):
+        context = fuser.build_context(all_results)
+    if hybrid.enabled:
+        hybrid.record(False, time.perf_counter() - start)
+    return context
+
+async def agenerate_rag_queries(question: str, api_key: Optional[str] = None) -> str:
+    """Async version of generate_rag_queries"""
+
+    api_key = api_key or openai_api_key()
+    backend = get_backend()
+    fuser = get_fuser()
+    hybrid = get_hybrid_search()
+    start = time.perf_counter()
+
+    if hybrid.probe:
+        with span("rag.lexical_search", backend=backend.name):
+            lexical_results = await backend.alexical_search(question, k=fuser.candidates_per_query)
+        if hybrid.accept(lexical_results):
+            context = fuser.build_context(lexical_results)
+            hybrid.record(True, time.perf_counter() - start)
+            return context
+
+    with span("rag.query_expansion"):
+        queries = await _query_generator(api_key).ainvoke({"question": question})
+    if not queries:
+        return ""
+
+    embeddings = create_embeddings(api_key)
+    with span("rag.embeddings", queries=len(queries)):
+        query_embeddings = await embeddings.aembed_documents(queries)
+
+    query_text = question if hybrid.enabled else None
+    with span("rag.vector_search", backend=backend.name):
+        all_results = await backend.asearch(query_embeddings, k=fuser.candidates_per_query, with_embeddings=True, query_text=query_text)
+
+    with span("rag.fusion", candidates=len(all_results)):
+        context = fuser.build_context(all_results)
+    if hybrid.enabled:
+        hybrid.record(False, time.perf_counter() - start)
+    return context
+
+def _market_search(query: str) -> str:
+    """Run a live SerpAPI search"""
+
+    search = SerpAPIWrapper(serpapi_api_key=serp_api_key())
     
-    for result in all_results:
-        content = result["content"]
-        if content not in seen_content:
-            seen_content.add(content)
-            unique_results.append(result)
+    with span("serpapi.search"):
+        return search.run(query)
+
+async def _amarket_search(query: str) -> str:
+    """Run a live SerpAPI search with SerpAPI's aiohttp client"""
+
+    search = SerpAPIWrapper(serpapi_api_key=serp_api_key())
     
-    formatted_results = "\n\n".join([r["content"] for r in unique_results[:3]])
+    with span("serpapi.search"):
+        return await search.arun(query)
+
+def _format_market_research(results: str, fetched_at: datetime) -> str:
+    # The timestamp is when the results were fetched, not when they were served from the cache
+    timestamp = fetched_at.strftime("%Y-%m-%d %H:%M:%S")
+     
+    formatted_results = f"Market Research Results (as of {timestamp}):\n\n{results}"
     return formatted_results
 
 def get_stock_analysis(query: str) -> str:
     """Get stock analysis for a given query"""
 
-    serp_api_key = os.getenv("SERP_API_KEY")
-    search = SerpAPIWrapper(serpapi_api_key=serp_api_key)
-    
-    results = search.run(query)
-     
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-     
-    formatted_results = f"Market Research Results (as of {timestamp}):\n\n{results}"
-    return formatted_results
\ No newline at end of file
+    with span("tool.market_research"):
+        results, fetched_at = get_research_cache().get(query, _market_search)
+    return _format_market_research(results, fetched_at)
+
+async def aget_stock_analysis(query: str) -> str:
+    """Async version of get_stock_analysis"""
+
+    with span("tool.market_research"):
+        results, fetched_at = await get_research_cache().aget(query, _amarket_search)
+    return _format_market_research(results, fetched_at)
\ No newline at end of file
@@ -0,0 +1,195 @@
+# Import other
+import os
+import json
+import time
+import uuid
+import atexit
+import random
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TRACE_MODES = ("off", "sample", "all")
+
+# Keys that hold tracing bookkeeping rather than turn data
+_IGNORED_KEYS = ("trace_id",)
+
+
+def _fingerprint(value: Any) -> Any:
+    """Cheap change detector: identity and length for containers, the value itself otherwise"""
+
+    if isinstance(value, (list, dict)):
+        return id(value), len(value)
+    return value
+
+
+class Tracer:
+    """Record per-node state diffs for sampled turns in a bounded ring buffer"""
+
+    def __init__(
+        self,
+        mode: str = "off",
+        sample_rate: float = 0.1,
+        buffer_size: int = 1000,
+        max_value_chars: int = 2000,
+        max_list_items: int = 20,
+        max_active_traces: int = 256
+    ) -> None:
+        if mode not in TRACE_MODES:
+            raise ValueError(f"Unknown trace mode '{mode}', expected one of {TRACE_MODES}")
+
+        self.mode = mode
+        self.sample_rate = sample_rate
+        self.max_value_chars = max_value_chars
+        self.max_list_items = max_list_items
+        self.max_active_traces = max_active_traces
+
+        self._events: Deque[Dict[str, Any]] = deque(maxlen=buffer_size)
+        # Per active trace: start time, event count and the (fingerprint, value) of every key last seen.
+        # Values are held by reference, never copied
+        self._active: "OrderedDict[str, Tuple[float, int, Dict[str, Tuple[Any, Any]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Stats
+        self._traces_started = 0
+        self._traces_skipped = 0
+        self._events_recorded = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    def start_trace(self) -> Optional[str]:
+        """Decide whether to trace a turn, returning its trace id or None if it isn't sampled"""
+
+        if self.mode == "off" or (self.mode == "sample" and random.random() >= self.sample_rate):
+            with self._lock:
+                self._traces_skipped += 1
+            return None
+
+        trace_id = uuid.uuid4().hex
+        with self._lock:
+            self._active[trace_id] = (time.perf_counter(), 0, {})
+            # Turns that failed mid-graph never finish, so only the most recent ones are kept
+            while len(self._active) > self.max_active_traces:
+                self._active.popitem(last=False)
+            self._traces_started += 1
+        return trace_id
+
+    def _summarize(self, value: Any, previous: Any) -> Any:
+        """Compact, JSON-friendly form of a changed value; appended list items only when a list grew"""
+
+        if isinstance(value, str):
+            return value if len(value) <= self.max_value_chars else value[:self.max_value_chars] + f"... [{len(value)} chars]"
+        if isinstance(value, list):
+            if isinstance(previous, tuple) and previous[0] == id(value) and previous[1] <= len(value):
+                return {"appended": [self._summarize(item, None) for item in value[previous[1]:][-self.max_list_items:]]}
+            if len(value) > self.max_list_items:
+                return {"length": len(value)}
+            return [self._summarize(item, None) for item in value]
+        if isinstance(value, dict):
+            return {key: self._summarize(item, None) for key, item in value.items()}
+        return value
+
+    def record(self, trace_id: Optional[str], node: str, state: Dict[str, Any]) -> None:
+        """Record the keys that changed since the trace's previous event"""
+
+        if trace_id is None:
+            return
+
+        with self._lock:
+            active = self._active.get(trace_id)
+            if active is None:
+                return
+            started_at, seq, seen = active
+
+            changes = {}
+            for key, value in state.items():
+                if key in _IGNORED_KEYS:
+                    continue
+                fingerprint = _fingerprint(value)
+                previous, previous_value = seen.get(key, (None, None))
+                if key in seen and (
+                    previous == fingerprint
+                    # Reducers hand every node a fresh but equal dict
+                    or (isinstance(value, dict) and value == previous_value)
+                ):
+                    continue
+                changes[key] = self._summarize(value, previous)
+                seen[key] = (fingerprint, value)
+
+            self._events.append({
+                "trace_id": trace_id,
+                "seq": seq,
+                "node": node,
+                "elapsed_ms": (time.perf_counter() - started_at) * 1000,
+                "changes": changes
+            })
+            self._active[trace_id] = (started_at, seq + 1, seen)
+            self._events_recorded += 1
+
+    def end_trace(self, trace_id: Optional[str]) -> None:
+        """Release a finished trace's bookkeeping; its events stay in the buffer"""
+
+        if trace_id is None:
+            return
+        with self._lock:
+            self._active.pop(trace_id, None)
+
+    def events(self, trace_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Return buffered events, optionally for a single trace"""
+
+        with self._lock:
+            return [event for event in self._events if trace_id is None or event["trace_id"] == trace_id]
+
+    def to_jsonl(self, events: Optional[Iterable[Dict[str, Any]]] = None) -> str:
+        """Serialize events as JSON lines"""
+
+        events = self.events() if events is None else events
+        return "".join(json.dumps(event, default=str) + "\n" for event in events)
+
+    def export_jsonl(self, path: str, trace_id: Optional[str] = None) -> int:
+        """Write buffered events to a JSONL file for offline inspection, returning how many were written"""
+
+        events = self.events(trace_id)
+        with open(path, "w") as f:
+            f.write(self.to_jsonl(events))
+        return len(events)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return sampling and buffer statistics"""
+
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "traces_started": self._traces_started,
+                "traces_skipped": self._traces_skipped,
+                "events_recorded": self._events_recorded,
+                "buffered_events": len(self._events),
+                "active_traces": len(self._active)
+            }
+
+
+_tracer: Optional[Tracer] = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer() -> Tracer:
+    """Return the process-wide tracer, configured from the environment"""
+
+    global _tracer
+    if _tracer is None:
+        with _tracer_lock:
+            if _tracer is None:
+                _tracer = Tracer(
+                    mode=os.getenv("TRACE_MODE", "off"),
+                    sample_rate=float(os.getenv("TRACE_SAMPLE_RATE", "0.1")),
+                    buffer_size=int(os.getenv("TRACE_BUFFER_SIZE", "1000"))
+                )
+                export_path = os.getenv("TRACE_EXPORT_PATH")
+                if export_path and _tracer.enabled:
+                    atexit.register(_tracer.export_jsonl, export_path)
+    return _tracer
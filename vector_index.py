@@ -0,0 +1,217 @@
+# Import db connection
+from psycopg2 import sql
+
+# Import other
+import os
+import math
+from typing import Any, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+INDEX_METHODS = ("hnsw", "ivfflat", "none")
+
+
+class VectorIndexConfig:
+    """Build and query-time parameters for the pgvector ANN index"""
+
+    def __init__(
+        self,
+        method: str = "hnsw",
+        hnsw_m: int = 16,
+        hnsw_ef_construction: int = 64,
+        hnsw_ef_search: int = 40,
+        ivfflat_lists: Optional[int] = None,
+        ivfflat_probes: int = 10,
+        ivfflat_rebuild_drift: float = 0.25
+    ) -> None:
+        if method not in INDEX_METHODS:
+            raise ValueError(f"Unknown vector index method '{method}', expected one of {INDEX_METHODS}")
+
+        self.method = method
+        self.hnsw_m = hnsw_m
+        self.hnsw_ef_construction = hnsw_ef_construction
+        self.hnsw_ef_search = hnsw_ef_search
+        self.ivfflat_lists = ivfflat_lists
+        self.ivfflat_probes = ivfflat_probes
+        self.ivfflat_rebuild_drift = ivfflat_rebuild_drift
+
+    @classmethod
+    def from_env(cls) -> "VectorIndexConfig":
+        """Read the index configuration from environment variables"""
+
+        lists = os.getenv("IVFFLAT_LISTS")
+        return cls(
+            method=os.getenv("VECTOR_INDEX_METHOD", "hnsw"),
+            hnsw_m=int(os.getenv("HNSW_M", "16")),
+            hnsw_ef_construction=int(os.getenv("HNSW_EF_CONSTRUCTION", "64")),
+            hnsw_ef_search=int(os.getenv("HNSW_EF_SEARCH", "40")),
+            ivfflat_lists=int(lists) if lists else None,
+            ivfflat_probes=int(os.getenv("IVFFLAT_PROBES", "10")),
+            ivfflat_rebuild_drift=float(os.getenv("IVFFLAT_REBUILD_DRIFT", "0.25"))
+        )
+
+    def lists_for(self, row_count: int) -> int:
+        """IVFFlat list count: configured value, or pgvector's rows/1000 (sqrt above 1M rows) guidance"""
+
+        if self.ivfflat_lists:
+            return self.ivfflat_lists
+        if row_count > 1_000_000:
+            return max(1, int(math.sqrt(row_count)))
+        return max(1, row_count // 1000)
+
+
+_config: Optional[VectorIndexConfig] = None
+
+
+def get_index_config() -> VectorIndexConfig:
+    """Return the process-wide index configuration"""
+
+    global _config
+    if _config is None:
+        _config = VectorIndexConfig.from_env()
+    return _config
+
+
+def _index_name(table: str, method: str) -> str:
+    return f"{table}_embedding_{method}_idx"
+
+
+def drop_vector_indexes(cursor: Any, table: str = "book_vectors") -> None:
+    """Drop any ANN index managed by this module"""
+
+    for method in ("hnsw", "ivfflat"):
+        cursor.execute(sql.SQL("DROP INDEX IF EXISTS {}").format(sql.Identifier(_index_name(table, method))))
+
+
+def create_vector_index(
+    cursor: Any,
+    config: Optional[VectorIndexConfig] = None,
+    table: str = "book_vectors",
+    name: Optional[str] = None,
+    concurrently: bool = False
+) -> None:
+    """Create the configured ANN index on the embedding column if it doesn't exist"""
+
+    config = config or get_index_config()
+    if config.method == "none":
+        return
+
+    name_id = sql.Identifier(name or _index_name(table, config.method))
+    table_id = sql.Identifier(table)
+    create = sql.SQL("CREATE INDEX CONCURRENTLY IF NOT EXISTS" if concurrently else "CREATE INDEX IF NOT EXISTS")
+
+    if config.method == "hnsw":
+        cursor.execute(
+            sql.SQL(
+                "{} {} ON {} USING hnsw (embedding vector_l2_ops) WITH (m = {}, ef_construction = {})"
+            ).format(create, name_id, table_id, sql.Literal(config.hnsw_m), sql.Literal(config.hnsw_ef_construction))
+        )
+    else:
+        cursor.execute(sql.SQL("SELECT COUNT(*) FROM {}").format(table_id))
+        lists = config.lists_for(cursor.fetchone()[0])
+        cursor.execute(
+            sql.SQL("{} {} ON {} USING ivfflat (embedding vector_l2_ops) WITH (lists = {})").format(
+                create, name_id, table_id, sql.Literal(lists)
+            )
+        )
+
+
+def rebuild_vector_index(cursor: Any, config: Optional[VectorIndexConfig] = None, table: str = "book_vectors") -> None:
+    """Rebuild the ANN index after a bulk load so it reflects the new data distribution"""
+
+    # IVFFlat centroids are trained at build time, so the index is recreated rather than reindexed
+    drop_vector_indexes(cursor, table)
+    create_vector_index(cursor, config, table)
+    cursor.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(table)))
+
+
+def vector_index_needs_rebuild(cursor: Any, config: Optional[VectorIndexConfig] = None, table: str = "book_vectors") -> bool:
+    """Whether the ANN index is missing, invalid, of another method, or IVFFlat trained on a drifted row count"""
+
+    config = config or get_index_config()
+    cursor.execute(
+        """
+        SELECT c.relname, obj_description(c.oid, 'pg_class')
+        FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE i.indrelid = %s::regclass AND i.indisvalid AND c.relname = ANY(%s)
+        """,
+        (table, [_index_name(table, method) for method in ("hnsw", "ivfflat")])
+    )
+    existing = dict(cursor.fetchall())
+    wanted = {_index_name(table, config.method)} if config.method != "none" else set()
+    if set(existing) != wanted:
+        return True
+
+    # HNSW is maintained incrementally on INSERT and DELETE, so only IVFFlat's build-time centroids go stale
+    if config.method != "ivfflat":
+        return False
+    built_rows = existing[_index_name(table, "ivfflat")]
+    if not built_rows or not built_rows.isdigit():
+        return True
+    cursor.execute(sql.SQL("SELECT COUNT(*) FROM {}").format(sql.Identifier(table)))
+    rows = cursor.fetchone()[0]
+    return abs(rows - int(built_rows)) > config.ivfflat_rebuild_drift * max(int(built_rows), 1)
+
+
+def rebuild_vector_index_concurrently(conn: Any, config: Optional[VectorIndexConfig] = None, table: str = "book_vectors") -> None:
+    """Rebuild the ANN index of a live table without blocking queries, swapping the new index in by rename"""
+
+    # rebuild_vector_index holds ACCESS EXCLUSIVE on the table for the whole build and leaves no
+    # index between the drop and the create. Here the new index is built beside the old one, and
+    # the old one is only dropped once its replacement is valid. CONCURRENTLY can't run inside a
+    # transaction block, so this needs the pending ingestion work committed first.
+    config = config or get_index_config()
+    building = f"{table}_embedding_new_idx"
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            # A failed concurrent build leaves an invalid index behind
+            cursor.execute(sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {}").format(sql.Identifier(building)))
+            create_vector_index(cursor, config, table, name=building, concurrently=True)
+            if config.method == "ivfflat":
+                # Remember the row count the centroids were trained on, for vector_index_needs_rebuild
+                cursor.execute(sql.SQL("SELECT COUNT(*) FROM {}").format(sql.Identifier(table)))
+                cursor.execute(
+                    sql.SQL("COMMENT ON INDEX {} IS {}").format(sql.Identifier(building), sql.Literal(str(cursor.fetchone()[0])))
+                )
+            for method in ("hnsw", "ivfflat"):
+                cursor.execute(sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {}").format(sql.Identifier(_index_name(table, method))))
+            if config.method != "none":
+                cursor.execute(
+                    sql.SQL("ALTER INDEX {} RENAME TO {}").format(
+                        sql.Identifier(building), sql.Identifier(_index_name(table, config.method))
+                    )
+                )
+            cursor.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(table)))
+    finally:
+        conn.autocommit = autocommit
+
+
+def search_params_sql(config: Optional[VectorIndexConfig] = None) -> Optional[str]:
+    """Return the SET LOCAL statement for the per-query recall/speed trade-off, if any"""
+
+    # SET can't take bind parameters server-side (psycopg 3), so the integer is inlined
+    config = config or get_index_config()
+    if config.method == "hnsw":
+        return f"SET LOCAL hnsw.ef_search = {int(config.hnsw_ef_search)}"
+    if config.method == "ivfflat":
+        return f"SET LOCAL ivfflat.probes = {int(config.ivfflat_probes)}"
+    return None
+
+
+def apply_search_params(cursor: Any, config: Optional[VectorIndexConfig] = None) -> None:
+    """Set the per-query recall/speed trade-off for the current transaction"""
+
+    statement = search_params_sql(config)
+    if statement:
+        cursor.execute(statement)
+
+
+async def aapply_search_params(cursor: Any, config: Optional[VectorIndexConfig] = None) -> None:
+    """Async version of apply_search_params for psycopg 3 cursors"""
+
+    statement = search_params_sql(config)
+    if statement:
+        await cursor.execute(statement)
@@ -0,0 +1,456 @@
+# Import db connection pool and index tuning
+from db import get_async_pool, get_pool
+from vector_index import aapply_search_params, apply_search_params
+
+# Import other
+import os
+import json
+import time
+import asyncio
+import threading
+import numpy as np
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Single-row table holding a counter that ingestion bumps whenever book_vectors changes
+KB_META_DDL = """
+CREATE TABLE IF NOT EXISTS knowledge_base_meta (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    version BIGINT NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+)
+"""
+KB_META_EXISTS_QUERY = "SELECT to_regclass('knowledge_base_meta') IS NOT NULL"
+KB_VERSION_QUERY = "SELECT version FROM knowledge_base_meta WHERE id"
+
+# Full-text search over chunk content, kept in sync by Postgres as a generated column
+TEXT_SEARCH_CONFIG = "english"
+FULL_TEXT_DDL = [
+    f"""
+    ALTER TABLE book_vectors
+        ADD COLUMN IF NOT EXISTS content_tsv tsvector
+        GENERATED ALWAYS AS (to_tsvector('{TEXT_SEARCH_CONFIG}', content)) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS book_vectors_content_tsv ON book_vectors USING GIN (content_tsv)"
+]
+
+# Every term of the question must match; ts_rank_cd with normalization 32 scales ranks to [0, 1)
+LEXICAL_QUERY = f"""
+    SELECT b.id, b.content, ts_rank_cd(b.content_tsv, q.tsq, 32) AS text_rank
+    FROM book_vectors b, websearch_to_tsquery('{TEXT_SEARCH_CONFIG}', %s) AS q(tsq)
+    WHERE b.content_tsv @@ q.tsq
+    ORDER BY text_rank DESC
+    LIMIT %s
+"""
+
+
+def ensure_full_text_index(cursor: Any) -> None:
+    """Add the generated tsvector column and its GIN index to book_vectors, if missing"""
+
+    for statement in FULL_TEXT_DDL:
+        cursor.execute(statement)
+
+
+def bump_kb_version(cursor: Any) -> int:
+    """Record that the knowledge base changed and return its new version"""
+
+    cursor.execute(KB_META_DDL)
+    cursor.execute("""
+        INSERT INTO knowledge_base_meta (id, version) VALUES (TRUE, 1)
+        ON CONFLICT (id) DO UPDATE SET version = knowledge_base_meta.version + 1, updated_at = now()
+        RETURNING version
+    """)
+    return cursor.fetchone()[0]
+
+
+def read_kb_version(cursor: Any) -> Optional[int]:
+    """Return the knowledge base version, or None if it has never been recorded"""
+
+    # Readers may not have DDL rights, so a missing table is checked for rather than created
+    cursor.execute(KB_META_EXISTS_QUERY)
+    if not cursor.fetchone()[0]:
+        return None
+    cursor.execute(KB_VERSION_QUERY)
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+class RetrievalBackend:
+    """Interface for batched nearest-neighbour search over the knowledge base"""
+
+    name = "base"
+
+    def search(
+        self,
+        query_embeddings: List[List[float]],
+        k: int = 2,
+        with_embeddings: bool = False,
+        query_text: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Return the k nearest chunks for every query, tagged with query_index and row id, plus embeddings if asked"""
+
+        # Backends with full-text search also return the k best keyword matches for query_text as
+        # one more ranking, with query_index len(query_embeddings); others ignore it
+
+        raise NotImplementedError
+
+    async def asearch(
+        self,
+        query_embeddings: List[List[float]],
+        k: int = 2,
+        with_embeddings: bool = False,
+        query_text: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Async version of search; by default runs the blocking search in a worker thread"""
+
+        return await asyncio.to_thread(self.search, query_embeddings, k, with_embeddings, query_text)
+
+    def lexical_search(self, query_text: str, k: int = 5) -> List[Dict[str, Any]]:
+        """Return the k best chunks matching every term of query_text, with their text_rank; [] if unsupported"""
+
+        return []
+
+    async def alexical_search(self, query_text: str, k: int = 5) -> List[Dict[str, Any]]:
+        """Async version of lexical_search"""
+
+        return await asyncio.to_thread(self.lexical_search, query_text, k)
+
+    def version(self) -> Optional[Any]:
+        """Identify the knowledge base contents, changing whenever they are re-ingested"""
+
+        return None
+
+    async def aversion(self) -> Optional[Any]:
+        """Async version of version"""
+
+        return await asyncio.to_thread(self.version)
+
+
+def to_pgvector(embedding: List[float]) -> str:
+    """Convert an embedding to the literal format PostgreSQL expects"""
+
+    return '[' + ','.join(map(str, embedding)) + ']'
+
+
+class PgVectorBackend(RetrievalBackend):
+    """Search the book_vectors table in Postgres with pgvector"""
+
+    name = "pgvector"
+
+    def __init__(self, version_check_interval: float = 30.0) -> None:
+        self.version_check_interval = version_check_interval
+        self._version: Optional[int] = None
+        self._version_checked_at = float("-inf")
+
+    def _cached_version(self) -> Tuple[bool, Optional[int]]:
+        """Return (still valid, version); the table is polled at most once per interval"""
+
+        return time.monotonic() - self._version_checked_at < self.version_check_interval, self._version
+
+    def _remember_version(self, version: Optional[int]) -> Optional[int]:
+        self._version = version
+        self._version_checked_at = time.monotonic()
+        return version
+
+    def version(self) -> Optional[int]:
+        """Return the version bumped by ingestion in knowledge_base_meta"""
+
+        valid, version = self._cached_version()
+        if valid:
+            return version
+        with get_pool().connection() as conn:
+            with conn.cursor() as cursor:
+                return self._remember_version(read_kb_version(cursor))
+
+    async def aversion(self) -> Optional[int]:
+        """Async version of version on the psycopg 3 pool"""
+
+        valid, version = self._cached_version()
+        if valid:
+            return version
+        pool = await get_async_pool()
+        async with pool.connection() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(KB_META_EXISTS_QUERY)
+                row = await cursor.fetchone()
+                if row[0]:
+                    await cursor.execute(KB_VERSION_QUERY)
+                    row = await cursor.fetchone()
+                else:
+                    row = None
+        return self._remember_version(row[0] if row else None)
+
+    @staticmethod
+    def _query(
+        query_embeddings: List[List[float]],
+        k: int,
+        with_embeddings: bool = False,
+        query_text: Optional[str] = None
+    ) -> Tuple[str, List[Any]]:
+        """Build the batched kNN statement, with an optional full-text ranking, and its parameters"""
+
+        # One VALUES row per query, joined laterally to its own nearest-neighbour search
+        values = ", ".join(["(%s::int, %s::vector)"] * len(query_embeddings))
+        params: List[Any] = []
+        for query_index, embedding in enumerate(query_embeddings):
+            params.extend([query_index, to_pgvector(embedding)])
+        params.append(k)
+
+        embedding_column = "b.embedding" if with_embeddings else "NULL::vector"
+        sql = f"""
+            WITH hits AS (
+            SELECT q.query_index, hit.id, hit.content, hit.distance, hit.embedding
+            FROM (VALUES {values}) AS q(query_index, embedding)
+            CROSS JOIN LATERAL (
+                SELECT b.id, b.content, b.embedding <-> q.embedding AS distance, {embedding_column} AS embedding
+                FROM book_vectors b
+                ORDER BY b.embedding <-> q.embedding
+                LIMIT %s
+            ) AS hit
+        """
+
+        if query_text is not None:
+            # Keyword matches ranked in the same statement; any term may match here, and the
+            # negated rank sorts like a distance so the hits fuse with the vector rankings
+            sql += f"""
+            UNION ALL (
+                SELECT %s::int, b.id, b.content, -ts_rank_cd(b.content_tsv, q.tsq, 32), {embedding_column}
+                FROM book_vectors b,
+                    to_tsquery('{TEXT_SEARCH_CONFIG}', replace(plainto_tsquery('{TEXT_SEARCH_CONFIG}', %s)::text, ' & ', ' | ')) AS q(tsq)
+                WHERE b.content_tsv @@ q.tsq
+                ORDER BY 4
+                LIMIT %s
+            )
+            """
+            params.extend([len(query_embeddings), query_text, k])
+
+        # Chunks found by several queries are sent once: only the first row of each id carries its
+        # vector, in pgvector's binary send format rather than ~19 KB of decimal text
+        sql += """
+            )
+            SELECT query_index, id, content, distance,
+                CASE WHEN row_number() OVER (PARTITION BY id ORDER BY query_index, distance) = 1
+                    THEN vector_send(embedding) END
+            FROM hits
+            ORDER BY 1, 4
+        """
+        return sql, params
+
+    @staticmethod
+    def _rows_to_results(rows: List[Tuple[Any, ...]]) -> List[Dict[str, Any]]:
+        results = []
+        for query_index, row_id, content, distance, embedding in rows:
+            result = {"query_index": query_index, "id": row_id, "content": content, "distance": distance}
+            if embedding is not None:
+                # vector_send: int16 dimensions, int16 unused, then big-endian float4 values
+                result["embedding"] = np.frombuffer(embedding, dtype=">f4", offset=4).astype(np.float32)
+            results.append(result)
+        return results
+
+    def search(
+        self,
+        query_embeddings: List[List[float]],
+        k: int = 2,
+        with_embeddings: bool = False,
+        query_text: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Find the k nearest chunks for every query embedding, and keyword matches for query_text, in one SQL statement"""
+
+        if not query_embeddings:
+            return []
+
+        sql, params = self._query(query_embeddings, k, with_embeddings, query_text)
+        with get_pool().connection() as conn:
+            with conn.cursor() as cursor:
+                apply_search_params(cursor)
+                cursor.execute(sql, params)
+                rows = cursor.fetchall()
+
+        return self._rows_to_results(rows)
+
+    async def asearch(
+        self,
+        query_embeddings: List[List[float]],
+        k: int = 2,
+        with_embeddings: bool = False,
+        query_text: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Async version of search on the psycopg 3 pool, without tying up a thread"""
+
+        if not query_embeddings:
+            return []
+
+        sql, params = self._query(query_embeddings, k, with_embeddings, query_text)
+        pool = await get_async_pool()
+        async with pool.connection() as conn:
+            async with conn.transaction():
+                # Binary results, so the vectors arrive as raw bytes rather than hex-escaped text
+                async with conn.cursor(binary=True) as cursor:
+                    await aapply_search_params(cursor)
+                    await cursor.execute(sql, params)
+                    rows = await cursor.fetchall()
+
+        return self._rows_to_results(rows)
+
+    @staticmethod
+    def _lexical_results(rows: List[Tuple[Any, ...]]) -> List[Dict[str, Any]]:
+        return [
+            {"query_index": 0, "id": row_id, "content": content, "distance": -text_rank, "text_rank": text_rank}
+            for row_id, content, text_rank in rows
+        ]
+
+    def lexical_search(self, query_text: str, k: int = 5) -> List[Dict[str, Any]]:
+        """Return the k best chunks matching every term of query_text, from the GIN index alone"""
+
+        with get_pool().connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(LEXICAL_QUERY, (query_text, k))
+                rows = cursor.fetchall()
+
+        return self._lexical_results(rows)
+
+    async def alexical_search(self, query_text: str, k: int = 5) -> List[Dict[str, Any]]:
+        """Async version of lexical_search on the psycopg 3 pool"""
+
+        pool = await get_async_pool()
+        async with pool.connection() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(LEXICAL_QUERY, (query_text, k))
+                rows = await cursor.fetchall()
+
+        return self._lexical_results(rows)
+
+
+class NumpyVectorBackend(RetrievalBackend):
+    """Search a memory-mapped embedding matrix in-process, with no external database"""
+
+    name = "numpy"
+
+    def __init__(self, path: str, block_size: int = 65536) -> None:
+        self.path = path
+        self.block_size = block_size
+
+        with open(os.path.join(path, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        with open(os.path.join(path, "metadata.jsonl")) as f:
+            self.metadata = [json.loads(line) for line in f]
+
+        self.embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")
+        self.norms = np.load(os.path.join(path, "norms.npy"))
+
+        if len(self.metadata) != self.embeddings.shape[0]:
+            raise ValueError(f"Vector store at {path} has {self.embeddings.shape[0]} vectors but {len(self.metadata)} metadata rows")
+
+    def version(self) -> Optional[Any]:
+        """Return the knowledge base version the store was exported at"""
+
+        return self.manifest.get("version")
+
+    def _top_k(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Vectorized exact top-k L2 search, scanning the matrix in blocks to bound memory"""
+
+        query_norms = np.einsum("ij,ij->i", queries, queries)[:, None]
+        best_ids = np.empty((len(queries), 0), dtype=np.int64)
+        best_dists = np.empty((len(queries), 0), dtype=np.float32)
+
+        for start in range(0, self.embeddings.shape[0], self.block_size):
+            block = np.asarray(self.embeddings[start:start + self.block_size], dtype=np.float32)
+            # ||q - x||^2 = ||q||^2 - 2 q.x + ||x||^2
+            dists = query_norms - 2.0 * queries @ block.T + self.norms[start:start + len(block)][None, :]
+
+            kk = min(k, dists.shape[1])
+            part = np.argpartition(dists, kk - 1, axis=1)[:, :kk]
+            best_ids = np.concatenate([best_ids, part + start], axis=1)
+            best_dists = np.concatenate([best_dists, np.take_along_axis(dists, part, axis=1)], axis=1)
+
+            if best_ids.shape[1] > k:
+                keep = np.argpartition(best_dists, k - 1, axis=1)[:, :k]
+                best_ids = np.take_along_axis(best_ids, keep, axis=1)
+                best_dists = np.take_along_axis(best_dists, keep, axis=1)
+
+        order = np.argsort(best_dists, axis=1)
+        best_ids = np.take_along_axis(best_ids, order, axis=1)
+        best_dists = np.sqrt(np.maximum(np.take_along_axis(best_dists, order, axis=1), 0.0))
+        return best_ids, best_dists
+
+    def search(
+        self,
+        query_embeddings: List[List[float]],
+        k: int = 2,
+        with_embeddings: bool = False,
+        query_text: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Find the k nearest chunks for a batch of query embeddings; there is no full-text index, so query_text is ignored"""
+
+        if not query_embeddings or k <= 0 or self.embeddings.shape[0] == 0:
+            return []
+
+        ids, dists = self._top_k(np.asarray(query_embeddings, dtype=np.float32), k)
+        results = [
+            {"query_index": query_index, "id": int(row_id), "content": self.metadata[row_id]["content"], "distance": float(distance)}
+            for query_index in range(len(ids))
+            for row_id, distance in zip(ids[query_index], dists[query_index])
+        ]
+        if with_embeddings:
+            vectors = np.asarray(self.embeddings[ids.ravel()], dtype=np.float32)
+            for result, vector in zip(results, vectors):
+                result["embedding"] = vector
+        return results
+
+
+def export_numpy_store(
+    rows: Iterable[Tuple[Dict[str, Any], List[float]]],
+    path: str,
+    dim: int,
+    count: int,
+    dtype: str = "float32",
+    version: Optional[int] = None
+) -> None:
+    """Write (metadata, embedding) rows to the on-disk format read by NumpyVectorBackend"""
+
+    os.makedirs(path, exist_ok=True)
+    matrix = np.lib.format.open_memmap(
+        os.path.join(path, "embeddings.npy"), mode="w+", dtype=np.dtype(dtype), shape=(count, dim)
+    )
+    norms = np.empty(count, dtype=np.float32)
+
+    written = 0
+    with open(os.path.join(path, "metadata.jsonl"), "w") as f:
+        for metadata, embedding in rows:
+            matrix[written] = embedding
+            # Norms are computed from the stored precision so distances stay consistent
+            stored = np.asarray(matrix[written], dtype=np.float32)
+            norms[written] = stored @ stored
+            f.write(json.dumps(metadata) + "\n")
+            written += 1
+
+    if written != count:
+        raise ValueError(f"Expected {count} rows but exported {written}")
+
+    matrix.flush()
+    np.save(os.path.join(path, "norms.npy"), norms)
+    with open(os.path.join(path, "manifest.json"), "w") as f:
+        json.dump({"count": count, "dim": dim, "dtype": dtype, "version": version}, f)
+
+
+_backend: Optional[RetrievalBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> RetrievalBackend:
+    """Return the process-wide retrieval backend selected by RETRIEVAL_BACKEND"""
+
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                name = os.getenv("RETRIEVAL_BACKEND", "pgvector")
+                if name == "pgvector":
+                    _backend = PgVectorBackend(float(os.getenv("KB_VERSION_CHECK_INTERVAL", "30")))
+                elif name == "numpy":
+                    _backend = NumpyVectorBackend(os.getenv("VECTOR_STORE_PATH", "vector_store"))
+                else:
+                    raise ValueError(f"Unknown retrieval backend '{name}', expected 'pgvector' or 'numpy'")
+    return _backend